@@ -0,0 +1,105 @@
+import os
+import shutil
+import subprocess
+
+import aiohttp
+from aiohttp import web
+import pytest
+import pytest_asyncio
+
+from truenas_installer.server import InstallerRPCServer
+
+
+@pytest_asyncio.fixture
+async def start_rpc_server():
+    """
+    Starts in-process RPC servers that check method results against their schemas. Returns the server and its URL.
+    """
+    runners = []
+
+    async def start():
+        server = InstallerRPCServer(None, validate_results=True)
+        app = web.Application()
+        app.router.add_routes([
+            web.get("/", server.handle_http_request),
+            web.get("/metrics", server.handle_metrics),
+        ])
+        app.on_shutdown.append(server.on_shutdown)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        runners.append(runner)
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        return server, f"http://{host}:{port}/"
+
+    try:
+        yield start
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+@pytest_asyncio.fixture
+async def rpc_server(start_rpc_server):
+    return await start_rpc_server()
+
+
+@pytest_asyncio.fixture
+async def rpc_ws(rpc_server):
+    """
+    A websocket connected to `rpc_server`.
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(rpc_server[1]) as ws:
+            yield ws
+
+
+class LoopDevices:
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.devices = []
+
+    def __call__(self, size: int = 1024 ** 3, path=None) -> str:
+        """
+        Attaches a loop device (with partition scanning) to `path` and returns its path. `path` defaults to a new
+        image file, it is created with `size` bytes (sparse) unless it already exists.
+        """
+        if path is None:
+            path = self.tmp_path / f"loop{len(self.devices)}.img"
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.truncate(size)
+
+        try:
+            device = subprocess.run(["losetup", "-f", "-P", "--show", str(path)], check=True, capture_output=True,
+                                    text=True).stdout.strip()
+        except subprocess.CalledProcessError as e:
+            pytest.skip(f"Unable to set up a loop device: {e.stderr}")
+
+        self.devices.append(device)
+        return device
+
+    def detach(self, *devices: str):
+        """
+        Detaches `devices` (all attached devices by default) before the test ends.
+        """
+        for device in devices or list(self.devices):
+            self.devices.remove(device)
+            subprocess.run(["losetup", "-d", device])
+
+
+@pytest.fixture
+def loop_device(tmp_path):
+    """
+    Attaches loop devices to image files: `loop_device(size)` or `loop_device(path=image)` returns the device path.
+    They are detached when the test ends. Skips the test unless it runs as root and losetup is installed.
+    """
+    if os.geteuid() != 0 or shutil.which("losetup") is None:
+        pytest.skip("Requires root and losetup")
+
+    loop_devices = LoopDevices(tmp_path)
+    try:
+        yield loop_devices
+    finally:
+        loop_devices.detach()
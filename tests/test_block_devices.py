@@ -0,0 +1,479 @@
+import json
+import os
+import struct
+import subprocess
+import time
+import uuid
+import zlib
+
+import pytest
+
+from truenas_installer import blkid, block_devices
+from truenas_installer.block_devices import list_block_devices
+from truenas_installer.disks import ZFSMember, disks_from_block_devices
+from truenas_installer.gpt import GPTPartition, build_partition_table, reread_partition_table
+
+MiB = 1024 * 1024
+GiB = 1024 * MiB
+LINUX_FILESYSTEM = "0FC63DAF-8483-4772-8E79-3D69D8477DE4"
+
+
+def crc32c(data):
+    crc = 0xffffffff
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ (0x82f63b78 if crc & 1 else 0)
+    return crc ^ 0xffffffff
+
+
+def ext(label, compat, incompat, ro_compat):
+    sb = bytearray(1024)
+    struct.pack_into("<IIIIIII", sb, 0, 16384, 65536, 0, 60000, 16000, 0, 2)
+    struct.pack_into("<IIII", sb, 0x20, 32768, 32768, 8192, 0)
+    struct.pack_into("<HHHHH", sb, 0x38, 0xef53, 1, 1, 0, 0)
+    struct.pack_into("<I", sb, 0x4c, 1)
+    struct.pack_into("<III", sb, 0x5c, compat, incompat, ro_compat)
+    sb[0x68:0x78] = uuid.uuid4().bytes
+    sb[0x78:0x88] = label.encode().ljust(16, b"\0")
+    return [(1024, sb)]
+
+
+def xfs(label, size):
+    sb = bytearray(512)
+    blocks = size // 4096
+    struct.pack_into(">4sIQQQ", sb, 0, b"XFSB", 4096, blocks, 0, 0)
+    sb[32:48] = uuid.uuid4().bytes
+    struct.pack_into(">QQQQIIIII", sb, 48, 0, 128, 129, 130, 1, blocks // 4, 4, 0, 1024)
+    struct.pack_into(">HHHH", sb, 100, 0x34b4, 512, 512, 8)
+    sb[108:120] = label.encode().ljust(12, b"\0")
+    sb[120:128] = bytes([12, 9, 9, 3, 14, 0, 0, 25])
+    return [(0, sb)]
+
+
+def vfat(label, size, directory_label=None):
+    sector = bytearray(512)
+    sectors = size // 512
+    sector[0:11] = b"\xeb\x3c\x90MSDOS5.0"
+    struct.pack_into("<HBHBHHBHHHII", sector, 0x0b, 512, 4, 4, 2, 512, 0, 0xf8, 128, 32, 64, 0, sectors)
+    struct.pack_into("<BBBI", sector, 0x24, 0x80, 0, 0x29, 0x12345678)
+    sector[0x2b:0x36] = label.encode().ljust(11)
+    sector[0x36:0x3e] = b"FAT16   "
+    sector[510:512] = b"\x55\xaa"
+    writes = [(0, sector)]
+    if directory_label is not None:
+        entry = bytearray(32)
+        entry[:11] = directory_label.encode().ljust(11)
+        entry[11] = 0x08
+        writes.append(((4 + 2 * 128) * 512, entry))
+    return writes
+
+
+def swap(label, size):
+    header = bytearray(4096)
+    struct.pack_into("<III", header, 1024, 1, size // 4096 - 1, 0)
+    header[1036:1052] = uuid.uuid4().bytes
+    header[1052:1068] = label.encode().ljust(16, b"\0")
+    header[4086:4096] = b"SWAPSPACE2"
+    return [(0, header)]
+
+
+def luks2(label):
+    header = bytearray(4096)
+    struct.pack_into(">6sHQQ", header, 0, b"LUKS\xba\xbe", 2, 16384, 1)
+    header[24:72] = label.encode().ljust(48, b"\0")
+    header[72:78] = b"sha256"
+    header[168:204] = str(uuid.uuid4()).encode()
+    struct.pack_into(">Q", header, 256, 0)
+    return [(0, header)]
+
+
+def lvm2():
+    sector = bytearray(512)
+    sector[0:8] = b"LABELONE"
+    struct.pack_into("<QII8s", sector, 8, 1, 0, 32, b"LVM2 001")
+    sector[32:64] = b"0123456789abcdefghijklmnopqrstuv"
+    crc = ~zlib.crc32(bytes(sector[20:]), ~0xf597a6cf & 0xffffffff) & 0xffffffff
+    struct.pack_into("<I", sector, 16, crc)
+    return [(512, sector)]
+
+
+def linux_raid(name, size):
+    sb = bytearray(256 + 2 * 2)
+    struct.pack_into("<IIII", sb, 0, 0xa92b4efc, 1, 0, 0)
+    sb[16:32] = uuid.uuid4().bytes
+    sb[32:64] = name.encode().ljust(32, b"\0")
+    struct.pack_into("<QIIQII", sb, 64, int(time.time()), 1, 0, (size - MiB) // 512, 0, 2)
+    struct.pack_into("<QQQ", sb, 128, 2048, (size - MiB) // 512, 8)
+    struct.pack_into("<I", sb, 220, 2)
+    csum = sum(struct.unpack_from(f"<{len(sb) // 4}I", sb))
+    struct.pack_into("<I", sb, 216, ((csum & 0xffffffff) + (csum >> 32)) & 0xffffffff)
+    return [(4096, sb)]
+
+
+def iso9660(label):
+    primary = bytearray(2048)
+    primary[0:7] = b"\x01CD001\x01"
+    primary[8:40] = b"LINUX".ljust(32)
+    primary[40:72] = label.encode().ljust(32)
+    struct.pack_into("<I", primary, 80, 1024)
+    struct.pack_into(">I", primary, 84, 1024)
+    struct.pack_into("<H", primary, 128, 2048)
+    struct.pack_into(">H", primary, 130, 2048)
+    terminator = bytearray(2048)
+    terminator[0:7] = b"\xffCD001\x01"
+    return [(32768, primary), (34816, terminator)]
+
+
+def btrfs(label, size):
+    sb = bytearray(4096)
+    sb[32:48] = uuid.uuid4().bytes
+    struct.pack_into("<QQ8sQ", sb, 48, 65536, 0, b"_BHRfS_M", 1)
+    struct.pack_into("<QQ", sb, 112, size, 0)
+    struct.pack_into("<IIII", sb, 144, 4096, 16384, 4096, 4096)
+    sb[0x12b:0x12b + 256] = label.encode().ljust(256, b"\0")
+    struct.pack_into("<I", sb, 0, crc32c(sb[32:]))
+    return [(65536, sb)]
+
+
+def exfat(label, size):
+    boot = bytearray(512 * 12)
+    sector = memoryview(boot)[:512]
+    sector[0:11] = b"\xeb\x76\x90EXFAT   "
+    struct.pack_into("<QQIIIIIIHHBBBBB", sector, 64, 0, size // 512, 24, 64, 128, (size // 512 - 128) // 8, 5,
+                     0x12345678, 0x100, 0, 9, 3, 1, 0x80, 0)
+    sector[510:512] = b"\x55\xaa"
+    checksum = 0
+    for i, byte in enumerate(boot[:512 * 11]):
+        if i not in (106, 107, 112):
+            checksum = (((checksum & 1) << 31) + (checksum >> 1) + byte) & 0xffffffff
+    boot[512 * 11:] = struct.pack("<I", checksum) * 128
+    entry = bytearray(32)
+    entry[0] = 0x83
+    entry[1] = len(label)
+    entry[2:2 + 2 * len(label)] = label.encode("utf-16-le")
+    return [(0, boot), ((128 + 3 * 8) * 512, entry)]
+
+
+def ntfs(label, size):
+    sector = bytearray(512)
+    sector[0:11] = b"\xeb\x52\x90NTFS    "
+    struct.pack_into("<HBHBHHBHHHII", sector, 0x0b, 512, 8, 0, 0, 0, 0, 0xf8, 0, 63, 255, 0, 0)
+    struct.pack_into("<IQQQb", sector, 0x24, 0x800080, size // 512 - 1, 4, 2, -10)
+    struct.pack_into("<bQ", sector, 0x44, 1, 0x1234567890)
+    sector[510:512] = b"\x55\xaa"
+
+    def record(attributes=b""):
+        record = bytearray(1024)
+        struct.pack_into("<4sHHQHHHHII", record, 0, b"FILE", 0x30, 3, 0, 1, 1, 0x38, 1, 0x38 + len(attributes) + 8,
+                         1024)
+        record[0x38:0x38 + len(attributes)] = attributes
+        struct.pack_into("<I", record, 0x38 + len(attributes), 0xffffffff)
+        return record
+
+    value = label.encode("utf-16-le")
+    attribute = bytearray(24 + (len(value) + 7) // 8 * 8)
+    struct.pack_into("<IIBBHHHIH", attribute, 0, 0x60, len(attribute), 0, 0, 0x18, 0, 0, len(value), 0x18)
+    attribute[24:24 + len(value)] = value
+    return [(0, sector), (4 * 4096, record()), (4 * 4096 + 3 * 1024, record(bytes(attribute)))]
+
+
+def pack_nvlist(nvlist, top=True):
+    def string(value):
+        value = value.encode()
+        return struct.pack(">I", len(value)) + value.ljust((len(value) + 3) // 4 * 4, b"\0")
+
+    data = (b"\x01\x01\0\0" if top else b"") + struct.pack(">ii", 0, 1)
+    for name, value in nvlist.items():
+        nested = b""
+        if isinstance(value, str):
+            pair = string(name) + struct.pack(">ii", 9, 1) + string(value)
+        elif isinstance(value, dict):
+            pair = string(name) + struct.pack(">ii", 19, 1)
+            nested = pack_nvlist(value, False)
+        else:
+            pair = string(name) + struct.pack(">iiQ", 8, 1, value)
+        data += struct.pack(">ii", 8 + len(pair), 8 + len(pair)) + pair + nested
+
+    return data + struct.pack(">ii", 0, 0)
+
+
+def zfs(pool, size):
+    nvlist = pack_nvlist({
+        "version": 5000,
+        "name": pool,
+        "state": 0,
+        "txg": 4,
+        "pool_guid": 0x1234567890abcdef,
+        "hostid": 0x12345678,
+        "hostname": "truenas",
+        "top_guid": 0x1111,
+        "guid": 0x1111,
+        "vdev_children": 1,
+        "vdev_tree": {"type": "disk", "id": 0, "guid": 0x1111, "path": "/dev/sda3"},
+    })
+    uberblock = struct.pack("<QQQQQ", 0x00bab10c, 5000, 4, 0, int(time.time()))
+    writes = []
+    aligned = size // (256 * 1024) * (256 * 1024)
+    for label in [0, 256 * 1024, aligned - 512 * 1024, aligned - 256 * 1024]:
+        writes.append((label + 16 * 1024, nvlist))
+        for i in range(0, 128, 4):
+            writes.append((label + 128 * 1024 + i * 1024, uberblock))
+    return writes
+
+
+# name: (size, whole disk contents or partitions)
+DISKS = {
+    "sda": (10 * GiB, [
+        (32 * MiB, lambda size: ext("root", 0x3c, 0x2c2, 0x7b)),
+        (16 * MiB, lambda size: swap("swap0", size)),
+        (None, lambda size: zfs("boot-pool", size)),
+    ]),
+    "sdb": (9 * GiB, lambda size: xfs("data", size)),
+    "sdc": (10 * GiB, [
+        (64 * MiB, lambda size: vfat("BOOTLABEL", size)),
+        (32 * MiB, lambda size: vfat("NO NAME", size, "DIRLABEL")),
+        (32 * MiB, lambda size: exfat("Exchange", size)),
+        (None, lambda size: ntfs("Windows", size)),
+    ]),
+    "sdd": (64 * MiB, [
+        (16 * MiB, lambda size: linux_raid("truenas:0", size)),
+        (16 * MiB, lambda size: lvm2()),
+        (None, lambda size: luks2("secret")),
+    ]),
+    "sde": (32 * MiB, lambda size: iso9660("TRUENAS_SCALE")),
+    "sdf": (10 * GiB, [
+        (32 * MiB, lambda size: ext("old", 0x3c, 0x2, 0x3)),
+        (32 * MiB, lambda size: ext("older", 0x38, 0x2, 0x3)),
+        (None, lambda size: btrfs("pool", size)),
+    ]),
+    "sdg": (16 * MiB, []),
+}
+
+# `lsblk -b -fJ -o name,fstype,label,rm,size,model` for loop devices with the contents above (see `build_disk`),
+# with loop device names replaced
+RECORDED_LSBLK = json.loads("""
+{"blockdevices": [
+{"name": "sda", "fstype": null, "label": null, "rm": false, "size": 10737418240, "model": null, "children": [
+    {"name": "sda1", "fstype": "ext4", "label": "root", "rm": false, "size": 33554432, "model": null},
+    {"name": "sda2", "fstype": "swap", "label": "swap0", "rm": false, "size": 16777216, "model": null},
+    {"name": "sda3", "fstype": "zfs_member", "label": "boot-pool", "rm": false, "size": 10684989440, "model": null}
+]},
+{"name": "sdb", "fstype": "xfs", "label": "data", "rm": false, "size": 9663676416, "model": null},
+{"name": "sdc", "fstype": null, "label": null, "rm": false, "size": 10737418240, "model": null, "children": [
+    {"name": "sdc1", "fstype": "vfat", "label": null, "rm": false, "size": 67108864, "model": null},
+    {"name": "sdc2", "fstype": "vfat", "label": "DIRLABEL", "rm": false, "size": 33554432, "model": null},
+    {"name": "sdc3", "fstype": "exfat", "label": "Exchange", "rm": false, "size": 33554432, "model": null},
+    {"name": "sdc4", "fstype": "ntfs", "label": "Windows", "rm": false, "size": 10601103360, "model": null}
+]},
+{"name": "sdd", "fstype": null, "label": null, "rm": false, "size": 67108864, "model": null, "children": [
+    {"name": "sdd1", "fstype": "linux_raid_member", "label": "truenas:0", "rm": false, "size": 16777216, "model": null},
+    {"name": "sdd2", "fstype": "LVM2_member", "label": null, "rm": false, "size": 16777216, "model": null},
+    {"name": "sdd3", "fstype": "crypto_LUKS", "label": "secret", "rm": false, "size": 31457280, "model": null}
+]},
+{"name": "sde", "fstype": "iso9660", "label": "TRUENAS_SCALE", "rm": false, "size": 33554432, "model": null},
+{"name": "sdf", "fstype": null, "label": null, "rm": false, "size": 10737418240, "model": null, "children": [
+    {"name": "sdf1", "fstype": "ext3", "label": "old", "rm": false, "size": 33554432, "model": null},
+    {"name": "sdf2", "fstype": "ext2", "label": "older", "rm": false, "size": 33554432, "model": null},
+    {"name": "sdf3", "fstype": "btrfs", "label": "pool", "rm": false, "size": 10668212224, "model": null}
+]},
+{"name": "sdg", "fstype": null, "label": null, "rm": false, "size": 16777216, "model": null}
+]}
+""")
+
+
+def write(fd, writes, base=0):
+    for offset, data in writes:
+        os.pwrite(fd, data, base + offset)
+
+
+def build_disk(path, size, contents):
+    """
+    Writes the disk image, returns `(start, size, writes)` of its partitions.
+    """
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+    fd = os.open(path, os.O_RDWR)
+    try:
+        if callable(contents):
+            write(fd, contents(size))
+            return []
+
+        if not contents:
+            return []
+
+        total_sectors = size // 512
+        partitions = []
+        start = 2048
+        for number, (part_size, _) in enumerate(contents, start=1):
+            if part_size:
+                end = start + part_size // 512 - 1
+            else:
+                # Up to the last aligned sector before the backup GPT
+                end = (total_sectors - 34) // 2048 * 2048 - 1
+            partitions.append(GPTPartition(number, start, end, LINUX_FILESYSTEM, f"part{number}"))
+            start = end + 1
+
+        primary, backup = build_partition_table(total_sectors, 512, partitions, False)
+        os.pwrite(fd, primary, 0)
+        os.pwrite(fd, backup, size - len(backup))
+
+        result = []
+        for partition, (_, fn) in zip(partitions, contents):
+            part_start = partition.first_lba * 512
+            part_size = (partition.last_lba - partition.first_lba + 1) * 512
+            writes = fn(part_size)
+            write(fd, writes, part_start)
+            result.append((part_start, part_size, writes))
+
+        return result
+    finally:
+        os.close(fd)
+
+
+def build_tree(root, disks=DISKS, removable=False, model=None):
+    """
+    Builds fake `/sys/block` and `/dev` trees for the disks.
+    """
+    sys_block = root / "sys" / "block"
+    dev = root / "dev"
+    dev.mkdir(parents=True)
+    for i, (name, (size, contents)) in enumerate(disks.items()):
+        path = sys_block / name
+        (path / "slaves").mkdir(parents=True)
+        (path / "holders").mkdir()
+        (path / "dev").write_text(f"8:{i * 16}\n")
+        (path / "size").write_text(f"{size // 512}\n")
+        (path / "removable").write_text(f"{int(removable)}\n")
+        if model is not None:
+            (path / "device").mkdir()
+            (path / "device" / "model").write_text(f"{model}\n")
+
+        for number, (start, part_size, writes) in enumerate(build_disk(dev / name, size, contents), start=1):
+            part = path / f"{name}{number}"
+            (part / "holders").mkdir(parents=True)
+            (part / "dev").write_text(f"8:{i * 16 + number}\n")
+            (part / "partition").write_text(f"{number}\n")
+            (part / "start").write_text(f"{start // 512}\n")
+            (part / "size").write_text(f"{part_size // 512}\n")
+            with open(dev / f"{name}{number}", "wb") as f:
+                f.truncate(part_size)
+                write(f.fileno(), writes)
+
+    return str(sys_block), str(dev)
+
+
+@pytest.mark.asyncio
+async def test__equivalent_to_lsblk(tmp_path):
+    sys_block, dev = build_tree(tmp_path)
+    assert await list_block_devices(sys_block, dev) == RECORDED_LSBLK["blockdevices"]
+
+
+@pytest.mark.asyncio
+async def test__disks(tmp_path):
+    sys_block, dev = build_tree(tmp_path)
+    disks = disks_from_block_devices(await list_block_devices(sys_block, dev), {})
+    assert disks == disks_from_block_devices(RECORDED_LSBLK["blockdevices"], {})
+    assert [(disk.name, disk.label, disk.zfs_members) for disk in disks] == [
+        ("sda", "zfs-\"boot-pool\"", [ZFSMember("sda3", "boot-pool")]),
+        ("sdb", "xfs", []),
+        ("sdc", "vfat", []),
+        ("sdf", "ext3-old", []),
+    ]
+
+
+@pytest.mark.asyncio
+async def test__sysfs_attributes(tmp_path):
+    sys_block, dev = build_tree(tmp_path, {"sda": DISKS["sda"]}, removable=True, model="Flash Drive")
+    # A device-mapper device on top of the first partition
+    os.makedirs(f"{sys_block}/dm-0/slaves/sda1")
+    os.makedirs(f"{sys_block}/dm-0/holders")
+    os.makedirs(f"{sys_block}/sda/sda1/holders/dm-0")
+    for name, value in [("dev", "253:0"), ("size", "65536"), ("removable", "0")]:
+        with open(f"{sys_block}/dm-0/{name}", "w") as f:
+            f.write(f"{value}\n")
+
+    [sda] = await list_block_devices(sys_block, dev)
+    assert (sda["rm"], sda["model"]) == (True, "Flash Drive")
+    assert [(child["name"], child["rm"], child["model"]) for child in sda["children"]] == [
+        ("sda1", True, None),
+        ("sda2", True, None),
+        ("sda3", True, None),
+    ]
+    assert [child["name"] for child in sda["children"][0]["children"]] == ["dm-0"]
+
+
+@pytest.mark.asyncio
+async def test__live(tmp_path, loop_device):
+    loop_devices = []
+    for name, (size, contents) in DISKS.items():
+        build_disk(tmp_path / name, size, contents)
+        device = loop_device(path=tmp_path / name)
+        loop_devices.append(device)
+        if contents and not callable(contents):
+            fd = os.open(device, os.O_RDONLY)
+            try:
+                reread_partition_table(fd)
+            finally:
+                os.close(fd)
+
+    names = {os.path.basename(device) for device in loop_devices}
+    native = [device for device in await list_block_devices() if device["name"] in names]
+    assert [(device["name"], device["size"], len(device.get("children", []))) for device in native] == [
+        (device["name"], device["size"], len(device.get("children", [])))
+        for device in json.loads(subprocess.run(
+            ["lsblk", "-b", "-fJ", "-o", "name,fstype,label,rm,size,model", *loop_devices],
+            capture_output=True, text=True, check=True,
+        ).stdout)["blockdevices"]
+    ]
+    assert [
+        (child["fstype"], child["label"])
+        for device in native
+        for child in [device] + device.get("children", [])
+        if child["fstype"] is not None
+    ] == [
+        (child["fstype"], child["label"])
+        for device in RECORDED_LSBLK["blockdevices"]
+        for child in [device] + device.get("children", [])
+        if child["fstype"] is not None
+    ]
+
+
+@pytest.mark.asyncio
+async def test__benchmark(tmp_path, monkeypatch):
+    """
+    Enumerates a few hundred disks, with every read taking as long as a seek on a spinning disk would.
+    """
+    count = 200
+    latency = 0.0005
+    disks = {
+        f"sd{i:03}": (16 * GiB, [(1 * MiB, lambda size: []), (None, lambda size: zfs("tank", size))])
+        for i in range(count)
+    }
+    sys_block, dev = build_tree(tmp_path, disks)
+
+    read = blkid._Device.read
+
+    def slow_read(self, offset, length):
+        time.sleep(latency)
+        return read(self, offset, length)
+
+    monkeypatch.setattr(blkid._Device, "read", slow_read)
+
+    results = []
+    for threads in [1, block_devices.PROBE_THREADS]:
+        monkeypatch.setattr(block_devices, "PROBE_THREADS", threads)
+        start = time.monotonic()
+        devices = await list_block_devices(sys_block, dev)
+        results.append((threads, time.monotonic() - start))
+        assert len(devices) == count
+        assert all(device["children"][1]["label"] == "tank" for device in devices)
+
+    print()
+    print(f"{count} disks ({count * 3} devices), {latency * 1000:g} ms per read")
+    print(f"{'threads':>8} {'seconds':>8}")
+    for threads, seconds in results:
+        print(f"{threads:>8} {seconds:>8.2f}")
+
+    assert results[1][1] < results[0][1]
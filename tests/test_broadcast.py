@@ -0,0 +1,92 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from truenas_installer.server.api.install import callback
+from truenas_installer.server.broadcast import BroadcastHub
+
+
+class Server:
+    def json_serialize(self, data):
+        return data["params"][0]["message"]
+
+
+class Websocket:
+    def __init__(self, stalled=False):
+        self.closed = False
+        self.received = []
+        self.stalled = asyncio.Event()
+        if not stalled:
+            self.stalled.set()
+
+    async def send_str(self, data):
+        await self.stalled.wait()
+        self.received.append(data)
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test__slow_client():
+    hub = BroadcastHub(Server(), queue_size=4, replay_size=3)
+    fast = Websocket()
+    slow = Websocket(stalled=True)
+    hub.subscribe(fast)
+    hub.subscribe(slow)
+
+    async def publish(message, key=None):
+        hub.publish("installation_progress", {"progress": 0, "message": message}, key)
+        await settle()
+
+    await publish("Formatting disk sda")
+    # `slow` is now stuck sending the first message
+    for progress in range(10):
+        await publish(f"Installing {progress * 10}%", "Installing")
+    for message in ["a", "b", "c", "d"]:
+        await publish(message)
+
+    assert fast.received == ["Formatting disk sda"] + [f"Installing {progress * 10}%" for progress in range(10)] + [
+        "a", "b", "c", "d",
+    ]
+    assert [stats["queued"] for stats in hub.stats()] == [0, 4]
+    assert hub.stats()[1]["coalesced"] == 9
+    assert hub.stats()[1]["dropped"] == 1
+
+    slow.stalled.set()
+    await settle()
+    assert slow.received == ["Formatting disk sda", "a", "b", "c", "d"]
+    assert hub.stats()[1]["sent"] == 5
+
+    # Late clients get the most recent messages
+    late = Websocket()
+    hub.subscribe(late)
+    await settle()
+    assert late.received == ["b", "c", "d"]
+
+    slow.closed = True
+    assert len(hub.stats()) == 2
+    hub.close()
+
+
+@pytest.mark.asyncio
+async def test__replay(rpc_server):
+    server, url = rpc_server
+    callback(server, 0, "Formatting disk sda")
+    callback(server, 0.1, "Installing")
+    callback(server, 0.2, "Installing")
+
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url) as ws:
+            messages = [await asyncio.wait_for(ws.receive_json(), 5) for _ in range(2)]
+            assert [message["params"][0] for message in messages] == [
+                {"progress": 0, "message": "Formatting disk sda"},
+                {"progress": 0.2, "message": "Installing"},
+            ]
+
+            await ws.send_json({"jsonrpc": "2.0", "id": 1, "method": "progress_clients", "params": []})
+            clients = (await asyncio.wait_for(ws.receive_json(), 5))["result"]
+            assert [(client["sent"], client["queued"]) for client in clients] == [(2, 0)]
@@ -0,0 +1,69 @@
+import os
+
+from truenas_installer.busy import busy_disks
+from truenas_installer.disks import disks_from_block_devices
+
+MOUNTINFO = """\
+22 1 8:2 / / rw,relatime shared:1 - ext4 /dev/sda2 rw
+23 22 0:22 / /proc rw,relatime shared:2 - proc proc rw
+24 22 8:2 /srv /mnt/with\\040space rw,relatime shared:1 - ext4 /dev/sda2 rw
+25 22 0:40 / /mnt/btrfs rw,relatime shared:3 - btrfs /dev/sdb1 rw
+26 22 0:41 / /mnt/nfs rw,relatime shared:4 - nfs server:/export rw
+"""
+
+SWAPS = """\
+Filename\t\t\t\tType\t\tSize\t\tUsed\t\tPriority
+/dev/sdc1                               partition\t2097148\t\t0\t\t-2
+/swapfile                               file\t\t1048572\t\t0\t\t-3
+"""
+
+
+def build_tree(tmp_path):
+    proc = tmp_path / "proc"
+    (proc / "self").mkdir(parents=True)
+    (proc / "self" / "mountinfo").write_text(MOUNTINFO)
+    (proc / "swaps").write_text(SWAPS)
+
+    sys_block = tmp_path / "sys" / "block"
+    for major, (disk, partitions) in enumerate({
+        "sda": [1, 2],
+        "sdb": [1],
+        "sdc": [1],
+        "sdd": [1, 2],
+        "sde": [],
+        "md127": [],
+    }.items()):
+        (sys_block / disk / "holders").mkdir(parents=True)
+        (sys_block / disk / "dev").write_text(f"8:{major * 16}\n")
+        for number in partitions:
+            partition = sys_block / disk / f"{disk}{number}"
+            (partition / "holders").mkdir(parents=True)
+            (partition / "partition").write_text(f"{number}\n")
+            (partition / "dev").write_text(f"8:{major * 16 + number}\n")
+
+    os.mkdir(sys_block / "sdd" / "sdd2" / "holders" / "md127")
+    os.mkdir(sys_block / "sde" / "holders" / "dm-0")
+
+    return str(proc), str(sys_block)
+
+
+def test__busy_disks(tmp_path):
+    assert busy_disks(*build_tree(tmp_path)) == {
+        "sda": ["sda2 is mounted at /", "sda2 is mounted at /mnt/with space"],
+        "sdb": ["sdb1 is mounted at /mnt/btrfs"],
+        "sdc": ["sdc1 is used as swap"],
+        "sdd": ["sdd2 is used by md127"],
+        "sde": ["sde is used by dm-0"],
+    }
+
+
+def test__busy_reasons_listed(tmp_path):
+    disks = disks_from_block_devices([
+        {"name": name, "fstype": None, "label": None, "rm": False, "size": 16 * 1024 ** 3, "model": None}
+        for name in ["sda", "sdf"]
+    ], busy_disks(*build_tree(tmp_path)))
+
+    assert [(disk.name, disk.busy_reasons) for disk in disks] == [
+        ("sda", ["sda2 is mounted at /", "sda2 is mounted at /mnt/with space"]),
+        ("sdf", []),
+    ]
@@ -0,0 +1,110 @@
+import io
+import subprocess
+import time
+from unittest.mock import patch
+
+import pytest
+
+from truenas_installer.cassette import Cassette, CassetteError, recording, replaying
+from truenas_installer.install import run_installer
+from truenas_installer.serial import serial_sql
+from truenas_installer.utils import run, run_lines
+
+
+def not_executed(*args, **kwargs):
+    raise AssertionError("Command was executed while replaying")
+
+
+@pytest.mark.asyncio
+async def test__record_replay(tmp_path):
+    path = str(tmp_path / "cassette.json")
+    with recording(path):
+        assert (await run(["echo", "hello"])).stdout == "hello\n"
+        assert (await run(["sh", "-c", "echo world; echo error >&2; exit 3"], check=False)).returncode == 3
+
+    with patch("asyncio.create_subprocess_exec", not_executed):
+        with replaying(path):
+            result = await run(["echo", "hello"])
+            assert result.stdout == "hello\n"
+            assert result.returncode == 0
+
+            with pytest.raises(subprocess.CalledProcessError) as e:
+                await run(["sh", "-c", "echo world; echo error >&2; exit 3"])
+            assert (e.value.returncode, e.value.stdout, e.value.stderr) == (3, "world\n", "error\n")
+
+            with pytest.raises(CassetteError):
+                await run(["echo", "goodbye"])
+
+
+@pytest.mark.asyncio
+async def test__recording_is_saved_after_every_command(tmp_path):
+    path = str(tmp_path / "cassette.json")
+    with recording(path):
+        await run(["echo", "hello"])
+        # The system may be rebooted before the recording ends
+        assert [interaction["args"] for interaction in Cassette.load(path).interactions] == [["echo", "hello"]]
+
+
+@pytest.mark.asyncio
+async def test__replay_order():
+    cassette = Cassette([
+        {"args": ["zpool", "status"], "returncode": 1, "stdout": "", "stderr": "no pools", "duration": 0},
+        {"args": ["zpool", "status"], "returncode": 0, "stdout": "ONLINE", "stderr": "", "duration": 0},
+    ])
+    with replaying(cassette):
+        assert [(await run(["zpool", "status"], check=False)).stdout for _ in range(3)] == ["", "ONLINE", ""]
+
+
+@pytest.mark.asyncio
+async def test__replay_delays():
+    cassette = Cassette([{"args": ["sleep", "1"], "returncode": 0, "stdout": "", "stderr": "", "duration": 0.2}])
+    for delays, expected in [(False, (0, 0.1)), (True, (0.2, 1))]:
+        with replaying(cassette, delays=delays):
+            start = time.monotonic()
+            await run(["sleep", "1"])
+            assert expected[0] <= time.monotonic() - start < expected[1]
+
+
+@pytest.mark.asyncio
+async def test__replay_serial_sql():
+    cassette = Cassette([
+        {"args": ["dmesg"], "returncode": 0, "stderr": "", "duration": 0,
+         "stdout": "[    0.613041] 00:07: ttyS0 at I/O 0x3f8 (irq = 4, base_baud = 115200) is a 16550"},
+        {"args": ["setserial", "-G", "/dev/ttyS0"], "returncode": 0, "stderr": "", "duration": 0,
+         "stdout": "/dev/ttyS0 uart 16550A port 0x03f8 irq 4 baud_base 115200 spd_normal skip_test"},
+    ])
+    with patch("truenas_installer.serial.open", lambda path: io.StringIO("console=ttyS")):
+        with replaying(cassette):
+            assert await serial_sql() == ("update system_advanced set adv_serialconsole = 1;"
+                                          "update system_advanced set adv_serialport = 'ttyS0';"
+                                          "update system_advanced set adv_serialspeed = 115200;")
+
+
+@pytest.mark.asyncio
+async def test__record_replay_lines(tmp_path):
+    path = str(tmp_path / "cassette.json")
+    args = ["sh", "-c", "cat; echo; echo error >&2; exit 1"]
+    with recording(path):
+        lines = []
+        assert await run_lines(args, lines.append, b"hello") == 1
+        assert lines == ["hello\n", "error\n"]
+
+    with patch("asyncio.create_subprocess_exec", not_executed):
+        with replaying(path):
+            lines = []
+            assert await run_lines(args, lines.append, b"goodbye") == 1
+            assert lines == ["hello\n", "error\n"]
+
+
+@pytest.mark.asyncio
+async def test__replay_installer():
+    cassette = Cassette([{
+        "args": ["python3", "-m", "truenas_install"], "returncode": 0, "stderr": "", "duration": 0,
+        "stdout": '{"progress": 0.5, "message": "Extracting"}\n{"progress": 1, "message": "Done"}\n',
+    }])
+    progress = []
+    with patch("asyncio.create_subprocess_exec", not_executed):
+        with replaying(cassette):
+            await run_installer(["sda"], None, None, "", "/nonexistent", lambda *args: progress.append(args))
+
+    assert progress == [(0.5, "Extracting"), (1, "Done")]
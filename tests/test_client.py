@@ -0,0 +1,126 @@
+import asyncio
+import errno
+
+import pytest
+
+from truenas_installer.client import ClientPool, ConnectionClosed, RPCError, install_many
+from truenas_installer.lock import InstallationLock
+from truenas_installer.server.api import install as install_api
+
+SERVERS = 24
+
+
+class MachineLock(InstallationLock):
+    # Every in-process server stands for a different machine, none of them is ever locked by another one
+    def locked(self):
+        return False
+
+
+@pytest.fixture
+def backend(monkeypatch, tmp_path):
+    state = {"running": 0, "max_running": 0}
+
+    async def install_disks(params):
+        return params["disks"], []
+
+    async def serial_sql():
+        return ""
+
+    async def install(destination_disks, wipe_disks, set_pmbr, authentication, post_install, sql, callback,
+                      dry_run, discard):
+        state["running"] += 1
+        state["max_running"] = max(state["max_running"], state["running"])
+        try:
+            for progress in [0.25, 0.5, 1]:
+                await asyncio.sleep(0.01)
+                callback(progress, f"Installing to {destination_disks[0]}")
+
+            if destination_disks == ["bad"]:
+                raise install_api.InstallError("Failed to format bad")
+        finally:
+            state["running"] -= 1
+
+    monkeypatch.setattr(install_api, "_install_disks", install_disks)
+    monkeypatch.setattr(install_api, "serial_sql", serial_sql)
+    monkeypatch.setattr(install_api, "install_", install)
+    lock = MachineLock()
+    lock.path = tmp_path / "lock"
+    monkeypatch.setattr(install_api, "installation_lock", lock)
+    return state
+
+
+@pytest.mark.asyncio
+async def test__install_many(backend, start_rpc_server):
+    urls = [(await start_rpc_server())[1] for _ in range(SERVERS)]
+    params = {url: {"disks": ["bad" if i == 3 else f"sd{i}"], "set_pmbr": False, "authentication": None}
+              for i, url in enumerate(urls)}
+    progress = {}
+
+    async with ClientPool() as pool:
+        pool.add_listener("installation_progress", lambda host, params: progress.setdefault(host, []).append(params))
+        results = await install_many(pool, params, concurrency=5)
+
+        assert len(pool.clients) == SERVERS
+
+    assert backend["max_running"] <= 5
+    assert [url for url, result in results.items() if not result.succeeded] == [urls[3]]
+    assert (results[urls[3]].state, results[urls[3]].error) == ("FAILED", "Failed to format bad")
+    assert results[urls[0]].progress == {"progress": 1, "message": "Installing to sd0"}
+    # Notifications from every server went to the listener with the right host
+    assert progress[urls[5]][-1] == {"progress": 1, "message": "Installing to sd5"}
+    assert all(len(progress[url]) >= 1 for url in urls)
+
+
+@pytest.mark.asyncio
+async def test__unreachable(backend, start_rpc_server):
+    _, url = await start_rpc_server()
+    async with ClientPool(connect_timeout=1) as pool:
+        results = await install_many(pool, {
+            url: {"disks": ["sda"], "set_pmbr": False, "authentication": None},
+            "127.0.0.1:1": {"disks": ["sda"], "set_pmbr": False, "authentication": None},
+        })
+
+    assert results[url].succeeded
+    assert results["127.0.0.1:1"].state is None
+    assert results["127.0.0.1:1"].error.startswith("Unable to connect")
+
+
+@pytest.mark.asyncio
+async def test__adoption(start_rpc_server):
+    servers = [await start_rpc_server() for _ in range(2)]
+    (first, first_url), (second, second_url) = servers
+
+    async with ClientPool() as pool:
+        key = await pool.adopt(first_url)
+        # Every server has its own adoption state
+        assert first.access_key == key
+        assert second.access_key is None
+        assert await pool.call(second_url, "is_adopted") is False
+
+    async with ClientPool() as pool:
+        with pytest.raises(RPCError) as e:
+            await pool.call(first_url, "job_status", 1)
+        assert e.value.errno == errno.EACCES
+
+    async with ClientPool({first_url: key}) as pool:
+        with pytest.raises(RPCError) as e:
+            await pool.call(first_url, "job_status", 1)
+        assert (e.value.message, e.value.errno) == ("Job 1 does not exist", errno.ENOENT)
+
+
+@pytest.mark.asyncio
+async def test__multiplexing_and_reconnect(start_rpc_server):
+    _, url = await start_rpc_server()
+    async with ClientPool() as pool:
+        client = await pool.get(url)
+        results = await asyncio.gather(*[pool.call(url, "job_status", i) for i in range(50)],
+                                       return_exceptions=True)
+        assert [result.message for result in results] == [f"Job {i} does not exist" for i in range(50)]
+        assert await pool.get(url) is client
+
+        await client.ws.close()
+        with pytest.raises(ConnectionClosed):
+            await client.call("is_adopted")
+
+        assert await pool.call(url, "is_adopted") is False
+        assert await pool.get(url) is not client
@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+import pytest
+
+from truenas_installer import disks
+from truenas_installer.disks import DiskInventory
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    scans = []
+
+    async def scan_disks():
+        scans.append(None)
+        return []
+
+    monkeypatch.setattr(disks, "scan_disks", scan_disks)
+    return scans
+
+
+@pytest.mark.asyncio
+async def test__cached(scans):
+    inventory = DiskInventory()
+    inventory.start()
+    if inventory.monitor is None:
+        pytest.skip("Kernel uevents are not available")
+
+    try:
+        await inventory.get()
+        await inventory.get()
+        assert len(scans) == 1
+
+        await inventory.get(force_rescan=True)
+        assert len(scans) == 2
+
+        inventory.invalidate()
+        await inventory.get()
+        assert len(scans) == 3
+        assert inventory.generation == 3
+    finally:
+        inventory.stop()
+
+
+@pytest.mark.asyncio
+async def test__invalidated_by_uevents(scans):
+    devices = sorted(os.listdir("/sys/class/block"))
+    if os.geteuid() != 0 or not devices:
+        pytest.skip("Requires root and a block device")
+
+    inventory = DiskInventory()
+    inventory.start()
+    if inventory.monitor is None:
+        pytest.skip("Kernel uevents are not available")
+
+    try:
+        await inventory.get()
+        assert not inventory.stale
+
+        with open(f"/sys/class/block/{devices[0]}/uevent", "w") as f:
+            f.write("change")
+
+        for _ in range(100):
+            if inventory.stale:
+                break
+            await asyncio.sleep(0.01)
+
+        await inventory.get()
+        assert len(scans) == 2
+    finally:
+        inventory.stop()
+
+
+@pytest.mark.asyncio
+async def test__not_started(scans):
+    inventory = DiskInventory()
+    await inventory.get()
+    await inventory.get()
+    assert len(scans) == 2
+
+
+@pytest.mark.asyncio
+async def test__stalled_stream_consumer(monkeypatch):
+    async def stream_disks():
+        for name in ["sda", "sdb"]:
+            yield disks.Disk(name, 16 * 1024 ** 3, "Model", "", [], False)
+
+    monkeypatch.setattr(disks, "stream_disks", stream_disks)
+    inventory = DiskInventory()
+
+    # The consumer (i.e. a websocket client that does not read) stalls after the first disk
+    stream = inventory.stream()
+    assert (await anext(stream)).name == "sda"
+
+    # Does not wait for the consumer
+    assert [disk.name for disk in await asyncio.wait_for(inventory.get(), 5)] == ["sda", "sdb"]
+    assert inventory.generation == 2
+
+    assert [disk.name async for disk in stream] == ["sdb"]
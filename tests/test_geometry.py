@@ -0,0 +1,55 @@
+import pytest
+
+from truenas_installer.geometry import pool_geometry
+from truenas_installer.gpt import boot_disk_layout
+
+KiB = 1024
+MiB = 1024 * KiB
+
+
+@pytest.fixture
+def sys_block(tmp_path):
+    for name, logical, physical, optimal, discard in [
+        ("sda", 512, 512, 0, 0),
+        ("sdb", 512, 4096, 0, 0),
+        ("sdc", 4096, 4096, 0, 2 * 1024 ** 3),
+        ("nvme0n1", 4096, 16 * KiB, 128 * KiB, 2 * 1024 ** 3),
+        ("nvme1n1", 512, 4096, 4 * MiB, 2 * 1024 ** 3),
+        ("sdd", 512, 4096, 768 * KiB, 0),
+    ]:
+        queue = tmp_path / name / "queue"
+        queue.mkdir(parents=True)
+        (queue / "logical_block_size").write_text(f"{logical}\n")
+        (queue / "physical_block_size").write_text(f"{physical}\n")
+        (queue / "optimal_io_size").write_text(f"{optimal}\n")
+        (queue / "discard_max_bytes").write_text(f"{discard}\n")
+
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize("names,ashift,alignment,autotrim", [
+    (["sda"], 12, MiB, False),
+    (["sdb"], 12, MiB, False),
+    (["sdc"], 12, MiB, True),
+    (["nvme0n1"], 14, MiB, True),
+    (["nvme1n1"], 12, 4 * MiB, True),
+    # 768 KiB stripes do not divide 1 MiB and their common multiple is 3 MiB, which is fine
+    (["sdd"], 12, 3 * MiB, False),
+    # Mirrors get the largest geometry, autotrim only if all members support discard
+    (["nvme0n1", "nvme1n1"], 14, 4 * MiB, True),
+    (["sda", "nvme0n1"], 14, MiB, False),
+    # Missing devices get the defaults
+    (["sdz"], 12, MiB, False),
+])
+def test__pool_geometry(sys_block, names, ashift, alignment, autotrim):
+    geometry = pool_geometry(names, sys_block)
+    assert (geometry.ashift, geometry.alignment, geometry.autotrim) == (ashift, alignment, autotrim)
+    assert list(geometry.devices) == names
+
+
+def test__aligned_layout():
+    bios, efi, data = boot_disk_layout(32 * 1024 ** 3 // 512, 512, 4 * MiB)
+    assert bios.first_lba == 4096
+    assert efi.first_lba * 512 % (4 * MiB) == 0
+    assert data.first_lba * 512 % (4 * MiB) == 0
+    assert [p.first_lba for p in boot_disk_layout(32 * 1024 ** 3 // 512, 512)] == [4096, 6144, 1054720]
@@ -0,0 +1,139 @@
+import os
+import shutil
+import struct
+import subprocess
+import uuid
+import zlib
+
+import pytest
+
+from truenas_installer.gpt import (
+    BLKPG_PARTITION, GPT_ENTRY, GPT_HEADER, boot_disk_layout, build_partition_table, write_partition_table,
+)
+
+GiB = 1024 ** 3
+
+
+def read_gpt(path, sector_size=512):
+    with open(path, "rb") as f:
+        total_sectors = f.seek(0, os.SEEK_END) // sector_size
+
+        def read(lba, size):
+            f.seek(lba * sector_size)
+            return f.read(size)
+
+        def header(lba):
+            fields = GPT_HEADER.unpack(read(lba, GPT_HEADER.size))
+            assert fields[0] == b"EFI PART"
+            assert zlib.crc32(GPT_HEADER.pack(*(fields[:3] + (0,) + fields[4:]))) == fields[3]
+            entries = read(fields[10], fields[11] * fields[12])
+            assert zlib.crc32(entries) == fields[13]
+            return fields, entries
+
+        mbr = read(0, sector_size)
+        primary, entries = header(1)
+        backup, backup_entries = header(total_sectors - 1)
+
+    assert entries == backup_entries
+    assert (primary[5], primary[6]) == (backup[6], backup[5]) == (1, total_sectors - 1)
+
+    partitions = []
+    for i in range(primary[11]):
+        type_guid, guid, first_lba, last_lba, attributes, name = GPT_ENTRY.unpack_from(entries, i * GPT_ENTRY.size)
+        if type_guid != b"\0" * 16:
+            partitions.append((
+                i + 1, str(uuid.UUID(bytes_le=type_guid)).upper(), first_lba, last_lba, attributes,
+                name.decode("utf-16-le").rstrip("\0"),
+            ))
+
+    return mbr[446:462], primary, partitions
+
+
+@pytest.mark.parametrize("total_sectors,sector_size,expected", [
+    (33554432, 512, [(4096, 6143), (6144, 1054719), (1054720, 33554398)]),
+    (4194304, 4096, [(4096, 4351), (4352, 135423), (135424, 4194298)]),
+])
+def test__boot_disk_layout(total_sectors, sector_size, expected):
+    assert [
+        (partition.first_lba, partition.last_lba)
+        for partition in boot_disk_layout(total_sectors, sector_size)
+    ] == expected
+
+
+@pytest.mark.parametrize("set_pmbr", [False, True])
+def test__write_partition_table(tmp_path, set_pmbr):
+    image = tmp_path / "disk.img"
+    with open(image, "wb") as f:
+        f.truncate(16 * GiB)
+
+    write_partition_table(str(image), set_pmbr)
+
+    mbr_partition, header, partitions = read_gpt(image)
+    total_sectors = 16 * GiB // 512
+    assert mbr_partition == (
+        (b"\x80" if set_pmbr else b"\x00") + b"\x00\x02\x00\xee" +
+        (b"\xff\xff\xff" if set_pmbr else b"\xfe\xff\xff") +
+        struct.pack("<II", 1, total_sectors - 1)
+    )
+    assert header[7:9] == (34, total_sectors - 34)
+    assert partitions == [
+        (1, "21686148-6449-6E6F-744E-656564454649", 4096, 6143, 4, "BIOS boot partition"),
+        (2, "C12A7328-F81F-11D2-BA4B-00A0C93EC93B", 6144, 1054719, 0, "EFI system partition"),
+        (3, "6A898CC3-1DD2-11B2-99A6-080020736631", 1054720, total_sectors - 34, 0, "Solaris /usr & Mac ZFS"),
+    ]
+
+
+def test__small_disk_chs():
+    primary, _ = build_partition_table(16000000, 512, boot_disk_layout(16000000, 512), False)
+    # LBA 15999999 with the 255/63 geometry: cylinder 995, head 243, sector 16
+    assert primary[446 + 5:446 + 8] == bytes([243, 16 | (995 >> 8) << 6, 995 & 0xff])
+
+
+@pytest.mark.skipif(shutil.which("sgdisk") is None, reason="sgdisk is not installed")
+@pytest.mark.parametrize("set_pmbr", [False, True])
+def test__sgdisk_compatibility(tmp_path, set_pmbr):
+    if set_pmbr and shutil.which("parted") is None:
+        pytest.skip("parted is not installed")
+
+    image = tmp_path / "sgdisk.img"
+    with open(image, "wb") as f:
+        f.truncate(16 * GiB)
+
+    for args in [
+        ["-a4096", "-n1:0:+1024K", "-t1:EF02", "-A1:set:2"],
+        ["-n2:0:+524288K", "-t2:EF00"],
+        ["-n3:0:0", "-t3:BF01"],
+    ]:
+        subprocess.run(["sgdisk"] + args + [str(image)], check=True, capture_output=True)
+    if set_pmbr:
+        subprocess.run(["parted", "-s", str(image), "disk_set", "pmbr_boot", "on"], check=True, capture_output=True)
+
+    with open(image, "rb") as f:
+        data = f.read(34 * 512)
+        f.seek(-33 * 512, os.SEEK_END)
+        backup = f.read()
+
+    # Partition and disk GUIDs are random, so reuse the ones sgdisk has generated
+    total_sectors = 16 * GiB // 512
+    partitions = boot_disk_layout(total_sectors, 512)
+    for partition in partitions:
+        partition.guid = uuid.UUID(bytes_le=data[1024 + (partition.number - 1) * 128 + 16:][:16])
+
+    assert build_partition_table(
+        total_sectors, 512, partitions, set_pmbr, uuid.UUID(bytes_le=data[512 + 56:512 + 72]),
+    ) == (data, backup)
+
+
+def test__loop_device(loop_device):
+    device = loop_device(2 * GiB)
+    partitions = write_partition_table(device, False)
+
+    name = device.removeprefix("/dev/")
+    for partition in partitions:
+        with open(f"/sys/block/{name}/{name}p{partition.number}/start") as f:
+            assert int(f.read()) == partition.first_lba
+
+
+def test__blkpg_partition_size():
+    # `sizeof(struct blkpg_partition)` on 64-bit architectures
+    assert BLKPG_PARTITION.size == 152
@@ -0,0 +1,188 @@
+import asyncio
+import errno
+import os
+import subprocess
+
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+import pytest
+
+from truenas_installer.hotplug import HotplugEvent, HotplugMonitor, hotplug_monitor
+from truenas_installer.rtnetlink import IFF_LOWER_UP, IFF_UP, Link, link_from_message
+from truenas_installer.server.api import hotplug as hotplug_api
+
+
+def link_message(event, index, name, flags):
+    message = ifinfmsg()
+    message["index"] = index
+    message["flags"] = flags
+    message["attrs"] = [("IFLA_IFNAME", name), ("IFLA_MTU", 1500)]
+    message["event"] = event
+    return message
+
+
+def test__link_from_message():
+    assert link_from_message(link_message("RTM_NEWLINK", 2, "eno1", IFF_UP | IFF_LOWER_UP)) == Link(
+        2, "eno1", True, True, False, False,
+    )
+    assert link_from_message(link_message("RTM_DELLINK", 3, "eno2", 0), True) == Link(
+        3, "eno2", False, False, True, True,
+    )
+
+
+def test__link_events():
+    monitor = HotplugMonitor()
+    events = [monitor._link_event(link) for link in [
+        Link(2, "eno1", True, False, dump=True),
+        # Statistics update
+        Link(2, "eno1", True, False),
+        Link(2, "eno1", True, True),
+        Link(3, "enx1", False, False),
+        Link(3, "enx1", False, False, removed=True),
+        Link(4, "enx2", False, False, removed=True),
+    ]]
+    assert events == [
+        None,
+        None,
+        HotplugEvent("network_interface", "change", "eno1", True, True),
+        HotplugEvent("network_interface", "add", "enx1", False, False),
+        HotplugEvent("network_interface", "remove", "enx1", False, False),
+        None,
+    ]
+
+
+@pytest.fixture
+def fake_monitor(monkeypatch):
+    async def start():
+        pass
+
+    monkeypatch.setattr(hotplug_monitor, "start", start)
+    monkeypatch.setattr(hotplug_monitor, "stop", lambda: None)
+
+
+@pytest.mark.asyncio
+async def test__subscribe(fake_monitor, rpc_ws):
+
+    async def call(id_, method, params):
+        await rpc_ws.send_json({"jsonrpc": "2.0", "id": id_, "method": method, "params": params})
+        return (await asyncio.wait_for(rpc_ws.receive_json(), 5))["result"]
+
+    disks = await call(1, "subscribe_hotplug", [{"types": ["disk"], "actions": ["add"], "names": ["nvme*"]}])
+    interfaces = await call(2, "subscribe_hotplug", [{"types": ["network_interface"]}])
+
+    for event in [
+        HotplugEvent("disk", "add", "sdc"),
+        HotplugEvent("disk", "remove", "nvme1n1"),
+        HotplugEvent("disk", "add", "nvme1n1"),
+        HotplugEvent("network_interface", "change", "eno1", True, False),
+        HotplugEvent("disk", "resync", None),
+    ]:
+        hotplug_monitor.emit(event)
+
+    messages = [(await asyncio.wait_for(rpc_ws.receive_json(), 5))["params"][0] for _ in range(3)]
+    assert messages == [
+        {"subscription_id": disks, "type": "disk", "action": "add", "name": "nvme1n1", "up": None, "carrier": None},
+        {"subscription_id": interfaces, "type": "network_interface", "action": "change", "name": "eno1",
+         "up": True, "carrier": False},
+        {"subscription_id": disks, "type": "disk", "action": "resync", "name": None, "up": None, "carrier": None},
+    ]
+
+    assert await call(3, "unsubscribe_hotplug", [disks]) is None
+    hotplug_monitor.emit(HotplugEvent("disk", "add", "nvme2n1"))
+    # Nothing was sent before the response
+    assert await call(4, "unsubscribe_hotplug", [interfaces]) is None
+    assert hotplug_monitor.listeners == []
+
+    await rpc_ws.send_json({"jsonrpc": "2.0", "id": 5, "method": "unsubscribe_hotplug", "params": [interfaces]})
+    assert (await asyncio.wait_for(rpc_ws.receive_json(), 5))["error"]["data"] == {"errno": "ENOENT"}
+
+
+@pytest.mark.asyncio
+async def test__subscriptions_end_with_the_connection(fake_monitor, rpc_ws):
+    await rpc_ws.send_json({"jsonrpc": "2.0", "id": 1, "method": "subscribe_hotplug", "params": [{}]})
+    await asyncio.wait_for(rpc_ws.receive_json(), 5)
+    assert len(hotplug_api.subscriptions) == 1
+
+    await rpc_ws.close()
+    # Without waiting for the next event or subscription
+    for _ in range(100):
+        if not hotplug_api.subscriptions:
+            break
+        await asyncio.sleep(0.01)
+
+    assert hotplug_api.subscriptions == {}
+    assert hotplug_monitor.listeners == []
+
+
+@pytest.mark.asyncio
+async def test__concurrent_subscriptions_when_monitor_fails(monkeypatch, rpc_ws):
+    async def start():
+        # The second subscription arrives while the first one is starting the monitor
+        await asyncio.sleep(0.1)
+        raise OSError(errno.EPROTONOSUPPORT, "Protocol not supported")
+
+    monkeypatch.setattr(hotplug_monitor, "start", start)
+
+    for id_ in [1, 2]:
+        await rpc_ws.send_json({"jsonrpc": "2.0", "id": id_, "method": "subscribe_hotplug", "params": [{}]})
+
+    responses = [await asyncio.wait_for(rpc_ws.receive_json(), 5) for _ in range(2)]
+    assert [response["error"]["data"] for response in responses] == [{"errno": "EPROTONOSUPPORT"}] * 2
+    assert hotplug_api.subscriptions == {}
+    assert hotplug_monitor.listeners == []
+
+
+@pytest.mark.asyncio
+async def test__stalled_subscriber(fake_monitor, rpc_server, rpc_ws):
+    server, _ = rpc_server
+    await rpc_ws.send_json({"jsonrpc": "2.0", "id": 1, "method": "subscribe_hotplug", "params": [{}]})
+    await asyncio.wait_for(rpc_ws.receive_json(), 5)
+
+    # The client does not read anything meanwhile
+    for i in range(1000):
+        hotplug_monitor.emit(HotplugEvent("disk", "change", f"sd{i}"))
+
+    [client] = server.progress_hub.clients.values()
+    assert len(client.queue) <= 64
+    assert len(asyncio.all_tasks()) < 50
+
+
+@pytest.mark.asyncio
+async def test__live_network_interfaces():
+    if os.geteuid() != 0:
+        pytest.skip("Requires root")
+
+    events = []
+    received = asyncio.Event()
+
+    def listener(event):
+        if event.name == "tnihotplug0":
+            events.append(event.action)
+            received.set()
+
+    monitor = HotplugMonitor()
+    try:
+        await monitor.add_listener(listener)
+    except OSError:
+        pytest.skip("Netlink is not available")
+
+    try:
+        # Give the monitor the time to receive the existing interfaces
+        await asyncio.sleep(0.1)
+        if subprocess.run(["ip", "link", "add", "tnihotplug0", "type", "veth", "peer", "name", "tnihotplug1"],
+                          capture_output=True).returncode != 0:
+            pytest.skip("Unable to create a network interface")
+
+        try:
+            await asyncio.wait_for(received.wait(), 5)
+            assert events == ["add"]
+        finally:
+            subprocess.run(["ip", "link", "del", "tnihotplug0"], capture_output=True)
+
+        for _ in range(100):
+            if events[-1] == "remove":
+                break
+            await asyncio.sleep(0.01)
+
+        assert events == ["add", "remove"]
+    finally:
+        monitor.remove_listener(listener)
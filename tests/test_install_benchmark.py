@@ -0,0 +1,221 @@
+import asyncio
+import contextlib
+import hashlib
+import itertools
+import os
+import shutil
+import subprocess
+import textwrap
+import time
+
+import aiohttp
+from aiohttp import web
+import pytest
+
+from truenas_installer import install as install_module, utils
+from truenas_installer.disks import Disk
+from truenas_installer.install import install
+from truenas_installer.media import InstallMedia
+from truenas_installer.server import InstallerRPCServer
+from truenas_installer.server.api import install as install_api
+from truenas_installer.trace import tracer
+
+GiB = 1024 ** 3
+DISK_SIZE = 16 * GiB
+DISK_COUNTS = [1, 2, 4]
+# Commands that need ZFS. Unless `TRUENAS_INSTALLER_BENCHMARK_ZFS=1` is set (which creates and exports a real
+# `boot-pool`, so never set it on a system that has one), they are answered without being executed.
+ZFS_COMMANDS = {"zgenhostid", "zpool", "zfs"}
+
+# Mimics the output of the real `truenas_install`: a few slow steps and a lot of fine-grained extraction progress
+TRUENAS_INSTALL = textwrap.dedent("""\
+    import json
+    import sys
+    import time
+
+    params = json.load(sys.stdin)
+    assert params["json"] and params["disks"] and params["pool_name"] == "boot-pool"
+
+
+    def progress(value, message):
+        print(json.dumps({"progress": value, "message": message}), flush=True)
+
+
+    progress(0, "Creating dataset")
+    time.sleep(0.05)
+    for i in range(1, 101):
+        progress(0.1 + 0.7 * i / 100, f"Extracting ({i} %)")
+        time.sleep(0.002)
+    progress(0.8, "Performing post-install tasks")
+    time.sleep(0.05)
+    for disk in params["disks"]:
+        progress(0.9, f"Installing GRUB on {disk}")
+        time.sleep(0.01)
+    progress(1, "Installation finished")
+""")
+
+
+@pytest.fixture(scope="module")
+def image(tmp_path_factory):
+    if os.geteuid() != 0 or shutil.which("losetup") is None:
+        pytest.skip("Requires root and losetup")
+    if shutil.which("mksquashfs") is None:
+        pytest.skip("Requires mksquashfs")
+
+    root = tmp_path_factory.mktemp("image")
+    os.makedirs(root / "src" / "truenas_install")
+    (root / "src" / "truenas_install" / "__init__.py").write_text("")
+    (root / "src" / "truenas_install" / "__main__.py").write_text(TRUENAS_INSTALL)
+
+    path = root / "TrueNAS-SCALE.update"
+    subprocess.run(["mksquashfs", str(root / "src"), str(path), "-noappend", "-quiet"], check=True,
+                   capture_output=True)
+    with open(f"{path}.sha256", "w") as f:
+        f.write(f"{hashlib.sha256(path.read_bytes()).hexdigest()}  {path.name}\n")
+
+    return str(path)
+
+
+@pytest.fixture
+def environment(image, tmp_path, monkeypatch):
+    monkeypatch.setattr(install_module, "InstallMedia", lambda stager: InstallMedia(image))
+    monkeypatch.setattr(tracer, "path", str(tmp_path / "trace.json"))
+
+    if os.environ.get("TRUENAS_INSTALLER_BENCHMARK_ZFS") != "1":
+        async def fake_zfs(args, execute):
+            if args[0] in ZFS_COMMANDS:
+                return 0, "", ""
+
+            return await execute(args)
+
+        monkeypatch.setattr(utils, "interceptor", fake_zfs)
+
+
+@contextlib.contextmanager
+def loop_devices(loop_device, count):
+    devices = []
+    try:
+        for _ in range(count):
+            devices.append(loop_device(DISK_SIZE))
+
+        yield [Disk(device.removeprefix("/dev/"), DISK_SIZE, "Loop device", "", [], False) for device in devices]
+    finally:
+        loop_device.detach(*devices)
+
+
+def reset_peak_rss():
+    with contextlib.suppress(OSError):
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+
+
+def peak_rss():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+
+
+def report(trace, wall_time):
+    phases = {}
+    for event in trace["traceEvents"]:
+        if event.get("cat") == "step":
+            # Steps that run for every disk (i.e. `format:loop0`) are reported together, by the slowest one
+            phase = event["name"].split(":")[0]
+            phases[phase] = max(phases.get(phase, 0), event["dur"] / 1e6)
+
+    return {
+        "wall_time": wall_time,
+        "phases": phases,
+        "subprocesses": sum(event.get("cat") == "subprocess" for event in trace["traceEvents"]),
+        "peak_rss": peak_rss(),
+    }
+
+
+def print_reports(title, reports):
+    phases = list(dict.fromkeys(itertools.chain.from_iterable(report["phases"] for report in reports.values())))
+
+    print()
+    print(title)
+    print(f"{'':>18} | " + " | ".join(f"{count} disk(s)" for count in reports))
+    rows = [("wall time", lambda r: f"{r['wall_time']:8.3f}s")]
+    rows += [(phase, lambda r, phase=phase: f"{r['phases'].get(phase, 0):8.3f}s") for phase in phases]
+    rows += [
+        ("subprocesses", lambda r: f"{r['subprocesses']:9d}"),
+        ("peak RSS", lambda r: f"{r['peak_rss'] / 1024 ** 2:6.1f}MiB"),
+    ]
+    for name, fmt in rows:
+        print(f"{name:>18} | " + " | ".join(fmt(report) for report in reports.values()))
+
+
+@pytest.mark.asyncio
+async def test__install(environment, loop_device):
+    reports = {}
+    for count in DISK_COUNTS:
+        with loop_devices(loop_device, count) as disks:
+            progress = []
+            reset_peak_rss()
+            start = time.monotonic()
+            await install(disks, [], False, None, None, None, lambda value, message: progress.append(value))
+            reports[count] = report(tracer.trace(), time.monotonic() - start)
+
+        assert progress[-1] == 1
+
+    print_reports("install()", reports)
+
+
+@pytest.mark.asyncio
+async def test__install_rpc(environment, loop_device, monkeypatch):
+    server = InstallerRPCServer(None)
+    app = web.Application()
+    app.router.add_routes([web.get("/", server.handle_http_request)])
+    app.on_shutdown.append(server.on_shutdown)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+
+    reports = {}
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(f"http://{host}:{port}/") as ws:
+                for count in DISK_COUNTS:
+                    with loop_devices(loop_device, count) as disks:
+                        async def list_disks(force_rescan=False, include_busy=False):
+                            return disks
+
+                        async def serial_sql():
+                            return None
+
+                        monkeypatch.setattr(install_api, "list_disks", list_disks)
+                        monkeypatch.setattr(install_api, "serial_sql", serial_sql)
+
+                        reset_peak_rss()
+                        start = time.monotonic()
+                        await ws.send_json({
+                            "jsonrpc": "2.0",
+                            "id": count,
+                            "method": "install",
+                            "params": [{
+                                "disks": [disk.name for disk in disks],
+                                "set_pmbr": False,
+                                "authentication": None,
+                            }],
+                        })
+                        progress = []
+                        while True:
+                            message = await asyncio.wait_for(ws.receive_json(), 300)
+                            if message.get("method") == "installation_progress":
+                                progress.append(message["params"][0]["progress"])
+                            elif message.get("id") == count:
+                                break
+
+                        reports[count] = report(tracer.trace(), time.monotonic() - start)
+
+                    assert "error" not in message, message
+                    assert progress[-1] == 1
+    finally:
+        await runner.cleanup()
+
+    print_reports("install RPC", reports)
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import threading
+
+import aiohttp
+import pytest
+
+from truenas_installer.lock import installation_lock
+from truenas_installer.plan import Plan
+from truenas_installer.server.api import install as install_api
+from truenas_installer.utils import run, to_thread
+
+
+@pytest.mark.asyncio
+async def test__plan_cancelled():
+    calls = []
+    started = asyncio.Event()
+
+    def step(name):
+        async def fn():
+            calls.append(name)
+
+        return fn
+
+    async def install():
+        started.set()
+        await asyncio.sleep(60)
+
+    plan = Plan()
+    plan.add("mount_media", step("mount_media"))
+    plan.add("create_pool", step("create_pool"))
+    plan.add("install", install, requires=["mount_media", "create_pool"])
+    plan.add("unmount_media", step("unmount_media"), requires=["mount_media"], after=["install"])
+    plan.add("export_pool", step("export_pool"), requires=["create_pool"], after=["install", "unmount_media"])
+    plan.add("never_started", step("never_started"), requires=["install"])
+    plan.add("never_mounted", step("never_mounted"), requires=["never_started"], after=["install"])
+
+    task = asyncio.create_task(plan.run())
+    await asyncio.wait_for(started.wait(), 5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert sorted(calls[:2]) == ["create_pool", "mount_media"]
+    assert calls[2:] == ["unmount_media", "export_pool"]
+
+
+@pytest.mark.asyncio
+async def test__run_cancelled(tmp_path):
+    pid_file = tmp_path / "pid"
+    task = asyncio.create_task(run(["sh", "-c", f"echo $$ > {pid_file}; exec sleep 60"]))
+    for _ in range(500):
+        if pid_file.exists() and pid_file.read_text().strip():
+            break
+        await asyncio.sleep(0.01)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_file.read_text()), 0)
+
+
+@pytest.fixture
+def installation(monkeypatch, tmp_path):
+    proceed = asyncio.Event()
+    aborted = []
+
+    async def install_disks(params):
+        # Lets concurrent calls interleave
+        await asyncio.sleep(0.01)
+        return [], []
+
+    async def serial_sql():
+        return ""
+
+    async def install(destination_disks, wipe_disks, set_pmbr, authentication, post_install, sql, callback,
+                      dry_run, discard):
+        callback(0.5, "Installing")
+        try:
+            await proceed.wait()
+        except asyncio.CancelledError:
+            aborted.append(None)
+            raise
+
+        if set_pmbr:
+            raise install_api.InstallError("Failed")
+
+    monkeypatch.setattr(install_api, "_install_disks", install_disks)
+    monkeypatch.setattr(install_api, "serial_sql", serial_sql)
+    monkeypatch.setattr(install_api, "install_", install)
+    monkeypatch.setattr(installation_lock, "path", tmp_path / "lock")
+    return proceed, aborted
+
+
+def rpc_caller(rpc_ws):
+    ids = iter(range(1, 100))
+
+    async def call(method, *params):
+        response = await call_response(method, *params)
+        return response["result"]
+
+    async def call_response(method, *params):
+        id_ = next(ids)
+        await rpc_ws.send_json({"jsonrpc": "2.0", "id": id_, "method": method, "params": list(params)})
+        while "id" not in (response := await asyncio.wait_for(rpc_ws.receive_json(), 5)):
+            # `installation_progress`
+            pass
+
+        assert response["id"] == id_
+        return response
+
+    return call, call_response
+
+
+@pytest.mark.asyncio
+async def test__install_job(installation, rpc_ws):
+    proceed, aborted = installation
+    call, _ = rpc_caller(rpc_ws)
+
+    params = {"disks": ["sda"], "set_pmbr": False, "authentication": None}
+    job = await call("install_start", params)
+    status = await call("job_wait", {"id": job, "timeout": 0.1})
+    assert (status["state"], status["progress"]) == ("RUNNING", {"progress": 0.5, "message": "Installing"})
+
+    status = await call("job_abort", job)
+    assert (status["state"], status["finished"] is not None) == ("ABORTED", True)
+    assert len(aborted) == 1
+
+    proceed.set()
+    job = await call("install_start", params)
+    assert (await call("job_wait", {"id": job}))["state"] == "SUCCESS"
+
+    job = await call("install_start", {**params, "set_pmbr": True})
+    status = await call("job_wait", {"id": job})
+    assert (status["state"], status["error"]) == ("FAILED", {"message": "Failed", "errno": "EFAULT"})
+    # Kept for the clients that reconnect
+    assert (await call("job_status", job))["state"] == "FAILED"
+    assert not installation_lock.locked()
+
+
+@pytest.mark.asyncio
+async def test__concurrent_install_start(installation, rpc_server, rpc_ws):
+    proceed, aborted = installation
+    params = {"disks": ["sda"], "set_pmbr": False, "authentication": None}
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(rpc_server[1]) as other_ws:
+            # The second call checks the lock before the job started by the first one has had a chance to run
+            responses = await asyncio.gather(*[
+                rpc_caller(ws)[1]("install_start", params) for ws in [rpc_ws, other_ws]
+            ])
+
+    assert len([response for response in responses if "result" in response]) == 1
+    assert [response["error"]["message"] for response in responses if "error" in response] == [
+        "Installation is already in progress",
+    ]
+
+    proceed.set()
+    job = next(response["result"] for response in responses if "result" in response)
+    call, _ = rpc_caller(rpc_ws)
+    assert (await call("job_wait", {"id": job}))["state"] == "SUCCESS"
+    assert not installation_lock.locked()
+
+
+@pytest.mark.asyncio
+async def test__to_thread_cancelled():
+    started = threading.Event()
+    proceed = threading.Event()
+    finished = []
+
+    def write():
+        started.set()
+        proceed.wait(5)
+        finished.append(None)
+
+    task = asyncio.create_task(to_thread(write))
+    await asyncio.to_thread(started.wait, 5)
+    task.cancel()
+    await asyncio.sleep(0.1)
+    # The cancellation only propagates once the thread has returned
+    assert not task.done()
+
+    proceed.set()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert finished == [None]
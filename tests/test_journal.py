@@ -0,0 +1,72 @@
+import pytest
+
+from truenas_installer.journal import Journal
+from truenas_installer.plan import Plan
+
+
+def make_plan(journal, calls, valid, fail):
+    plan = Plan(journal=journal)
+
+    def step(name):
+        async def fn():
+            calls.append(name)
+            if name in fail:
+                raise RuntimeError(name)
+
+            return f"{name} result"
+
+        return fn
+
+    async def resume(result):
+        return result in valid
+
+    plan.add("format", step("format"), resume=resume)
+    plan.add("partitions", step("partitions"), requires=["format"])
+    plan.add("pool", step("pool"), requires=["partitions"], resume=resume)
+    plan.add("install", step("install"), requires=["pool"])
+    return plan
+
+
+@pytest.mark.asyncio
+async def test__resume(tmp_path):
+    parameters = {"disks": ["sda"]}
+    journal = Journal(str(tmp_path / "journal.json"))
+    journal.open(parameters)
+
+    calls = []
+    with pytest.raises(RuntimeError):
+        await make_plan(journal, calls, set(), {"install"}).run()
+    assert calls == ["format", "partitions", "pool", "install"]
+
+    journal = Journal(journal.path)
+    journal.open(parameters)
+
+    calls = []
+    plan = make_plan(journal, calls, {"format result", "pool result"}, set())
+    await plan.run()
+    assert calls == ["partitions", "install"]
+    assert plan.results["pool"] == "pool result"
+
+
+@pytest.mark.asyncio
+async def test__resume_invalidated(tmp_path):
+    journal = Journal(str(tmp_path / "journal.json"))
+    journal.open({"disks": ["sda"]})
+    with pytest.raises(RuntimeError):
+        await make_plan(journal, [], set(), {"install"}).run()
+
+    # The pool can not be reused on a disk that had to be formatted once again
+    calls = []
+    await make_plan(journal, calls, {"pool result"}, set()).run()
+    assert calls == ["format", "partitions", "pool", "install"]
+
+
+@pytest.mark.asyncio
+async def test__different_parameters(tmp_path):
+    journal = Journal(str(tmp_path / "journal.json"))
+    journal.open({"disks": ["sda"]})
+    with pytest.raises(RuntimeError):
+        await make_plan(journal, [], set(), {"install"}).run()
+
+    journal.open({"disks": ["sdb"]})
+    assert journal.steps == {}
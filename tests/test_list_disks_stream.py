@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from truenas_installer import disks as disks_module
+from truenas_installer.disks import Disk
+
+
+@pytest.fixture
+def rpc(monkeypatch, rpc_ws):
+    discovered = asyncio.Event()
+
+    async def stream_disks():
+        yield Disk("sdb", 16 * 1024 ** 3, "Model", "", [], False)
+        # The second disk is only discovered after the client has received the first one
+        await asyncio.wait_for(discovered.wait(), 5)
+        yield Disk("sda", 16 * 1024 ** 3, "Model", "", [], False)
+
+    monkeypatch.setattr(disks_module, "stream_disks", stream_disks)
+    monkeypatch.setattr(disks_module.disk_inventory, "disks", None)
+    monkeypatch.setattr(disks_module.disk_inventory, "generation", 0)
+
+    return rpc_ws, discovered
+
+
+@pytest.mark.asyncio
+async def test__list_disks_stream(rpc):
+    ws, discovered = rpc
+    await ws.send_json({"jsonrpc": "2.0", "id": 7, "method": "list_disks_stream", "params": [{}]})
+
+    message = await asyncio.wait_for(ws.receive_json(), 5)
+    assert message["method"] == "disk_discovered"
+    assert message["params"][0]["request_id"] == 7
+    assert message["params"][0]["disk"]["name"] == "sdb"
+    discovered.set()
+
+    messages = [await asyncio.wait_for(ws.receive_json(), 5) for _ in range(3)]
+    assert [(message.get("method"), message.get("params")) for message in messages[:2]] == [
+        ("disk_discovered", [{"request_id": 7, "disk": messages[0]["params"][0]["disk"]}]),
+        ("disk_discovery_finished", [{"request_id": 7, "count": 2}]),
+    ]
+    assert messages[0]["params"][0]["disk"]["name"] == "sda"
+    assert messages[2] == {"jsonrpc": "2.0", "id": 7, "result": 2}
+
+    assert [disk.name for disk in disks_module.disk_inventory.disks] == ["sda", "sdb"]
+
+
+@pytest.mark.asyncio
+async def test__busy_disks_are_opt_in(monkeypatch, rpc_ws):
+    async def stream_disks():
+        yield Disk("sda", 16 * 1024 ** 3, "Model", "iso9660", [], True, ["mounted"])
+        yield Disk("sdb", 16 * 1024 ** 3, "Model", "", [], False)
+
+    monkeypatch.setattr(disks_module, "stream_disks", stream_disks)
+    monkeypatch.setattr(disks_module.disk_inventory, "disks", None)
+
+    async def call(method, *params):
+        await rpc_ws.send_json({"jsonrpc": "2.0", "id": 1, "method": method, "params": list(params)})
+        messages = []
+        while "id" not in (message := await asyncio.wait_for(rpc_ws.receive_json(), 5)):
+            messages.append(message)
+        return message["result"], messages
+
+    # Existing clients are never offered the boot media
+    assert [disk["name"] for disk in (await call("list_disks"))[0]] == ["sdb"]
+    assert [(disk["name"], disk["busy_reasons"]) for disk in (await call("list_all_disks"))[0]] == [
+        ("sda", ["mounted"]),
+        ("sdb", []),
+    ]
+
+    for params, names in [({}, ["sdb"]), ({"include_busy": True}, ["sda", "sdb"])]:
+        count, messages = await call("list_disks_stream", params)
+        assert [message["params"][0]["disk"]["name"] for message in messages[:-1]] == names
+        assert count == len(names)
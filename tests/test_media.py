@@ -0,0 +1,101 @@
+import hashlib
+import os
+
+import pytest
+
+from truenas_installer.exception import InstallError
+from truenas_installer.media import SQUASHFS_MAGIC, SQUASHFS_SUPERBLOCK, InstallMedia
+from truenas_installer.staging import MediaStager
+
+SIZE = 1024 * 1024
+
+
+def squashfs(bytes_used=SIZE, magic=SQUASHFS_MAGIC, major=4):
+    superblock = SQUASHFS_SUPERBLOCK.pack(magic, 1, 0, 131072, 0, 1, 17, 0, 1, major, 0, 0, bytes_used,
+                                          *[0] * 6)
+    return superblock + os.urandom(SIZE - len(superblock))
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "rootfs.squashfs"
+    path.write_bytes(squashfs())
+    return path
+
+
+def write_checksum(image, checksum=None):
+    checksum = checksum or hashlib.sha256(image.read_bytes()).hexdigest()
+    (image.parent / f"{image.name}.sha256").write_text(f"{checksum.upper()}  {image.name}\n")
+
+
+def test__check(image):
+    InstallMedia(str(image)).check()
+
+
+@pytest.mark.parametrize("data,error", [
+    (squashfs(magic=b"sqsh"), "is not a squashfs image"),
+    (squashfs(major=3), "is not a squashfs image"),
+    (squashfs()[:50], "is truncated"),
+    (squashfs(bytes_used=SIZE + 1), f"is truncated ({SIZE} bytes out of {SIZE + 1})"),
+])
+def test__check_invalid(image, data, error):
+    image.write_bytes(data)
+    with pytest.raises(InstallError) as e:
+        InstallMedia(str(image)).check()
+
+    assert e.value.message.endswith(error)
+
+
+def test__check_missing(tmp_path):
+    with pytest.raises(InstallError) as e:
+        InstallMedia(str(tmp_path / "missing")).check()
+
+    assert e.value.message.startswith("Unable to read installation image")
+
+
+@pytest.mark.asyncio
+async def test__verify(image):
+    write_checksum(image)
+    await InstallMedia(str(image)).verify()
+
+
+@pytest.mark.asyncio
+async def test__verify_without_checksum(image):
+    messages = []
+    await InstallMedia(str(image)).verify(lambda progress, message: messages.append(message))
+
+    assert messages == [f"Warning: installation image {image} has no checksum file ({image}.sha256), it can not be "
+                        "verified"]
+
+
+@pytest.mark.asyncio
+async def test__verify_corrupt(image):
+    write_checksum(image)
+    data = bytearray(image.read_bytes())
+    data[SIZE // 2] ^= 0xff
+    image.write_bytes(data)
+
+    with pytest.raises(InstallError) as e:
+        await InstallMedia(str(image)).verify()
+
+    assert e.value.message.startswith(f"Installation image {image} is corrupt: SHA256 checksum is ")
+
+
+@pytest.mark.asyncio
+async def test__verify_empty_checksum(image):
+    (image.parent / f"{image.name}.sha256").write_text("")
+    with pytest.raises(InstallError) as e:
+        await InstallMedia(str(image)).verify()
+
+    assert e.value.message.startswith("Unable to read installation image checksum")
+
+
+@pytest.mark.asyncio
+async def test__verify_uses_stager_checksum(image, tmp_path, monkeypatch):
+    write_checksum(image, "0" * 64)
+    stager = MediaStager(str(image), str(tmp_path / "shm"))
+    stager.sha256 = "0" * 64
+    # Neither the image nor the stager is read once again
+    monkeypatch.setattr(InstallMedia, "_sha256", None)
+
+    await InstallMedia(str(image), stager).verify()
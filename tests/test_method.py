@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+from jsonschema.exceptions import SchemaError
+import pytest
+
+from truenas_installer.server.error import Error
+from truenas_installer.server.method import Method
+
+
+def make_method(result, validate_results):
+    async def fn(context, params):
+        return result
+
+    method = Method("test", {"type": "object", "required": ["disks"]}, {"type": "integer"}, fn)
+    method.server = SimpleNamespace(validate_results=validate_results)
+    return method
+
+
+def request(*args):
+    return SimpleNamespace(args=list(args))
+
+
+@pytest.mark.asyncio
+async def test__params():
+    method = make_method(1, False)
+    assert await method.call(request({"disks": []})) == 1
+
+    with pytest.raises(Error) as e:
+        await method.call(request({}))
+    assert e.value.text.startswith("'disks' is a required property")
+
+    with pytest.raises(Error) as e:
+        await method.call(request())
+    assert e.value.text == "1 parameter required, found 0"
+
+
+@pytest.mark.asyncio
+async def test__results():
+    assert await make_method("1", False).call(request({"disks": []})) == "1"
+
+    with pytest.raises(RuntimeError) as e:
+        await make_method("1", True).call(request({"disks": []}))
+    assert str(e.value).startswith("Method 'test' returned an invalid result: '1' is not of type 'integer'")
+
+
+def test__invalid_schema():
+    with pytest.raises(SchemaError):
+        Method("test", {"type": "text"}, None, None)
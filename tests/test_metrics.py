@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+from truenas_installer import metrics
+from truenas_installer.metrics import Counter, Histogram, Registry, loop_lag, rpc_calls, rpc_duration
+from truenas_installer.utils import run
+
+
+def test__render():
+    registry = Registry()
+    counter = Counter("calls_total", "Calls", ("method",), registry_=registry)
+    histogram = Histogram("duration_seconds", "Durations", ("method",), (0.1, 1), registry_=registry)
+
+    counter.inc("install")
+    counter.inc('a"b\\c')
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(value, "install")
+
+    assert registry.render() == "\n".join([
+        "# HELP calls_total Calls",
+        "# TYPE calls_total counter",
+        'calls_total{method="install"} 1',
+        'calls_total{method="a\\"b\\\\c"} 1',
+        "# HELP duration_seconds Durations",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{method="install",le="0.1"} 2',
+        'duration_seconds_bucket{method="install",le="1"} 3',
+        'duration_seconds_bucket{method="install",le="+Inf"} 4',
+        'duration_seconds_sum{method="install"} 2.65',
+        'duration_seconds_count{method="install"} 4',
+    ]) + "\n"
+
+
+@pytest.mark.asyncio
+async def test__endpoint(rpc_server):
+    _, url = rpc_server
+    await run(["true"])
+
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url) as ws:
+            await ws.send_json({"jsonrpc": "2.0", "id": 1, "method": "is_adopted", "params": []})
+            await asyncio.wait_for(ws.receive_json(), 5)
+            await ws.send_json({"jsonrpc": "2.0", "id": 2, "method": "job_status", "params": [1]})
+            await asyncio.wait_for(ws.receive_json(), 5)
+
+            async with session.get(f"{url}metrics") as response:
+                assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+                lines = (await response.text()).splitlines()
+
+    assert any(line.startswith('truenas_installer_rpc_calls_total{method="is_adopted",outcome="success"} ')
+               for line in lines)
+    assert any(line.startswith('truenas_installer_rpc_calls_total{method="job_status",outcome="error"} ')
+               for line in lines)
+    assert any(line.startswith('truenas_installer_rpc_call_duration_seconds_count{method="is_adopted"} ')
+               for line in lines)
+    assert any(line.startswith('truenas_installer_subprocesses_total{command="true",outcome="success"} ')
+               for line in lines)
+    assert "truenas_installer_websockets 1" in lines
+
+
+@pytest.mark.asyncio
+async def test__endpoint_requires_access_key_once_adopted(rpc_server):
+    _, url = rpc_server
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url) as ws:
+            await ws.send_json({"jsonrpc": "2.0", "id": 1, "method": "adopt", "params": []})
+            access_key = (await asyncio.wait_for(ws.receive_json(), 5))["result"]
+
+        for headers, status in [
+            ({}, 401),
+            ({"Authorization": "Bearer wrong"}, 401),
+            ({"Authorization": f"Bearer {access_key}"}, 200),
+        ]:
+            async with session.get(f"{url}metrics", headers=headers) as response:
+                assert response.status == status
+
+
+@pytest.mark.asyncio
+async def test__loop_lag(monkeypatch):
+    monkeypatch.setattr(metrics, "LOOP_LAG_INTERVAL", 0.01)
+    monkeypatch.setattr(loop_lag, "values", {})
+
+    await metrics.loop_lag_monitor.on_startup(None)
+    try:
+        await asyncio.sleep(0.005)
+        # Blocks the event loop
+        time.sleep(0.05)
+        await asyncio.sleep(0.05)
+    finally:
+        await metrics.loop_lag_monitor.on_shutdown(None)
+
+    assert loop_lag.values[()][1] >= 0.04
+
+
+def test__overhead(monkeypatch):
+    monkeypatch.setattr(rpc_calls, "values", {})
+    monkeypatch.setattr(rpc_duration, "values", {})
+
+    calls = 100000
+    start = time.perf_counter()
+    for _ in range(calls):
+        rpc_calls.inc("benchmark", "success")
+        rpc_duration.observe(0.002, "benchmark")
+    overhead = (time.perf_counter() - start) / calls
+
+    print()
+    print(f"per RPC call instrumentation overhead: {overhead * 1e6:.2f}µs")
+
+    # Negligible compared with the JSON-RPC handling of a call
+    assert overhead < 20e-6
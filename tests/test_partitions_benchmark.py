@@ -0,0 +1,90 @@
+import asyncio
+import fcntl
+import os
+import time
+
+import pytest
+
+from truenas_installer import utils
+from truenas_installer.gpt import BLKRRPART, write_partition_table
+
+GiB = 1024 ** 3
+# How long it takes for the partitions to show up after we start waiting for them (i.e. a slow HBA)
+DELAYS = [0.1, 0.5]
+
+
+@pytest.fixture
+def device(loop_device):
+    return loop_device(2 * GiB)
+
+
+def clear_partition_table(device):
+    fd = os.open(device, os.O_RDWR)
+    try:
+        os.pwrite(fd, b"\0" * 34 * 512, 0)
+        fcntl.ioctl(fd, BLKRRPART)
+    finally:
+        os.close(fd)
+
+
+async def measure(device, delay):
+    clear_partition_table(device)
+
+    loop = asyncio.get_running_loop()
+    loop.call_later(delay, lambda: loop.run_in_executor(None, write_partition_table, device, False))
+
+    start = time.monotonic()
+    found = await utils.get_partitions(device, [1, 2, 3], tries=10)
+    elapsed = time.monotonic() - start
+
+    assert all(found.values())
+    return elapsed
+
+
+@pytest.mark.asyncio
+async def test__get_partitions_latency(device, monkeypatch):
+    events = [await measure(device, delay) for delay in DELAYS]
+
+    def no_uevents(subsystem):
+        raise OSError("Netlink is not available")
+
+    monkeypatch.setattr(utils, "UeventMonitor", no_uevents)
+    polling = [await measure(device, delay) for delay in DELAYS]
+
+    print()
+    print("partitions appear after | uevents  | sysfs polling")
+    for delay, event_latency, polling_latency in zip(DELAYS, events, polling):
+        print(f"{delay:22.1f}s | {event_latency:7.3f}s | {polling_latency:7.3f}s")
+
+    for delay, event_latency, polling_latency in zip(DELAYS, events, polling):
+        assert event_latency < polling_latency
+
+
+@pytest.mark.asyncio
+async def test__partition_table_is_only_reread_when_partitions_are_missing(device, monkeypatch):
+    rereads = []
+
+    def reread_partition_table(fd):
+        rereads.append(fd)
+        return reread_partition_table_(fd)
+
+    reread_partition_table_ = utils.reread_partition_table
+    monkeypatch.setattr(utils, "reread_partition_table", reread_partition_table)
+
+    write_partition_table(device, False)
+    for _ in range(3):
+        assert all((await utils.get_partitions(device, [1, 2, 3], tries=10)).values())
+    assert rereads == []
+
+    # The kernel does not know about the partitions that are on the disk
+    fd = os.open(device, os.O_RDWR)
+    try:
+        table = os.pread(fd, 34 * 512, 0)
+        os.pwrite(fd, b"\0" * 34 * 512, 0)
+        fcntl.ioctl(fd, BLKRRPART)
+        os.pwrite(fd, table, 0)
+    finally:
+        os.close(fd)
+
+    assert all((await utils.get_partitions(device, [1, 2, 3], tries=10)).values())
+    assert len(rereads) == 1
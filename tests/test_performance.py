@@ -0,0 +1,98 @@
+import asyncio
+import os
+
+import pytest
+
+from truenas_installer import installer_menu, performance
+from truenas_installer.disks import Disk
+from truenas_installer.installer import Installer
+from truenas_installer.performance import DiskPerformance, measure, performance_key, probe_disks
+
+
+@pytest.fixture
+def tree(tmp_path):
+    dev = tmp_path / "dev"
+    dev.mkdir()
+    with open(dev / "sda", "wb") as f:
+        f.truncate(64 * 1024 * 1024)
+
+    device = tmp_path / "devices" / "pci0000:00" / "0000:00:14.0" / "usb2" / "2-1" / "host6" / "target6:0:0" / "6:0:0:0"
+    device.mkdir(parents=True)
+    sys_block = tmp_path / "sys" / "block"
+    (sys_block / "sda" / "queue").mkdir(parents=True)
+    (sys_block / "sda" / "queue" / "rotational").write_text("0\n")
+    os.symlink(device, sys_block / "sda" / "device")
+
+    return str(dev), str(sys_block)
+
+
+def test__measure(tree):
+    dev, sys_block = tree
+    result = measure("sda", 0.1, dev, sys_block)
+    assert result.sequential_read > 0
+    assert result.random_read_iops > 0
+    assert (result.rotational, result.transport) == (False, "usb")
+
+
+def test__measure_missing(tree):
+    dev, sys_block = tree
+    assert measure("sdb", 0.1, dev, sys_block) is None
+
+
+def disk(name, sequential_read=None, random_read_iops=0):
+    return Disk(name, 16 * 1024 ** 3, "Model", "", [], False, performance=None if sequential_read is None else
+                DiskPerformance(sequential_read, random_read_iops, False, None))
+
+
+def test__performance_key():
+    disks = [disk("nvme0n1"), disk("sda", 40), disk("sdb", 550, 90000), disk("sdc", 550, 100), disk("sdd")]
+    assert [d.name for d in sorted(disks, key=performance_key)] == ["sdb", "sdc", "sda", "nvme0n1", "sdd"]
+
+
+@pytest.mark.asyncio
+async def test__probe_disks_cached(monkeypatch):
+    result = DiskPerformance(100, 1000, True, "sata")
+    monkeypatch.setattr(performance, "measure", lambda name, duration: result)
+    monkeypatch.setattr(performance, "_cache", {})
+
+    disks = [disk("sda")]
+    await probe_disks(disks)
+    assert disks[0].performance == result
+    assert performance.cached_performance(disk("sda")) == result
+    assert performance.cached_performance(disk("sdb")) is None
+
+
+@pytest.mark.asyncio
+async def test__menu_probes_disks_once(monkeypatch):
+    results = {"sda": DiskPerformance(40, 100, False, "usb"), "nvme0n1": DiskPerformance(3000, 500000, False, "nvme")}
+    measured = []
+    listed = []
+
+    def measure(name, duration):
+        measured.append(name)
+        return results[name]
+
+    async def list_disks():
+        # A fresh snapshot every time, like after a rescan
+        return [disk("sda"), disk("nvme0n1")]
+
+    async def dialog_menu(title, items):
+        pass
+
+    async def dialog_checklist(title, text, items):
+        listed.append(list(items))
+        raise asyncio.CancelledError()
+
+    monkeypatch.setattr(performance, "measure", measure)
+    monkeypatch.setattr(performance, "_cache", {})
+    for name, fn in [("list_disks", list_disks), ("dialog_menu", dialog_menu), ("dialog_checklist", dialog_checklist)]:
+        monkeypatch.setattr(installer_menu, name, fn)
+
+    menu = installer_menu.InstallerMenu(Installer("25.04", "TrueNAS"))
+    await menu.run()
+    for _ in range(2):
+        with pytest.raises(asyncio.CancelledError):
+            await menu._install_upgrade_internal()
+
+    assert sorted(measured) == ["nvme0n1", "sda"]
+    assert listed == [["nvme0n1", "sda"]] * 2
@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+
+from truenas_installer.disks import Disk
+from truenas_installer.install import install
+from truenas_installer.plan import Plan
+
+
+class Steps:
+    """
+    Creates plan steps that record their calls and how many of them run at the same time.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, name, error=None, duration=0.01):
+        async def fn():
+            self.calls.append(name)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                await asyncio.sleep(duration)
+            finally:
+                self.running -= 1
+
+            if error is not None:
+                raise error
+
+            return name
+
+        return fn
+
+
+@pytest.mark.asyncio
+async def test__concurrency():
+    steps = Steps()
+    plan = Plan()
+    for i in range(6):
+        plan.add(f"format:sd{i}", steps(f"format:sd{i}"))
+
+    assert await plan.run(concurrency=2) == {f"format:sd{i}": f"format:sd{i}" for i in range(6)}
+    assert steps.max_running == 2
+
+
+@pytest.mark.asyncio
+async def test__unbounded_steps_do_not_count_against_concurrency():
+    steps = Steps()
+    plan = Plan()
+    plan.add("verify_media", steps("verify_media", duration=0.1), bounded=False)
+    for i in range(4):
+        plan.add(f"format:sd{i}", steps(f"format:sd{i}"))
+
+    await plan.run(concurrency=2)
+    assert steps.max_running == 3
+
+
+@pytest.mark.asyncio
+async def test__failure():
+    steps = Steps()
+    error = ValueError("Unable to mount media")
+    plan = Plan()
+    plan.add("mount_media", steps("mount_media", error))
+    plan.add("format:sda", steps("format:sda", duration=0.05))
+    plan.add("install_image", steps("install_image"), requires=["mount_media", "format:sda"])
+    plan.add("export_boot_pool", steps("export_boot_pool"), requires=["format:sda"], after=["install_image"])
+    plan.add("unmount_media", steps("unmount_media"), requires=["mount_media"], after=["install_image"])
+
+    with pytest.raises(ValueError) as e:
+        await plan.run()
+
+    assert e.value is error
+    # Steps that are already running are allowed to finish, steps that require the failed one are skipped, cleanup
+    # steps run as long as the steps they require have succeeded
+    assert steps.calls == ["mount_media", "format:sda", "export_boot_pool"]
+    assert set(plan.results) == {"format:sda", "export_boot_pool"}
+
+
+@pytest.mark.asyncio
+async def test__skipped_steps_skip_their_dependents():
+    steps = Steps()
+    plan = Plan()
+    plan.add("check_media", steps("check_media", ValueError("Invalid media")))
+    plan.add("format:sda", steps("format:sda"), requires=["check_media"])
+    plan.add("partitions:sda", steps("partitions:sda"), requires=["format:sda"])
+    plan.add("hostid", steps("hostid"))
+
+    with pytest.raises(ValueError):
+        await plan.run()
+
+    assert steps.calls == ["check_media", "hostid"]
+
+
+@pytest.mark.asyncio
+async def test__cancelled_cleanup_failure_does_not_stop_cleanup():
+    steps = Steps()
+    started = asyncio.Event()
+
+    async def install_image():
+        started.set()
+        await asyncio.sleep(60)
+
+    plan = Plan()
+    plan.add("mount_media", steps("mount_media"))
+    plan.add("install_image", install_image, requires=["mount_media"])
+    plan.add("unmount_media", steps("unmount_media", OSError("Device busy")), requires=["mount_media"],
+             after=["install_image"])
+    plan.add("export_boot_pool", steps("export_boot_pool"), after=["install_image", "unmount_media"])
+
+    task = asyncio.create_task(plan.run())
+    await asyncio.wait_for(started.wait(), 5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert steps.calls == ["mount_media", "unmount_media", "export_boot_pool"]
+
+
+@pytest.mark.parametrize("add,error", [
+    (
+        lambda plan: (plan.add("a", None, requires=["b"]), plan.add("b", None, after=["a"])),
+        "Dependency cycle between steps a, b",
+    ),
+    (
+        lambda plan: plan.add("a", None, requires=["missing"]),
+        "Step 'a' depends on unknown step 'missing'",
+    ),
+    (
+        lambda plan: (plan.add("a", None), plan.add("a", None)),
+        "Step 'a' is already defined",
+    ),
+])
+def test__invalid_plan(add, error):
+    plan = Plan()
+    with pytest.raises(ValueError) as e:
+        add(plan)
+        plan.describe()
+
+    assert str(e.value) == error
+
+
+@pytest.mark.asyncio
+async def test__invalid_plan_does_not_run():
+    steps = Steps()
+    plan = Plan()
+    plan.add("a", steps("a"))
+    plan.add("b", steps("b"), requires=["missing"])
+
+    with pytest.raises(ValueError):
+        await plan.run()
+
+    assert steps.calls == []
+
+
+def test__describe():
+    plan = Plan()
+    plan.add("check_media", None)
+    plan.add("geometry", None)
+    plan.add("format:sda", None, requires=["check_media", "geometry"])
+    plan.add("install_image", None, requires=["format:sda"])
+    plan.add("unmount_media", None, requires=["check_media"], after=["install_image"])
+
+    assert plan.describe() == [
+        "Stage 1: check_media, geometry (concurrently)",
+        "Stage 2: format:sda",
+        "  format:sda <- check_media, geometry",
+        "Stage 3: install_image",
+        "  install_image <- format:sda",
+        "Stage 4: unmount_media",
+        "  unmount_media <- check_media, install_image (any outcome)",
+    ]
+
+
+@pytest.mark.asyncio
+async def test__install_dry_run():
+    messages = []
+    disks = [Disk(name, 16 * 1024 ** 3, "Model", "", [], False) for name in ["sda", "sdb"]]
+    await install(disks, [Disk("sdc", 16 * 1024 ** 3, "Model", "", [], False)], False, None, None, None,
+                  lambda progress, message: messages.append(message), dry_run=True)
+
+    assert messages[0] == "Stage 1: check_media, verify_media, hostid, geometry (concurrently)"
+    assert "Stage 2: mount_media, format:sda, format:sdb, wipe:sdc (concurrently)" in messages
+    # A corrupt image stops the installation before any disk is touched
+    assert "  format:sda <- check_media, verify_media, geometry" in messages
+    assert "  wipe:sdc <- check_media, verify_media" in messages
+    assert ("  create_boot_pool <- verify_media, hostid, geometry, partitions:sda, partitions:sdb, wipe:sdc"
+            in messages)
+    assert messages[-1] == "  export_boot_pool <- create_boot_pool, install_image (any outcome)"
@@ -0,0 +1,96 @@
+import hashlib
+import os
+
+import pytest
+
+from truenas_installer import staging
+from truenas_installer.media import InstallMedia
+from truenas_installer.staging import MediaStager
+
+IMAGE = os.urandom(3 * 1024 * 1024 + 123)
+
+
+@pytest.fixture
+def stager(tmp_path, monkeypatch):
+    monkeypatch.setattr(staging, "READ_SIZE", 1024 * 1024)
+    monkeypatch.setattr(staging, "MEMORY_RESERVE", 0)
+
+    path = tmp_path / "rootfs.squashfs"
+    path.write_bytes(IMAGE)
+    return MediaStager(str(path), str(tmp_path / "shm"))
+
+
+@pytest.mark.asyncio
+async def test__staged(stager):
+    assert stager.status() == {"state": "idle", "progress": 0, "size": 0}
+
+    stager.start()
+    assert await stager.mount_source() == (stager.staged_path, True)
+
+    assert stager.status() == {"state": "staged", "progress": 1, "size": len(IMAGE)}
+    assert stager.sha256 == hashlib.sha256(IMAGE).hexdigest()
+    with open(stager.staged_path, "rb") as f:
+        assert f.read() == IMAGE
+    assert os.listdir(stager.directory) == [os.path.basename(stager.staged_path)]
+
+
+@pytest.mark.asyncio
+async def test__not_enough_memory(stager, monkeypatch):
+    monkeypatch.setattr(stager, "_fits_in_memory", lambda: False)
+
+    stager.start()
+    await stager.wait()
+
+    assert stager.state == "cached"
+    assert stager.sha256 == hashlib.sha256(IMAGE).hexdigest()
+    assert await stager.mount_source() == (stager.path, False)
+    assert not os.path.exists(stager.staged_path)
+
+
+@pytest.mark.asyncio
+async def test__failed(stager):
+    os.unlink(stager.path)
+
+    stager.start()
+    await stager.wait()
+
+    assert stager.state == "failed"
+    assert stager.sha256 is None
+    assert await stager.mount_source() == (stager.path, False)
+
+
+@pytest.mark.asyncio
+async def test__stopped(stager):
+    stager.stop()
+    stager.start()
+    await stager.wait()
+
+    assert (stager.state, stager.error) == ("failed", "Staging was stopped")
+    # The partial copy is removed
+    assert os.listdir(stager.directory) == []
+
+
+@pytest.mark.asyncio
+async def test__released_after_unmount(stager):
+    stager.start()
+    await stager.wait()
+    media = InstallMedia(stager.path, stager)
+
+    await media.unmount()
+
+    assert stager.state == "released"
+    assert not os.path.exists(stager.staged_path)
+    # The checksum is still known, the original media is mounted from now on
+    assert stager.sha256 == hashlib.sha256(IMAGE).hexdigest()
+    assert await stager.mount_source() == (stager.path, False)
+
+
+@pytest.mark.asyncio
+async def test__released_on_shutdown(stager):
+    stager.start()
+    await stager.wait()
+
+    await stager.on_shutdown(None)
+
+    assert stager.state == "released"
+    assert not os.path.exists(stager.staged_path)
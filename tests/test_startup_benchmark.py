@@ -0,0 +1,118 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+# Modules that only the server needs (or nothing needs before the first dialog)
+SERVER_MODULES = {"aiohttp", "aiohttp_rpc", "jsonschema", "pyroute2"}
+LAZY_MODULES = SERVER_MODULES | {"humanfriendly", "ixhardware"}
+STARTUP_TIMEOUT = 30
+
+
+def python(code, *args, **kwargs):
+    return subprocess.Popen([sys.executable, *args, "-c", textwrap.dedent(code)], **kwargs)
+
+
+def loaded_modules(module):
+    process = python(f"""\
+        import json
+        import sys
+        import {module}
+        print(json.dumps(sorted(name for name in sys.modules if "." not in name)))
+    """, stdout=subprocess.PIPE)
+    stdout, _ = process.communicate(timeout=STARTUP_TIMEOUT)
+    assert process.returncode == 0
+    return set(json.loads(stdout))
+
+
+def import_time(module):
+    """
+    Cumulative import time of `module` (in seconds), as reported by `python -X importtime`.
+    """
+    process = python(f"import {module}", "-X", "importtime", stderr=subprocess.PIPE)
+    _, stderr = process.communicate(timeout=STARTUP_TIMEOUT)
+    assert process.returncode == 0
+    for line in stderr.decode().splitlines():
+        _, _, cumulative, name = [column.strip() for column in line.replace(":", "|", 1).split("|")]
+        if name == module:
+            return int(cumulative) / 1e6
+
+
+def wait_for(condition, process):
+    start = time.monotonic()
+    while not condition():
+        assert process.poll() is None, "The installer has exited"
+        assert time.monotonic() - start < STARTUP_TIMEOUT, "The installer has not started"
+        time.sleep(0.005)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def connectable(port):
+    try:
+        socket.create_connection(("127.0.0.1", port), 0.1).close()
+    except OSError:
+        return False
+
+    return True
+
+
+@pytest.mark.parametrize("module", ["truenas_installer.__main__", "truenas_installer.installer_menu"])
+def test__lazy_imports(module):
+    assert not loaded_modules(module) & LAZY_MODULES
+
+
+def test__server_startup():
+    port = free_port()
+    start = time.monotonic()
+    server = python(f"""\
+        from truenas_installer.__main__ import run_server
+        from truenas_installer.installer import Installer
+        run_server(Installer("benchmark", "TrueNAS"), {port}, staging=False)
+    """, stdout=subprocess.DEVNULL)
+    try:
+        wait_for(lambda: connectable(port), server)
+        server_startup = time.monotonic() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    print()
+    print(f"server startup | listening after {server_startup:.3f}s")
+
+
+def test__first_dialog(tmp_path):
+    # Records when the console shows its first dialog and then cancels it
+    (tmp_path / "dialog").write_text(f"#!/bin/sh\ntouch {tmp_path / 'shown'}\nexit 1\n")
+    (tmp_path / "dialog").chmod(0o755)
+
+    start = time.monotonic()
+    menu = python("""\
+        from truenas_installer.__main__ import run_menu
+        from truenas_installer.installer import Installer
+        run_menu(Installer("benchmark", "TrueNAS"), staging=False)
+    """, env={**os.environ, "PATH": f"{tmp_path}:{os.environ['PATH']}"})
+    try:
+        wait_for(lambda: (tmp_path / "shown").exists(), menu)
+        first_dialog = time.monotonic() - start
+    finally:
+        menu.terminate()
+        menu.wait()
+
+    entry_point = import_time("truenas_installer.__main__")
+    server = import_time("truenas_installer.server")
+
+    print()
+    print(f"startup | import entry point {entry_point:.3f}s | import server {server:.3f}s | "
+          f"first dialog {first_dialog:.3f}s")
+
+    assert entry_point < server
@@ -0,0 +1,43 @@
+import asyncio
+import gc
+import weakref
+
+import pytest
+
+from truenas_installer.trace import Tracer, tracer
+from truenas_installer.utils import run
+
+
+@pytest.mark.asyncio
+async def test__commands_outside_of_recording_are_not_traced():
+    with tracer.recording():
+        await run(["true"])
+
+    for _ in range(100):
+        await run(["true"])
+
+    assert [event["args"]["args"] for event in tracer.events if event.get("cat") == "subprocess"] == ["true"]
+
+
+@pytest.mark.asyncio
+async def test__tracks():
+    tracer_ = Tracer()
+
+    async def step():
+        with tracer_.span("step", "step"):
+            await asyncio.sleep(0)
+
+    with tracer_.recording():
+        task = asyncio.get_running_loop().create_task(step(), name="format_disk")
+        await task
+        await asyncio.gather(*[step() for _ in range(3)])
+
+    tracks = [event["args"]["name"] for event in tracer_.events if event["ph"] == "M"]
+    assert tracks[0] == "format_disk"
+    assert len(tracks) == 4
+
+    # Finished tasks are not kept alive by the tracer
+    task_ref = weakref.ref(task)
+    del task
+    gc.collect()
+    assert task_ref() is None
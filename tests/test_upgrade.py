@@ -0,0 +1,108 @@
+from unittest.mock import patch
+
+import pytest
+
+from truenas_installer import upgrade as upgrade_module
+from truenas_installer.cassette import Cassette, replaying
+from truenas_installer.disks import Disk, ZFSMember
+from truenas_installer.exception import InstallError
+from truenas_installer.trace import tracer
+from truenas_installer.upgrade import upgrade
+
+
+class FakeMedia:
+    mountpoint = "/tmp/media"
+
+    def __init__(self, stager):
+        pass
+
+    def check(self):
+        pass
+
+    async def verify(self, callback=None):
+        pass
+
+    async def mount(self):
+        return self.mountpoint
+
+    async def unmount(self):
+        pass
+
+
+def interaction(args, stdout="", returncode=0):
+    return {"args": args, "returncode": returncode, "stdout": stdout, "stderr": "", "duration": 0}
+
+
+def cassette(boot_environments_after, bootfs_after="boot-pool/ROOT/24.04"):
+    return Cassette([
+        interaction(["zpool", "list", "-H", "-o", "name", "boot-pool"], returncode=1),
+        interaction(["zpool", "import", "-f", "-N", "-o", "cachefile=none", "boot-pool"]),
+        interaction(["zpool", "get", "-H", "-o", "value", "bootfs", "boot-pool"], "boot-pool/ROOT/24.04\n"),
+        interaction(["zpool", "get", "-H", "-o", "value", "bootfs", "boot-pool"], f"{bootfs_after}\n"),
+        interaction(["zfs", "list", "-H", "-o", "name", "-d", "1", "boot-pool/ROOT"],
+                    "boot-pool/ROOT\nboot-pool/ROOT/24.04\n"),
+        interaction(["zfs", "list", "-H", "-o", "name", "-d", "1", "boot-pool/ROOT"],
+                    "\n".join(["boot-pool/ROOT"] + boot_environments_after) + "\n"),
+        interaction(["zfs", "get", "-H", "-o", "value", "mountpoint", "boot-pool/ROOT/24.04"], "legacy\n"),
+        interaction(["mount", "-t", "zfs", "-o", "ro", "boot-pool/ROOT/24.04", "/tmp/old_root"]),
+        interaction(["zpool", "set", "bootfs=boot-pool/ROOT/24.10", "boot-pool"]),
+        interaction(["umount", "-f", "/tmp/old_root"]),
+        interaction(["zpool", "export", "-f", "boot-pool"]),
+    ])
+
+
+@pytest.fixture
+def environment(tmp_path):
+    installer_calls = []
+
+    async def run_installer(disks, authentication, post_install, sql, src, callback, old_root=None):
+        installer_calls.append((disks, src, old_root))
+
+    with patch.object(upgrade_module, "InstallMedia", FakeMedia):
+        with patch.object(upgrade_module, "run_installer", run_installer):
+            with patch("tempfile.mkdtemp", lambda: "/tmp/old_root"):
+                with patch("os.rmdir"):
+                    with patch.object(upgrade_module.installation_lock, "path", tmp_path / "lock"):
+                        with patch.object(upgrade_module.tracer, "path", str(tmp_path / "trace.json")):
+                            yield installer_calls
+
+
+def boot_disk(name):
+    return Disk(name, 16 * 1024 ** 3, "Model", 'zfs-"boot-pool"', [ZFSMember(f"{name}3", "boot-pool")], False)
+
+
+@pytest.mark.asyncio
+async def test__upgrade(environment):
+    with replaying(cassette(["boot-pool/ROOT/24.04", "boot-pool/ROOT/24.10"])):
+        await upgrade([boot_disk("sda"), boot_disk("sdb")], None, lambda progress, message: None)
+
+    assert environment == [(["sda", "sdb"], "/tmp/media", "/tmp/old_root")]
+    commands = [event["args"]["args"] for event in tracer.events if event.get("cat") == "subprocess"]
+    assert "zpool set bootfs=boot-pool/ROOT/24.10 boot-pool" in commands
+    assert commands[-1] == "zpool export -f boot-pool"
+
+
+@pytest.mark.asyncio
+async def test__upgrade_new_boot_environment_not_found(environment):
+    with replaying(cassette(["boot-pool/ROOT/24.04"])):
+        with pytest.raises(InstallError) as e:
+            await upgrade([boot_disk("sda")], None, lambda progress, message: None)
+
+    assert e.value.message == "Unable to find the new boot environment"
+
+
+@pytest.mark.asyncio
+async def test__upgrade_requires_boot_pool():
+    with pytest.raises(InstallError):
+        await upgrade([Disk("sda", 16 * 1024 ** 3, "Model", "", [], False)], None, lambda progress, message: None)
+
+
+@pytest.mark.asyncio
+async def test__upgrade_requires_single_boot_pool():
+    disks = [boot_disk("sda"), boot_disk("sdb")]
+    disks[0].zfs_members[0].pool_guid = "1"
+    disks[1].zfs_members[0].pool_guid = "2"
+    with pytest.raises(InstallError) as e:
+        await upgrade(disks, None, lambda progress, message: None)
+
+    assert e.value.message == "Disk(s) sda, sdb contain different boot pools"
@@ -0,0 +1,118 @@
+import os
+import struct
+
+import pytest
+
+from truenas_installer.disks import Disk
+from truenas_installer.gpt import write_partition_table
+from truenas_installer.wipe import ZFS_LABEL_SIZE, _wipe, signature_ranges, wipe_disk
+
+MiB = 1024 ** 2
+GiB = 1024 ** 3
+# Within every ZFS label
+UBERBLOCK_OFFSET = 128 * 1024
+UBERBLOCK_MAGIC = struct.pack("<Q", 0x00bab10c)
+EXT4_MAGIC_OFFSET = 1024 + 56
+EXT4_MAGIC = struct.pack("<H", 0xef53)
+XFS_MAGIC = b"XFSB"
+DATA = b"\xaa" * MiB
+
+
+def write_signatures(f, offset, size):
+    """
+    Writes xfs, ext4 and ZFS (all four labels) signatures to the device or partition at `offset` of `size` bytes.
+    Returns the offsets they have been written to.
+    """
+    aligned_size = size // ZFS_LABEL_SIZE * ZFS_LABEL_SIZE
+    signatures = {offset: XFS_MAGIC, offset + EXT4_MAGIC_OFFSET: EXT4_MAGIC}
+    for label_offset in [0, ZFS_LABEL_SIZE, aligned_size - 2 * ZFS_LABEL_SIZE, aligned_size - ZFS_LABEL_SIZE]:
+        signatures[offset + label_offset + UBERBLOCK_OFFSET] = UBERBLOCK_MAGIC
+
+    for signature_offset, signature in signatures.items():
+        os.pwrite(f, signature, signature_offset)
+
+    return signatures
+
+
+def assert_zeroed(f, signatures):
+    for signature_offset, signature in signatures.items():
+        assert os.pread(f, len(signature), signature_offset) == bytes(len(signature)), signature_offset
+
+
+def test__signature_ranges():
+    size = 64 * MiB + 100 * 1024
+    assert signature_ranges(MiB, size) == [(MiB, 3 * MiB // 2), (MiB + 64 * MiB - MiB // 2, MiB + size)]
+    # Tiny partitions are wiped as a whole
+    assert signature_ranges(0, 100 * 1024) == [(0, 100 * 1024), (0, 100 * 1024)]
+
+
+def test__image_file(tmp_path):
+    # Not a multiple of the ZFS label size, so that the last two labels are not at the very end
+    size = GiB + 100 * 1024
+    image = tmp_path / "disk.img"
+    with open(image, "wb") as f:
+        f.truncate(size)
+
+    write_partition_table(str(image), False)
+    fd = os.open(image, os.O_RDWR)
+    try:
+        signatures = write_signatures(fd, 0, size)
+        data_offsets = [4 * MiB, GiB - ZFS_LABEL_SIZE * 2 - MiB]
+        for data_offset in data_offsets:
+            os.pwrite(fd, DATA, data_offset)
+
+        assert _wipe(str(image), False) == []
+
+        assert_zeroed(fd, signatures)
+        # Protective MBR, primary and backup GPT headers
+        assert os.pread(fd, 2, 510) == bytes(2)
+        assert os.pread(fd, 8, 512) == bytes(8)
+        assert os.pread(fd, 8, size - 512) == bytes(8)
+        for data_offset in data_offsets:
+            assert os.pread(fd, len(DATA), data_offset) == DATA
+    finally:
+        os.close(fd)
+
+
+def test__discard_image_file(tmp_path):
+    image = tmp_path / "disk.img"
+    with open(image, "wb") as f:
+        f.truncate(4 * MiB)
+
+    assert _wipe(str(image), True) == [f"unable to discard {image}: not a block device"]
+
+
+def test__unable_to_open(tmp_path):
+    assert _wipe(str(tmp_path / "missing"), False)[0].startswith("unable to open")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("discard", [False, True])
+async def test__loop_device(loop_device, discard):
+    device = loop_device(GiB)
+    name = device.removeprefix("/dev/")
+    partition = write_partition_table(device, False)[-1]
+    offset = partition.first_lba * 512
+    size = (partition.last_lba - partition.first_lba + 1) * 512
+
+    fd = os.open(device, os.O_RDWR)
+    try:
+        signatures = write_signatures(fd, offset, size)
+        data_offset = offset + 16 * MiB
+        os.pwrite(fd, DATA, data_offset)
+        os.fsync(fd)
+
+        warnings = []
+        await wipe_disk(Disk(name, GiB, "", "", [], False), lambda progress, message: warnings.append(message),
+                        discard)
+        assert warnings == []
+
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        # The partitions (found in sysfs) are wiped too
+        assert_zeroed(fd, signatures)
+        # Discard erases everything
+        assert os.pread(fd, len(DATA), data_offset) == (bytes(len(DATA)) if discard else DATA)
+        # The kernel has forgotten about the partitions
+        assert not os.path.exists(f"/sys/class/block/{name}p{partition.number}")
+    finally:
+        os.close(fd)
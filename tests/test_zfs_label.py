@@ -0,0 +1,90 @@
+import os
+import struct
+
+from test_block_devices import pack_nvlist
+
+from truenas_installer.disks import Disk, ZFSMember
+from truenas_installer.upgrade import boot_pool_disks, stale_boot_pool_disks
+from truenas_installer.zfs_label import LABEL_SIZE, read_vdev_label
+
+SIZE = 64 * 1024 * 1024
+
+
+def config(txg, pool_guid=0x1234567890abcdef, ashift=12):
+    return pack_nvlist({
+        "version": 5000,
+        "name": "boot-pool",
+        "state": 0,
+        "txg": txg,
+        "pool_guid": pool_guid,
+        "hostid": 0x7f0101,
+        "hostname": "truenas",
+        "top_guid": 0x1111,
+        "guid": 0x1111,
+        "vdev_children": 1,
+        "vdev_tree": {"type": "disk", "id": 0, "guid": 0x1111, "ashift": ashift, "path": "/dev/sda3"},
+    })
+
+
+def write_labels(path, labels, byteorder="<", ashift=12):
+    """
+    `labels` are `(config txg, uberblock txgs)` for L0..L3, `None` for a damaged label.
+    """
+    with open(path, "wb") as f:
+        f.truncate(SIZE)
+
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        for offset, label in zip([0, LABEL_SIZE, SIZE - 2 * LABEL_SIZE, SIZE - LABEL_SIZE], labels):
+            if label is None:
+                continue
+
+            txg, uberblock_txgs = label
+            os.pwrite(fd, config(txg, ashift=ashift), offset + 16 * 1024)
+            for i, uberblock_txg in enumerate(uberblock_txgs):
+                os.pwrite(fd, struct.pack(f"{byteorder}QQQQQ", 0x00bab10c, 5000, uberblock_txg, 0, 1700000000 + i),
+                          offset + 128 * 1024 + i * (1 << ashift))
+    finally:
+        os.close(fd)
+
+
+def test__read(tmp_path):
+    write_labels(tmp_path / "sda3", [(40, [38, 39, 40, 41])] * 4)
+    label = read_vdev_label(str(tmp_path / "sda3"))
+    assert (label.pool, label.pool_guid, label.guid, label.txg, label.hostid, label.hostname, label.labels) == (
+        "boot-pool", 0x1234567890abcdef, 0x1111, 41, 0x7f0101, "truenas", 4,
+    )
+    assert label.vdev_tree["path"] == "/dev/sda3"
+
+
+def test__damaged_labels(tmp_path):
+    # The label written last wins, uberblocks are only searched within 4 KiB slots
+    write_labels(tmp_path / "sda3", [None, (30, [30]), (35, [35, 36]), None], byteorder=">")
+    label = read_vdev_label(str(tmp_path / "sda3"))
+    assert (label.txg, label.labels) == (36, 2)
+
+
+def test__no_label(tmp_path):
+    with open(tmp_path / "sda3", "wb") as f:
+        f.truncate(SIZE)
+
+    assert read_vdev_label(str(tmp_path / "sda3")) is None
+    assert read_vdev_label(str(tmp_path / "missing")) is None
+
+
+def disk(name, pool_guid, txg, timestamp=None):
+    return Disk(name, 16 * 1024 ** 3, "Model", 'zfs-"boot-pool"',
+                [ZFSMember(f"{name}3", "boot-pool", pool_guid, txg, timestamp)], False)
+
+
+def test__stale_boot_pools():
+    disks = [disk("sda", "1", 500), disk("sdb", "2", 9000), disk("sdc", "2", 8999), disk("sdd", None, None)]
+    assert [d.name for d in boot_pool_disks(disks)] == ["sdb", "sdc"]
+    assert [d.name for d in stale_boot_pool_disks(disks)] == ["sda", "sdd"]
+
+
+def test__stale_boot_pool_with_more_transactions():
+    # The old pool has been used for years, the new one has just been installed: txg order says the opposite
+    disks = [disk("sda", "1", 250000, 1600000000), disk("sdb", "2", 40, 1700000000), disk("sdc", "2", 38, 1699999990)]
+    assert [d.name for d in boot_pool_disks(disks)] == ["sdb", "sdc"]
+    assert [d.name for d in stale_boot_pool_disks(disks)] == ["sda"]
@@ -1,23 +1,29 @@
 import argparse
 import asyncio
+import contextlib
 import json
 
-from aiohttp import web
-
-from ixhardware import parse_dmi
-
 from .installer import Installer
-from .installer_menu import InstallerMenu
-from .server import InstallerRPCServer
-from .server.doc import generate_api_doc
+
+# Every mode imports only what it uses: the server stack (aiohttp, aiohttp_rpc, jsonschema, ...) costs more to import
+# than the whole TUI, and the console should show its first dialog as soon as possible.
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--doc", action="store_true")
     parser.add_argument("--server", action="store_true")
+    parser.add_argument("--no-staging", action="store_true")
+    parser.add_argument("--validate-results", action="store_true")
+    parser.add_argument("--record-cassette", metavar="PATH",
+                        help="record every command the installer runs (and its output) to a cassette")
     args = parser.parse_args()
 
+    if args.doc:
+        from .server.doc import generate_api_doc
+        generate_api_doc()
+        return
+
     with open("/etc/version") as f:
         version = f.read().strip()
 
@@ -28,24 +34,59 @@ def main():
     except Exception:
         pass
 
-    dmi = parse_dmi()
-
-    installer = Installer(version, dmi, vendor)
+    installer = Installer(version, vendor)
 
-    if args.doc:
-        generate_api_doc()
-    elif args.server:
-        rpc_server = InstallerRPCServer(installer)
-        app = web.Application()
-        app.router.add_routes([
-            web.get("/", rpc_server.handle_http_request),
-        ])
-        app.on_shutdown.append(rpc_server.on_shutdown)
-        web.run_app(app, port=80)
+    if args.record_cassette is not None:
+        from .cassette import recording
+        cassette = recording(args.record_cassette)
     else:
-        loop = asyncio.get_event_loop()
-        loop.create_task(InstallerMenu(installer).run())
-        loop.run_forever()
+        cassette = contextlib.nullcontext()
+
+    with cassette:
+        if args.server:
+            run_server(installer, staging=not args.no_staging, validate_results=args.validate_results)
+        else:
+            run_menu(installer, staging=not args.no_staging)
+
+
+def run_server(installer, port=80, staging=True, validate_results=False):
+    from aiohttp import web
+
+    from .disks import disk_inventory
+    from .hotplug import hotplug_monitor
+    from .metrics import loop_lag_monitor
+    from .server import InstallerRPCServer
+    from .staging import media_stager
+
+    rpc_server = InstallerRPCServer(installer, validate_results)
+    app = web.Application()
+    app.router.add_routes([
+        web.get("/", rpc_server.handle_http_request),
+        web.get("/metrics", rpc_server.handle_metrics),
+    ])
+    app.on_shutdown.append(rpc_server.on_shutdown)
+    app.on_startup.append(loop_lag_monitor.on_startup)
+    app.on_shutdown.append(loop_lag_monitor.on_shutdown)
+    app.on_startup.append(disk_inventory.on_startup)
+    app.on_shutdown.append(disk_inventory.on_shutdown)
+    app.on_shutdown.append(hotplug_monitor.on_shutdown)
+    if staging:
+        app.on_startup.append(media_stager.on_startup)
+        app.on_shutdown.append(media_stager.on_shutdown)
+    web.run_app(app, port=port)
+
+
+def run_menu(installer, staging=True):
+    from .disks import disk_inventory
+    from .installer_menu import InstallerMenu
+    from .staging import media_stager
+
+    loop = asyncio.get_event_loop()
+    disk_inventory.start()
+    if staging:
+        media_stager.start()
+    loop.create_task(InstallerMenu(installer).run())
+    loop.run_forever()
 
 
 if __name__ == "__main__":
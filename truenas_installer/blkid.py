@@ -0,0 +1,370 @@
+import os
+import struct
+
+from .nvlist import NVListError, unpack_nvlist
+
+__all__ = ["probe_filesystem"]
+
+MD_SB_MAGIC = 0xa92b4efc
+MD_SB_1 = struct.Struct("<II")
+MD_SB_1_SUPER_OFFSET = 144
+MD_SB_1_SET_NAME = slice(32, 64)
+
+EXT_SUPERBLOCK_OFFSET = 1024
+EXT_MAGIC = 0xef53
+EXT_FEATURE_COMPAT_HAS_JOURNAL = 0x0004
+EXT_FEATURE_INCOMPAT_JOURNAL_DEV = 0x0008
+EXT2_FEATURE_INCOMPAT_SUPPORTED = 0x0002 | 0x0010
+EXT3_FEATURE_INCOMPAT_SUPPORTED = 0x0002 | 0x0004 | 0x0010
+EXT3_FEATURE_RO_COMPAT_SUPPORTED = 0x0001 | 0x0002 | 0x0004
+
+SWAP_PAGE_SIZES = [4096, 8192, 16384, 32768, 65536]
+SWAP_LABEL_OFFSET = 1024 + 28
+
+ISO9660_DESCRIPTORS_OFFSET = 32768
+ISO9660_DESCRIPTOR_SIZE = 2048
+
+NTFS_MFT_RECORD_VOLUME = 3
+NTFS_ATTR_VOLUME_NAME = 0x60
+NTFS_ATTR_END = 0xffffffff
+
+EXFAT_ENTRY_VOLUME_LABEL = 0x83
+
+ZFS_LABEL_SIZE = 256 * 1024
+ZFS_NVLIST_OFFSET = 16 * 1024
+ZFS_NVLIST_SIZE = 112 * 1024
+ZFS_UBERBLOCKS_OFFSET = 128 * 1024
+ZFS_UBERBLOCK_STEP = 1024
+ZFS_UBERBLOCK_MAGIC = 0x00bab10c
+# How many uberblocks must be found to consider a device a ZFS vdev
+ZFS_UBERBLOCKS_WANTED = 4
+
+
+class _Device:
+    def __init__(self, fd: int, size: int, partitions: list[tuple[int, int]]):
+        self.fd = fd
+        self.size = size
+        self.partitions = partitions
+
+    def read(self, offset: int, length: int) -> bytes:
+        if offset < 0 or offset + length > self.size:
+            return b""
+
+        return os.pread(self.fd, length, offset)
+
+    def covered_by_partition(self, offset: int, length: int) -> bool:
+        return any(start <= offset and offset + length <= start + size for start, size in self.partitions)
+
+
+def probe_filesystem(path: str, partitions: list[tuple[int, int]] = ()) -> tuple[str | None, str | None]:
+    """
+    Detects the filesystem (or other signature, i.e. `zfs_member` or `linux_raid_member`) on the device and its
+    label, the way `blkid` does, without running it.
+
+    `partitions` are `(offset, size)` of the device partitions in bytes. Signatures within them do not belong to the
+    device itself (this matters for ZFS labels, that are also found at the end of the device).
+
+    Unlike `blkid`, checksums are not verified, and if multiple signatures are present, the first one that is found
+    is reported (`blkid` reports none).
+
+    Returns `(fstype, label)`, `(None, None)` if nothing is found or the device can not be read.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    except OSError:
+        return None, None
+
+    try:
+        device = _Device(fd, os.lseek(fd, 0, os.SEEK_END), list(partitions))
+        for probe in PROBES:
+            try:
+                if result := probe(device):
+                    return result
+            except (OSError, struct.error, UnicodeDecodeError):
+                continue
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+    return None, None
+
+
+def _probe_linux_raid(device: _Device):
+    # Superblock versions 1.1, 1.2 and 1.0 (which is in the last 8..12 KiB, 4 KiB aligned)
+    for offset in [0, 4096, ((device.size // 512 - 16) & ~7) * 512]:
+        sb = device.read(offset, 256)
+        if len(sb) == 256:
+            magic, major_version = MD_SB_1.unpack_from(sb)
+            super_offset = struct.unpack_from("<Q", sb, MD_SB_1_SUPER_OFFSET)[0]
+            if magic == MD_SB_MAGIC and major_version == 1 and super_offset == offset // 512:
+                return "linux_raid_member", _string(sb[MD_SB_1_SET_NAME])
+
+    # Superblock version 0.90, in the last 64 KiB-aligned 64 KiB
+    if device.size >= 0x20000:
+        magic = device.read((device.size & ~0xffff) - 0x10000, 4)
+        if magic in (struct.pack("<I", MD_SB_MAGIC), struct.pack(">I", MD_SB_MAGIC)):
+            return "linux_raid_member", None
+
+
+def _probe_lvm2(device: _Device):
+    data = device.read(0, 4 * 512)
+    for sector in range(4):
+        label = data[sector * 512:(sector + 1) * 512]
+        if (
+            label[:8] == b"LABELONE" and
+            label[24:32] == b"LVM2 001" and
+            struct.unpack_from("<Q", label, 8)[0] == sector
+        ):
+            return "LVM2_member", None
+
+
+def _probe_luks(device: _Device):
+    header = device.read(0, 512)
+    if header[:6] != b"LUKS\xba\xbe":
+        return
+
+    version = struct.unpack_from(">H", header, 6)[0]
+    if version == 1:
+        return "crypto_LUKS", None
+    if version == 2 and struct.unpack_from(">Q", header, 256)[0] == 0:
+        return "crypto_LUKS", _string(header[24:72])
+
+
+def _probe_vfat(device: _Device):
+    sector = device.read(0, 512)
+    if len(sector) < 512 or sector[510:512] != b"\x55\xaa":
+        return
+
+    fat32 = sector[0x52:0x5a] == b"FAT32   " or sector[0x52:0x57] == b"MSWIN"
+    if not fat32 and sector[0x36:0x3b] not in (b"FAT12", b"FAT16", b"FAT  ", b"MSDOS"):
+        return
+
+    sector_size, cluster_size, reserved, fats, root_entries = struct.unpack_from("<HBHBH", sector, 0x0b)
+    media = sector[0x15]
+    fat_length = struct.unpack_from("<H", sector, 0x16)[0]
+    if (
+        not fats or not reserved or
+        not (media >= 0xf8 or media == 0xf0) or
+        not _power_of_2(cluster_size) or
+        not _power_of_2(sector_size) or not 512 <= sector_size <= 4096
+    ):
+        return
+
+    if fat32 or not fat_length:
+        fat_length = struct.unpack_from("<I", sector, 0x24)[0]
+        root_cluster = struct.unpack_from("<I", sector, 0x2c)[0]
+        data_start = (reserved + fats * fat_length) * sector_size
+        root = device.read(data_start + (root_cluster - 2) * cluster_size * sector_size, cluster_size * sector_size)
+    else:
+        root = device.read((reserved + fats * fat_length) * sector_size, root_entries * 32)
+
+    label = None
+    for offset in range(0, len(root) - 31, 32):
+        entry = root[offset:offset + 32]
+        if entry[0] == 0:
+            break
+        # Volume label entry (and not a long file name entry) that is not deleted
+        if entry[11] & 0x08 and entry[11] & 0x0f != 0x0f and entry[0] != 0xe5:
+            label = entry[:11]
+            if label[0] == 0x05:
+                label = b"\xe5" + label[1:]
+            break
+
+    # Like `blkid`, the label stored in the boot sector is ignored (it is only reported as `LABEL_FATBOOT`)
+    if label and label != b"NO NAME    ":
+        return "vfat", label.decode("cp437").rstrip(" ") or None
+
+    return "vfat", None
+
+
+def _probe_swap(device: _Device):
+    for page_size in SWAP_PAGE_SIZES:
+        magic = device.read(page_size - 10, 10)
+        if magic == b"SWAP-SPACE":
+            return "swap", None
+        if magic == b"SWAPSPACE2":
+            header = device.read(1024, 44)
+            version, last_page = struct.unpack_from("<II", header)
+            if version not in (1, 1 << 24) or last_page == 0:
+                return
+            return "swap", _string(device.read(SWAP_LABEL_OFFSET, 16))
+
+
+def _probe_xfs(device: _Device):
+    sb = device.read(0, 512)
+    if sb[:4] != b"XFSB":
+        return
+
+    block_size, data_blocks = struct.unpack_from(">IQ", sb, 4)
+    if not _power_of_2(block_size) or not 512 <= block_size <= 65536 or not data_blocks:
+        return
+
+    return "xfs", _string(sb[108:120])
+
+
+def _probe_ext(device: _Device):
+    sb = device.read(EXT_SUPERBLOCK_OFFSET, 1024)
+    if len(sb) < 1024 or struct.unpack_from("<H", sb, 0x38)[0] != EXT_MAGIC:
+        return
+
+    compat, incompat, ro_compat = struct.unpack_from("<III", sb, 0x5c)
+    label = _string(sb[0x78:0x88])
+    if incompat & EXT_FEATURE_INCOMPAT_JOURNAL_DEV:
+        return "jbd", label
+
+    # ext4 uses at least one feature that ext3 does not understand
+    ext3_unsupported = ro_compat & ~EXT3_FEATURE_RO_COMPAT_SUPPORTED or incompat & ~EXT3_FEATURE_INCOMPAT_SUPPORTED
+    if ext3_unsupported:
+        return "ext4", label
+
+    if compat & EXT_FEATURE_COMPAT_HAS_JOURNAL:
+        return "ext3", label
+
+    if not incompat & ~EXT2_FEATURE_INCOMPAT_SUPPORTED:
+        return "ext2", label
+
+
+def _probe_btrfs(device: _Device):
+    sb = device.read(0x10000, 0x1000)
+    if sb[0x40:0x48] == b"_BHRfS_M":
+        return "btrfs", _string(sb[0x12b:0x22b])
+
+
+def _probe_exfat(device: _Device):
+    sector = device.read(0, 512)
+    if sector[3:11] != b"EXFAT   " or sector[510:512] != b"\x55\xaa":
+        return
+
+    cluster_heap_offset, _, root_cluster = struct.unpack_from("<III", sector, 88)
+    sector_shift, cluster_shift = sector[108], sector[109]
+    if not 9 <= sector_shift <= 12 or cluster_shift > 25 - sector_shift:
+        return
+
+    cluster_size = 1 << (sector_shift + cluster_shift)
+    root = device.read((cluster_heap_offset << sector_shift) + (root_cluster - 2) * cluster_size, cluster_size)
+    for offset in range(0, len(root) - 31, 32):
+        entry = root[offset:offset + 32]
+        if entry[0] == 0:
+            break
+        if entry[0] == EXFAT_ENTRY_VOLUME_LABEL:
+            return "exfat", entry[2:2 + 2 * min(entry[1], 11)].decode("utf-16-le") or None
+
+    return "exfat", None
+
+
+def _probe_ntfs(device: _Device):
+    sector = device.read(0, 512)
+    if sector[3:11] != b"NTFS    ":
+        return
+
+    sector_size, sectors_per_cluster = struct.unpack_from("<HB", sector, 0x0b)
+    if not 256 <= sector_size <= 4096 or not _power_of_2(sectors_per_cluster):
+        return
+
+    total_sectors, mft_cluster = struct.unpack_from("<QQ", sector, 0x28)
+    clusters_per_mft_record = struct.unpack_from("<b", sector, 0x40)[0]
+    if clusters_per_mft_record > 0:
+        mft_record_size = clusters_per_mft_record * sectors_per_cluster * sector_size
+    else:
+        mft_record_size = 1 << -clusters_per_mft_record
+
+    if mft_cluster > total_sectors // sectors_per_cluster:
+        return
+
+    mft_offset = mft_cluster * sectors_per_cluster * sector_size
+    if device.read(mft_offset, 4) != b"FILE":
+        return
+
+    record = device.read(mft_offset + NTFS_MFT_RECORD_VOLUME * mft_record_size, mft_record_size)
+    if record[:4] != b"FILE":
+        return
+
+    offset = struct.unpack_from("<H", record, 0x14)[0]
+    while offset + 24 <= len(record):
+        attr_type, attr_length = struct.unpack_from("<II", record, offset)
+        if attr_type == NTFS_ATTR_END or not attr_length:
+            break
+        if attr_type == NTFS_ATTR_VOLUME_NAME:
+            value_length, value_offset = struct.unpack_from("<IH", record, offset + 0x10)
+            value = record[offset + value_offset:offset + value_offset + value_length]
+            return "ntfs", value.decode("utf-16-le") or None
+        offset += attr_length
+
+    return "ntfs", None
+
+
+def _probe_iso9660(device: _Device):
+    descriptor = device.read(ISO9660_DESCRIPTORS_OFFSET, ISO9660_DESCRIPTOR_SIZE)
+    if descriptor[1:6] == b"CD001":
+        # The first descriptor is not necessarily the primary one (i.e. boot record comes first for El Torito)
+        for i in range(16):
+            if descriptor[0] == 1:
+                return "iso9660", descriptor[40:72].decode("ascii", "replace").rstrip(" ") or None
+            if descriptor[0] == 255:
+                break
+            descriptor = device.read(ISO9660_DESCRIPTORS_OFFSET + (i + 1) * ISO9660_DESCRIPTOR_SIZE,
+                                     ISO9660_DESCRIPTOR_SIZE)
+
+        return "iso9660", None
+
+
+def _probe_squashfs(device: _Device):
+    if device.read(0, 4) in (b"hsqs", b"sqsh"):
+        return "squashfs", None
+
+
+def _probe_zfs(device: _Device):
+    alignment = device.size % ZFS_LABEL_SIZE
+    found = 0
+    for offset in [
+        0,
+        ZFS_LABEL_SIZE,
+        device.size - 2 * ZFS_LABEL_SIZE - alignment,
+        device.size - ZFS_LABEL_SIZE - alignment,
+    ]:
+        if device.covered_by_partition(offset, ZFS_LABEL_SIZE):
+            continue
+
+        uberblocks = device.read(offset + ZFS_UBERBLOCKS_OFFSET, ZFS_LABEL_SIZE - ZFS_UBERBLOCKS_OFFSET)
+        for ub_offset in range(0, len(uberblocks), ZFS_UBERBLOCK_STEP):
+            if uberblocks[ub_offset:ub_offset + 8] in (
+                struct.pack("<Q", ZFS_UBERBLOCK_MAGIC),
+                struct.pack(">Q", ZFS_UBERBLOCK_MAGIC),
+            ):
+                found += 1
+
+        if found >= ZFS_UBERBLOCKS_WANTED:
+            try:
+                label = unpack_nvlist(device.read(offset + ZFS_NVLIST_OFFSET, ZFS_NVLIST_SIZE))
+            except NVListError:
+                label = {}
+
+            name = label.get("name")
+            return "zfs_member", name if isinstance(name, str) else None
+
+
+# In roughly the same order `blkid` probes them
+PROBES = [
+    _probe_linux_raid,
+    _probe_lvm2,
+    _probe_luks,
+    _probe_vfat,
+    _probe_swap,
+    _probe_xfs,
+    _probe_ext,
+    _probe_iso9660,
+    _probe_squashfs,
+    _probe_btrfs,
+    _probe_exfat,
+    _probe_ntfs,
+    _probe_zfs,
+]
+
+
+def _string(data: bytes) -> str | None:
+    return data.split(b"\0", 1)[0].decode("utf-8", "replace").rstrip(" ") or None
+
+
+def _power_of_2(n: int) -> bool:
+    return n > 0 and n & (n - 1) == 0
@@ -0,0 +1,132 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from .blkid import probe_filesystem
+
+__all__ = ["iter_block_devices", "list_block_devices"]
+
+SYS_BLOCK = "/sys/block"
+DEV = "/dev"
+# Probing mostly waits for the disks, so many of them can be read at once
+PROBE_THREADS = 32
+# `lsblk` does not list RAM disks unless asked to
+RAM_DISK_MAJOR = "1"
+
+
+async def list_block_devices(sys_block: str = SYS_BLOCK, dev: str = DEV) -> list[dict]:
+    """
+    Lists block devices the same way `lsblk -b -fJ -o name,fstype,label,rm,size,model` does (returns its
+    `blockdevices`), by reading sysfs and probing filesystem signatures directly.
+    """
+    return sorted([device async for device in iter_block_devices(sys_block, dev)], key=lambda device: device["name"])
+
+
+async def iter_block_devices(sys_block: str = SYS_BLOCK, dev: str = DEV):
+    """
+    Same as `list_block_devices`, but yields every top-level device (with its children) as soon as it has been
+    probed, in no particular order.
+    """
+    devices = await asyncio.to_thread(_enumerate, sys_block, dev)
+
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(min(PROBE_THREADS, sum(len(probes) for _, probes in devices) or 1),
+                                  thread_name_prefix="probe")
+
+    async def probe(device, probes):
+        results = await asyncio.gather(*[
+            loop.run_in_executor(executor, probe_filesystem, path, partitions)
+            for _, path, partitions in probes
+        ])
+        for (probed, _, _), (fstype, label) in zip(probes, results):
+            probed["fstype"] = fstype
+            probed["label"] = label
+
+        return device
+
+    tasks = [asyncio.ensure_future(probe(device, probes)) for device, probes in devices]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _enumerate(sys_block: str, dev: str):
+    # `(device, probes)` for every top-level device
+    devices = []
+    for name in sorted(os.listdir(sys_block)):
+        path = os.path.join(sys_block, name)
+        # Devices built on top of other devices (i.e. `md` and `dm`) are listed as their children
+        if _listdir(os.path.join(path, "slaves")):
+            continue
+
+        if (_read(path, "dev") or "").split(":")[0] == RAM_DISK_MAJOR:
+            continue
+
+        # Neither does it list loop devices that are not set up
+        if name.startswith("loop") and _read(path, "size") == "0":
+            continue
+
+        probes = []
+        devices.append((_device(sys_block, dev, path, name, False, False, probes), probes))
+
+    return devices
+
+
+def _device(sys_block: str, dev: str, path: str, name: str, removable: bool, partition: bool, probes: list):
+    if not partition:
+        removable = _read(path, "removable") == "1"
+
+    device = {
+        "name": name,
+        "fstype": None,
+        "label": None,
+        "rm": removable,
+        "size": int(_read(path, "size") or 0) * 512,
+        "model": None,
+    }
+    if not partition and not _listdir(os.path.join(path, "slaves")):
+        device["model"] = _read(path, "device/model") or None
+
+    children = []
+    partitions = []
+    for number, child in sorted(_partitions(path, name)):
+        partitions.append((int(_read(child, "start") or 0) * 512, int(_read(child, "size") or 0) * 512))
+        children.append(_device(sys_block, dev, child, os.path.basename(child), removable, True, probes))
+
+    for holder in sorted(_listdir(os.path.join(path, "holders"))):
+        children.append(_device(sys_block, dev, os.path.join(sys_block, holder), holder, removable, False, probes))
+
+    if children:
+        device["children"] = children
+
+    probes.append((device, os.path.join(dev, name), partitions))
+    return device
+
+
+def _partitions(path: str, name: str):
+    partitions = []
+    for entry in _listdir(path):
+        if entry.startswith(name) and (number := _read(os.path.join(path, entry), "partition")):
+            partitions.append((int(number), os.path.join(path, entry)))
+
+    return partitions
+
+
+def _read(path: str, name: str) -> str | None:
+    try:
+        with open(os.path.join(path, name)) as f:
+            return f.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _listdir(path: str) -> list[str]:
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
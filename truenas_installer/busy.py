@@ -0,0 +1,102 @@
+import os
+
+__all__ = ["busy_disks"]
+
+PROC = "/proc"
+SYS_BLOCK = "/sys/block"
+
+
+def busy_disks(proc: str = PROC, sys_block: str = SYS_BLOCK) -> dict[str, list[str]]:
+    """
+    Maps every whole disk that is in use to the reasons why: one of its devices (the disk itself or a partition) is
+    mounted (including bind mounts), is used as swap, or holds another block device (i.e. an `md` array or a
+    device-mapper target).
+
+    Built in one pass over `mountinfo`, `swaps` and the sysfs `holders` directories.
+    """
+    # device name -> whole disk name, "major:minor" -> device name
+    disks = {}
+    numbers = {}
+    reasons = {}
+
+    def add(device, reason):
+        if (disk := disks.get(device)) is not None:
+            disk_reasons = reasons.setdefault(disk, [])
+            if reason not in disk_reasons:
+                disk_reasons.append(reason)
+
+    holders = []
+    for disk in _listdir(sys_block):
+        path = os.path.join(sys_block, disk)
+        for device, device_path in [(disk, path)] + [
+            (entry, os.path.join(path, entry))
+            for entry in _listdir(path)
+            if entry.startswith(disk) and os.path.exists(os.path.join(path, entry, "partition"))
+        ]:
+            disks[device] = disk
+            if (number := _read(os.path.join(device_path, "dev"))) is not None:
+                numbers[number] = device
+            for holder in sorted(_listdir(os.path.join(device_path, "holders"))):
+                holders.append((device, holder))
+
+    for device, holder in holders:
+        add(device, f"{device} is used by {holder}")
+
+    for line in _lines(os.path.join(proc, "self/mountinfo")):
+        fields = line.split()
+        try:
+            separator = fields.index("-")
+            number, mountpoint, source = fields[2], _unescape(fields[4]), fields[separator + 2]
+        except (ValueError, IndexError):
+            continue
+
+        if (device := numbers.get(number)) is None:
+            device = _device_name(_unescape(source))
+
+        add(device, f"{device} is mounted at {mountpoint}")
+
+    for line in _lines(os.path.join(proc, "swaps"))[1:]:
+        if fields := line.split():
+            device = _device_name(_unescape(fields[0]))
+            add(device, f"{device} is used as swap")
+
+    return reasons
+
+
+def _device_name(path: str) -> str | None:
+    if not path.startswith("/dev/"):
+        return None
+
+    # Resolves `/dev/disk/by-*` and `/dev/mapper` links
+    return os.path.basename(os.path.realpath(path))
+
+
+def _unescape(value: str) -> str:
+    # Spaces, tabs, newlines and backslashes are octal-escaped
+    for escaped, char in [("\\040", " "), ("\\011", "\t"), ("\\012", "\n"), ("\\134", "\\")]:
+        value = value.replace(escaped, char)
+
+    return value
+
+
+def _lines(path: str) -> list[str]:
+    try:
+        with open(path) as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _listdir(path: str) -> list[str]:
+    try:
+        return sorted(os.listdir(path))
+    except OSError:
+        return []
@@ -0,0 +1,151 @@
+import asyncio
+import contextlib
+import json
+import os
+import time
+from collections import defaultdict
+
+from . import utils
+
+__all__ = ["Cassette", "CassetteError", "recording", "replaying"]
+
+CASSETTE_VERSION = 1
+
+
+class CassetteError(Exception):
+    pass
+
+
+class Cassette:
+    """
+    Commands executed by `utils.run` and `utils.run_lines`, with their exit codes, output and durations.
+
+    Only external commands are covered (`zpool`, `zfs`, `udevadm settle`, `truenas_install`, the `serial_sql` probes,
+    ...). Disks are partitioned, wiped and listed in-process (`gpt`, `wipe`, `block_devices`), so replaying an
+    installation still needs disks to write to (image files or loop devices), and `list_disks` still reads sysfs.
+
+    `truenas_install` is matched by its arguments only: its parameters (written to its stdin) are not recorded, and
+    its progress is reported all at once when it is replayed.
+
+    When replaying, every command is answered with the responses recorded for the same arguments, in the order they
+    were recorded. Once they are exhausted, they are served once again from the beginning, so that a single recording
+    can be replayed repeatedly (i.e. in a benchmark loop).
+    """
+
+    def __init__(self, interactions: list[dict] | None = None):
+        self.interactions = interactions or []
+        self._responses = defaultdict(list)
+        self._positions = defaultdict(int)
+        for interaction in self.interactions:
+            self._responses[tuple(interaction["args"])].append(interaction)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            data = json.load(f)
+
+        if data.get("version") != CASSETTE_VERSION:
+            raise CassetteError(f"Unsupported cassette version in {path}: {data.get('version')!r}")
+
+        return cls(data["interactions"])
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CASSETTE_VERSION, "interactions": self.interactions}, f, indent=1)
+            f.write("\n")
+        # Do not leave a partial cassette behind if the recording is interrupted
+        os.rename(tmp_path, path)
+
+    def record(self, args: list[str], returncode: int, stdout: str, stderr: str, duration: float):
+        interaction = {
+            "args": list(args),
+            "returncode": returncode,
+            "stdout": stdout,
+            "stderr": stderr,
+            "duration": duration,
+        }
+        self.interactions.append(interaction)
+        self._responses[tuple(args)].append(interaction)
+
+    def next(self, args: list[str]) -> dict:
+        responses = self._responses.get(tuple(args))
+        if not responses:
+            raise CassetteError(f"Command was not recorded: {' '.join(args)}")
+
+        position = self._positions[tuple(args)]
+        self._positions[tuple(args)] = (position + 1) % len(responses)
+        return responses[position]
+
+    def rewind(self):
+        self._positions.clear()
+
+
+class _Recorder:
+    def __init__(self, cassette: Cassette, path: str | None):
+        self.cassette = cassette
+        self.path = path
+
+    async def __call__(self, args, execute):
+        start = time.monotonic()
+        returncode, stdout, stderr = await execute(args)
+        self.cassette.record(args, returncode, stdout, stderr, time.monotonic() - start)
+        if self.path is not None:
+            # The installer usually does not exit (the system is rebooted instead)
+            self.cassette.save(self.path)
+        return returncode, stdout, stderr
+
+
+class _Player:
+    def __init__(self, cassette: Cassette, delays: bool):
+        self.cassette = cassette
+        self.delays = delays
+
+    async def __call__(self, args, execute):
+        interaction = self.cassette.next(args)
+        if self.delays:
+            await asyncio.sleep(interaction["duration"])
+
+        return interaction["returncode"], interaction["stdout"], interaction["stderr"]
+
+
+@contextlib.contextmanager
+def _intercept(interceptor):
+    if utils.interceptor is not None:
+        raise CassetteError("Another cassette is already in use")
+
+    utils.interceptor = interceptor
+    try:
+        yield
+    finally:
+        utils.interceptor = None
+
+
+@contextlib.contextmanager
+def recording(path: str | None = None):
+    """
+    Executes commands as usual while recording them. The cassette is written to `path` (if given) after every
+    command and when the `with` block exits, even if it exits with an exception (so failed runs can be replayed too).
+
+    `python -m truenas_installer --record-cassette PATH` records everything the installer runs.
+    """
+    cassette = Cassette()
+    try:
+        with _intercept(_Recorder(cassette, path)):
+            yield cassette
+    finally:
+        if path is not None:
+            cassette.save(path)
+
+
+@contextlib.contextmanager
+def replaying(cassette: Cassette | str, delays: bool = False):
+    """
+    Serves recorded responses instead of executing commands. With `delays`, every response takes as long as the
+    recorded command did.
+    """
+    if isinstance(cassette, str):
+        cassette = Cassette.load(cassette)
+
+    with _intercept(_Player(cassette, delays)):
+        yield cassette
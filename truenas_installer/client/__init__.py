@@ -0,0 +1,5 @@
+from .connection import ConnectionClosed, InstallerClient, RPCError
+from .fleet import InstallResult, install_many
+from .pool import ClientPool
+
+__all__ = ["ClientPool", "ConnectionClosed", "InstallResult", "InstallerClient", "RPCError", "install_many"]
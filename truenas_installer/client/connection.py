@@ -0,0 +1,148 @@
+import asyncio
+import errno
+import itertools
+import json
+import logging
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["ConnectionClosed", "InstallerClient", "RPCError"]
+
+CONNECT_TIMEOUT = 10
+# Detects servers that have gone away without closing the connection (i.e. rebooted by the installation)
+HEARTBEAT = 30
+
+
+class RPCError(Exception):
+    """
+    An error returned by the server.
+    """
+
+    def __init__(self, message, code=None, errno_=None):
+        self.message = message
+        self.code = code
+        # I.e. `errno.EBUSY`, `None` if the server has not reported one
+        self.errno = errno_
+        super().__init__(message)
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class InstallerClient:
+    """
+    A websocket JSON-RPC connection to one installer server. Any number of calls can be made concurrently, responses
+    are matched to them by their ids. Notifications (i.e. `installation_progress`) are passed to the listeners.
+    """
+
+    def __init__(self, url: str, session: aiohttp.ClientSession, access_key: str | None = None):
+        self.url = url
+        self.session = session
+        self.access_key = access_key
+        self.ws = None
+        self.reader = None
+        self.ids = itertools.count(1)
+        # id -> future of the response
+        self.pending = {}
+        # notification name -> callbacks
+        self.listeners = {}
+
+    async def connect(self, timeout: float = CONNECT_TIMEOUT):
+        """
+        Connects and, if the server has been adopted (there is an `access_key`), authenticates.
+        """
+        self.ws = await asyncio.wait_for(self.session.ws_connect(self.url, heartbeat=HEARTBEAT), timeout)
+        self.reader = asyncio.get_running_loop().create_task(self._read())
+        if self.access_key is not None:
+            try:
+                await asyncio.wait_for(self.call("authenticate", self.access_key), timeout)
+            except BaseException:
+                await self.close()
+                raise
+
+    @property
+    def closed(self):
+        return self.ws is None or self.ws.closed
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            await self.reader
+
+    async def adopt(self) -> str:
+        """
+        Adopts the server. The returned access key is used to authenticate from now on.
+        """
+        self.access_key = await self.call("adopt")
+        return self.access_key
+
+    async def call(self, method: str, *params, timeout: float | None = None):
+        if self.closed:
+            raise ConnectionClosed(f"Not connected to {self.url}")
+
+        id_ = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[id_] = future
+        try:
+            try:
+                await self.ws.send_str(json.dumps({"jsonrpc": "2.0", "id": id_, "method": method, "params": params}))
+            except ConnectionError as e:
+                raise ConnectionClosed(f"Connection to {self.url} closed: {e}") from None
+
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(id_, None)
+
+    def add_listener(self, name: str, callback):
+        """
+        Calls `callback(params)` for every `name` notification.
+        """
+        self.listeners.setdefault(name, []).append(callback)
+
+    def remove_listener(self, name: str, callback):
+        self.listeners[name].remove(callback)
+
+    async def _read(self):
+        try:
+            async for message in self.ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+
+                try:
+                    data = json.loads(message.data)
+                except ValueError:
+                    logger.warning("Invalid JSON from %s: %r", self.url, message.data)
+                    continue
+
+                if "method" in data:
+                    self._notify(data["method"], data.get("params") or [{}])
+                elif (future := self.pending.get(data.get("id"))) is not None and not future.done():
+                    if (error := data.get("error")) is not None:
+                        future.set_exception(RPCError(error.get("message"), error.get("code"),
+                                                      _errno(error.get("data"))))
+                    else:
+                        future.set_result(data.get("result"))
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionClosed(f"Connection to {self.url} closed"))
+
+    def _notify(self, name, params):
+        for callback in list(self.listeners.get(name, [])):
+            try:
+                callback(params[0])
+            except Exception:
+                logger.error("Unhandled exception in %r listener", name, exc_info=True)
+
+
+def _errno(data):
+    value = data.get("errno") if isinstance(data, dict) else None
+    if isinstance(value, str):
+        # `exception_middleware` reports errno names
+        return getattr(errno, value, None)
+
+    return value
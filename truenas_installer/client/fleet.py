@@ -0,0 +1,86 @@
+import asyncio
+from dataclasses import dataclass
+
+import aiohttp
+
+from .connection import ConnectionClosed, RPCError
+from .pool import ClientPool
+
+__all__ = ["InstallResult", "install_many"]
+
+DEFAULT_CONCURRENCY = 8
+# `job_wait` calls are kept short so that dead connections are noticed
+WAIT_TIMEOUT = 30
+# Consecutive connection failures while waiting for an installation before the host is given up on
+MAX_RECONNECTS = 5
+RECONNECT_DELAY = 2
+
+CONNECTION_ERRORS = (ConnectionClosed, aiohttp.ClientError, OSError, asyncio.TimeoutError)
+
+
+@dataclass
+class InstallResult:
+    host: str
+    # The final job state (`SUCCESS`, `FAILED`, `ABORTED`), `None` if the installation could not be started or its
+    # outcome is unknown
+    state: str | None
+    error: str | None = None
+    job_id: int | None = None
+    # The last `installation_progress`
+    progress: dict | None = None
+
+    @property
+    def succeeded(self):
+        return self.state == "SUCCESS"
+
+
+async def install_many(pool: ClientPool, params: dict[str, dict], concurrency: int = DEFAULT_CONCURRENCY,
+                       reconnect_delay: float = RECONNECT_DELAY) -> dict[str, InstallResult]:
+    """
+    Installs on many servers, at most `concurrency` at a time. `params` maps every host to its `install` parameters.
+
+    Installations run as jobs (`install_start`), so a dropped connection is reopened and the installation keeps
+    running meanwhile. Failures are reported in the results instead of being raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def install(host, host_params):
+        async with semaphore:
+            try:
+                job_id = await pool.call(host, "install_start", host_params)
+            except RPCError as e:
+                return InstallResult(host, None, e.message)
+            except CONNECTION_ERRORS as e:
+                return InstallResult(host, None, f"Unable to connect: {e!r}")
+
+            return await _wait(pool, host, job_id, reconnect_delay)
+
+    results = await asyncio.gather(*[install(host, host_params) for host, host_params in params.items()])
+    return {result.host: result for result in results}
+
+
+async def _wait(pool: ClientPool, host: str, job_id: int, reconnect_delay: float) -> InstallResult:
+    failures = 0
+    while True:
+        try:
+            status = await pool.call(host, "job_wait", {"id": job_id, "timeout": WAIT_TIMEOUT},
+                                     timeout=WAIT_TIMEOUT * 2)
+        except RPCError as e:
+            return InstallResult(host, None, e.message, job_id)
+        except CONNECTION_ERRORS as e:
+            failures += 1
+            if failures > MAX_RECONNECTS:
+                return InstallResult(host, None, f"Connection lost: {e!r}", job_id)
+
+            await asyncio.sleep(reconnect_delay)
+            continue
+
+        failures = 0
+        if status["state"] != "RUNNING":
+            return InstallResult(
+                host,
+                status["state"],
+                status["error"]["message"] if status["error"] else None,
+                job_id,
+                status["progress"],
+            )
@@ -0,0 +1,74 @@
+import asyncio
+import functools
+
+import aiohttp
+
+from .connection import CONNECT_TIMEOUT, InstallerClient
+
+__all__ = ["ClientPool"]
+
+
+class ClientPool:
+    """
+    Keeps one connection to every installer server (`host`, `host:port` or a URL), opened when it is first used and
+    reopened (and re-authenticated) once it has been closed. All connections share one HTTP session.
+
+    Notification listeners are called with the host and the notification params.
+    """
+
+    def __init__(self, access_keys: dict[str, str] | None = None, connect_timeout: float = CONNECT_TIMEOUT):
+        self.access_keys = dict(access_keys or {})
+        self.connect_timeout = connect_timeout
+        self.session = None
+        self.clients = {}
+        self.locks = {}
+        self.listeners = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def get(self, host: str) -> InstallerClient:
+        async with self.locks.setdefault(host, asyncio.Lock()):
+            client = self.clients.get(host)
+            if client is None or client.closed:
+                if self.session is None:
+                    self.session = aiohttp.ClientSession()
+
+                client = InstallerClient(_url(host), self.session, self.access_keys.get(host))
+                for name, callback in self.listeners:
+                    client.add_listener(name, functools.partial(callback, host))
+
+                await client.connect(self.connect_timeout)
+                self.clients[host] = client
+
+            return client
+
+    async def call(self, host: str, method: str, *params, timeout: float | None = None):
+        return await (await self.get(host)).call(method, *params, timeout=timeout)
+
+    async def adopt(self, host: str) -> str:
+        self.access_keys[host] = await (await self.get(host)).adopt()
+        return self.access_keys[host]
+
+    def add_listener(self, name: str, callback):
+        """
+        Calls `callback(host, params)` for every `name` notification from any server.
+        """
+        self.listeners.append((name, callback))
+        for host, client in self.clients.items():
+            client.add_listener(name, functools.partial(callback, host))
+
+    async def close(self):
+        await asyncio.gather(*[client.close() for client in self.clients.values()], return_exceptions=True)
+        self.clients = {}
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+def _url(host: str) -> str:
+    # The server listens on port 80
+    return host if "://" in host else f"http://{host}/"
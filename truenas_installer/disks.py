@@ -1,18 +1,30 @@
-from dataclasses import dataclass
-import json
-import re
+import asyncio
+from dataclasses import dataclass, field
 
+from .block_devices import iter_block_devices
+from .busy import busy_disks
+from .performance import DiskPerformance, cached_performance
+from .uevent import UeventMonitor
 from .utils import run
+from .zfs_label import read_vdev_label
 
-__all__ = ["list_disks"]
+__all__ = ["disk_inventory", "list_disks", "scan_disks", "stream_disks"]
 
 MIN_DISK_SIZE = 8_000_000_000
+# Devices that are never installation targets
+VIRTUAL_DISK_PREFIXES = ("dm", "loop", "md", "sr", "st")
 
 
 @dataclass
 class ZFSMember:
     name: str
     pool: str
+    # From the vdev label, `None` if it could not be read
+    pool_guid: str | None = None
+    txg: int | None = None
+    # Of the most recent uberblock (seconds since the epoch). Unlike `txg`, it is comparable between different pools.
+    timestamp: int | None = None
+    hostid: int | None = None
 
 
 @dataclass
@@ -23,29 +35,237 @@ class Disk:
     label: str
     zfs_members: list[ZFSMember]
     removable: bool
+    # Why the disk can not be used for the installation (i.e. it is mounted), empty if it can
+    busy_reasons: list[str] = field(default_factory=list)
+    # Set by `performance.probe_disks`
+    performance: DiskPerformance | None = None
 
     @property
     def device(self):
         return f"/dev/{self.name}"
 
 
-async def list_disks():
-    # need to settle so that lsblk output is stable
+class DiskInventory:
+    """
+    A snapshot of `scan_disks()` that is kept current by block device uevents, so that listing disks does not have to
+    fork `udevadm` and probe every device every time.
+
+    `generation` is incremented every time the snapshot is rebuilt. Uevents only mark the snapshot as stale, it is
+    rebuilt by the next caller.
+
+    Mounting a filesystem or writing a ZFS label does not generate a uevent: the installation invalidates the
+    inventory itself, and `force_rescan` can be used when exact freshness is required. Until `start` is called (or if
+    uevents can not be received), every call rescans.
+    """
+
+    def __init__(self):
+        self.disks = None
+        self.generation = 0
+        self.stale = True
+        self.monitor = None
+        self.task = None
+        self.lock = asyncio.Lock()
+
+    async def on_startup(self, app):
+        self.start()
+
+    async def on_shutdown(self, app):
+        self.stop()
+
+    def start(self):
+        if self.task is not None:
+            return
+
+        try:
+            self.monitor = UeventMonitor("block")
+        except OSError:
+            return
+
+        self.task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        if self.monitor is not None:
+            self.monitor.close()
+            self.monitor = None
+
+    def invalidate(self):
+        self.stale = True
+
+    async def get(self, force_rescan: bool = False) -> list[Disk]:
+        if force_rescan or self.stale or self.monitor is None:
+            await self._rescan(force_rescan or self.monitor is None)
+
+        return list(self.disks)
+
+    async def stream(self, force_rescan: bool = False):
+        """
+        Same as `get`, but yields the disks one by one, as soon as they are discovered when the snapshot has to be
+        rebuilt.
+
+        The snapshot is rebuilt in the background, so a slow consumer does not hold up other callers, and it is
+        completed even if the consumer stops early.
+        """
+        if not (force_rescan or self.stale or self.monitor is None):
+            for disk in list(self.disks):
+                yield disk
+            return
+
+        queue = asyncio.Queue()
+        scan = asyncio.get_running_loop().create_task(self._stream_rescan(force_rescan or self.monitor is None, queue))
+        try:
+            while (disk := await queue.get()) is not None:
+                yield disk
+        except BaseException:
+            # The consumer has stopped early, the error (if any) will be reported to the next caller
+            scan.add_done_callback(lambda task: task.cancelled() or task.exception())
+            raise
+
+        await scan
+
+    async def _stream_rescan(self, force: bool, queue: asyncio.Queue):
+        try:
+            async with self.lock:
+                if not force and not self.stale:
+                    # Someone else has rescanned while we were waiting for the lock
+                    for disk in self.disks:
+                        queue.put_nowait(disk)
+                    return
+
+                self.stale = False
+                disks = []
+                try:
+                    async for disk in stream_disks():
+                        disks.append(disk)
+                        queue.put_nowait(disk)
+                except BaseException:
+                    self.stale = True
+                    raise
+
+                self.disks = sorted(disks, key=lambda x: x.name)
+                self.generation += 1
+        finally:
+            queue.put_nowait(None)
+
+    async def _rescan(self, force: bool):
+        async with self.lock:
+            if not force and not self.stale:
+                # Someone else has rescanned while we were waiting for the lock
+                return
+
+            # Events that arrive while we are scanning make the new snapshot stale right away
+            self.stale = False
+            try:
+                self.disks = await scan_disks()
+            except Exception:
+                self.stale = True
+                raise
+
+            self.generation += 1
+
+    async def _run(self):
+        try:
+            await self._rescan(False)
+        except Exception:
+            # Will be retried by the first caller
+            pass
+
+        while True:
+            event = await self.monitor.receive()
+            # `None` means that events were lost
+            if event is None or event.properties.get("DEVTYPE") in ("disk", "partition"):
+                self.stale = True
+
+
+disk_inventory = DiskInventory()
+
+
+async def list_disks(force_rescan: bool = False, include_busy: bool = False) -> list[Disk]:
+    """
+    Returns the disks that can be used for the installation, from the inventory snapshot (unless `force_rescan`).
+    With `include_busy`, disks that are in use are listed too, with their `busy_reasons`.
+    """
+    disks = await disk_inventory.get(force_rescan)
+    if not include_busy:
+        disks = [disk for disk in disks if not disk.busy_reasons]
+
+    return disks
+
+
+async def scan_disks():
+    # we sort the disks by name because `nvme` comes before `sd*`
+    # and our appliances have nvme boot drives so by putting nvme
+    # devices up top in the installer, it provides a convenience
+    # for other departments
+    return sorted([disk async for disk in stream_disks()], key=lambda x: x.name)
+
+
+async def stream_disks():
+    """
+    Yields the disks as soon as each one (and its partitions) has been probed, in no particular order.
+    """
+    # need to settle so that device signatures are stable
     await run(["udevadm", "settle"])
 
-    with open("/etc/mtab") as f:
-        mtab = f.read()
+    busy = await asyncio.to_thread(busy_disks)
+    queue = asyncio.Queue()
 
+    async def complete(device):
+        disks = disks_from_block_devices([device], busy)
+        await read_zfs_labels(disks)
+        for disk in disks:
+            disk.performance = cached_performance(disk)
+            queue.put_nowait(disk)
+
+    async def discover():
+        try:
+            # ZFS labels of a disk are read while other disks are still being probed
+            async with asyncio.TaskGroup() as tasks:
+                async for device in iter_block_devices():
+                    tasks.create_task(complete(device))
+        finally:
+            queue.put_nowait(None)
+
+    discovery = asyncio.create_task(discover())
+    try:
+        while (disk := await queue.get()) is not None:
+            yield disk
+
+        await discovery
+    finally:
+        discovery.cancel()
+
+
+async def read_zfs_labels(disks: list[Disk]):
+    """
+    Fills in pool membership details of `zfs_members` from their vdev labels.
+    """
+    members = [zfs_member for disk in disks for zfs_member in disk.zfs_members]
+    labels = await asyncio.gather(*[
+        asyncio.to_thread(read_vdev_label, f"/dev/{zfs_member.name}") for zfs_member in members
+    ])
+    for zfs_member, label in zip(members, labels):
+        if label is not None:
+            zfs_member.pool_guid = str(label.pool_guid)
+            zfs_member.txg = label.txg
+            zfs_member.timestamp = label.timestamp
+            zfs_member.hostid = label.hostid
+
+
+def disks_from_block_devices(blockdevices: list[dict], busy: dict[str, list[str]]) -> list[Disk]:
+    """
+    Builds the disk list from `lsblk -b -fJ -o name,fstype,label,rm,size,model`-shaped `blockdevices` and the
+    `busy_disks()` index.
+    """
     disks = []
-    for disk in json.loads(
-        (await run(["lsblk", "-b", "-fJ", "-o", "name,fstype,label,rm,size,model"])).stdout
-    )["blockdevices"]:
-        if disk["name"].startswith(("dm", "loop", "md", "sr", "st")):
+    for disk in blockdevices:
+        if disk["name"].startswith(VIRTUAL_DISK_PREFIXES):
             continue
         elif disk["size"] < MIN_DISK_SIZE:
             continue
-        elif re.search(fr"/dev/{disk['name']}p?[0-9]+", mtab):
-            continue
 
         zfs_members = []
         if disk["fstype"] is not None:
@@ -74,12 +294,9 @@ async def list_disks():
                 disk["model"] or "Unknown Model",
                 label,
                 zfs_members,
-                disk["rm"]
+                disk["rm"],
+                busy.get(disk["name"], []),
             )
         )
 
-    # we sort the disks by name because `nvme` comes before `sd*`
-    # and our appliances have nvme boot drives so by putting nvme
-    # devices up top in the installer, it provides a convenience
-    # for other departments
     return sorted(disks, key=lambda x: x.name)
@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+import math
+import os
+
+__all__ = ["DeviceGeometry", "PoolGeometry", "device_geometry", "pool_geometry"]
+
+SYS_BLOCK = "/sys/block"
+# What the boot pool has always been created with. Also right for 512e disks that report 512 byte physical sectors.
+MIN_ASHIFT = 12
+# The largest ashift ZFS supports
+MAX_ASHIFT = 16
+# What sgdisk aligns partitions to
+DEFAULT_ALIGNMENT = 1024 * 1024
+# Optimal I/O sizes that are not powers of two (i.e. RAID controllers that report their stripe width) can lead to an
+# unreasonably large common alignment
+MAX_ALIGNMENT = 16 * 1024 * 1024
+
+
+@dataclass
+class DeviceGeometry:
+    logical_block_size: int
+    physical_block_size: int
+    optimal_io_size: int
+    discard: bool
+
+    @property
+    def ashift(self) -> int:
+        return min(max(self.physical_block_size.bit_length() - 1, MIN_ASHIFT), MAX_ASHIFT)
+
+    @property
+    def alignment(self) -> int:
+        return _alignment([DEFAULT_ALIGNMENT, self.physical_block_size, self.optimal_io_size])
+
+
+@dataclass
+class PoolGeometry:
+    ashift: int
+    # Partition alignment in bytes
+    alignment: int
+    autotrim: bool
+    devices: dict[str, DeviceGeometry]
+
+
+def device_geometry(name: str, sys_block: str = SYS_BLOCK) -> DeviceGeometry:
+    """
+    Reads the block device topology the kernel reports in `/sys/block/<name>/queue`. Values that can not be read
+    default to 512 byte sectors, no preferred I/O size and no discard support.
+    """
+    queue = os.path.join(sys_block, name, "queue")
+    logical_block_size = _read_int(os.path.join(queue, "logical_block_size")) or 512
+    return DeviceGeometry(
+        logical_block_size,
+        max(_read_int(os.path.join(queue, "physical_block_size")), logical_block_size),
+        _read_int(os.path.join(queue, "optimal_io_size")),
+        _read_int(os.path.join(queue, "discard_max_bytes")) > 0,
+    )
+
+
+def pool_geometry(names: list[str], sys_block: str = SYS_BLOCK) -> PoolGeometry:
+    """
+    Chooses the boot pool ashift and partition alignment that suit all of its (mirrored) devices, i.e. the largest
+    geometry among them. Automatic TRIM is enabled if all of them support discard.
+    """
+    devices = {name: device_geometry(name, sys_block) for name in names}
+    return PoolGeometry(
+        max([device.ashift for device in devices.values()], default=MIN_ASHIFT),
+        _alignment([device.alignment for device in devices.values()]),
+        bool(devices) and all(device.discard for device in devices.values()),
+        devices,
+    )
+
+
+def _alignment(sizes: list[int]) -> int:
+    sizes = [size for size in sizes if size > 0]
+    alignment = math.lcm(DEFAULT_ALIGNMENT, *sizes)
+    if alignment > MAX_ALIGNMENT:
+        # Fall back to what is a multiple of every power-of-two size
+        alignment = max([DEFAULT_ALIGNMENT] + [size for size in sizes if size & (size - 1) == 0])
+
+    return min(alignment, MAX_ALIGNMENT)
+
+
+def _read_int(path: str) -> int:
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return 0
@@ -0,0 +1,289 @@
+import ctypes
+from dataclasses import dataclass, field
+import fcntl
+import os
+import stat
+import struct
+import uuid
+import zlib
+
+__all__ = ["GPTPartition", "boot_disk_layout", "build_partition_table", "read_device_partition_table",
+           "read_partition_table", "reread_partition_table", "write_partition_table"]
+
+BLKRRPART = 0x125f
+BLKSSZGET = 0x1268
+BLKPG = 0x1269
+BLKPG_ADD_PARTITION = 1
+BLKPG_ARG = struct.Struct("iiiP")
+# `struct blkpg_partition`, padded to the alignment of its `long long` fields like the kernel does (152 bytes)
+BLKPG_PARTITION = struct.Struct("qqi64s64s0q")
+HDIO_GETGEO = 0x0301
+
+MBR_SIZE = 512
+MBR_PARTITION_OFFSET = 446
+MBR_SIGNATURE = b"\x55\xaa"
+MBR_PROTECTIVE_TYPE = 0xee
+
+GPT_SIGNATURE = b"EFI PART"
+GPT_REVISION = 0x00010000
+GPT_HEADER = struct.Struct("<8sIIIIQQQQ16sQIII")
+GPT_ENTRY = struct.Struct("<16s16sQQQ72s")
+GPT_ENTRIES = 128
+
+BIOS_BOOT_PARTITION = "21686148-6449-6E6F-744E-656564454649"  # EF02
+EFI_SYSTEM_PARTITION = "C12A7328-F81F-11D2-BA4B-00A0C93EC93B"  # EF00
+SOLARIS_USR_PARTITION = "6A898CC3-1DD2-11B2-99A6-080020736631"  # BF01
+
+LEGACY_BIOS_BOOTABLE = 1 << 2
+
+# sgdisk aligns partitions to 1 MiB unless told otherwise
+DEFAULT_ALIGNMENT = 1024 * 1024
+
+# Default CHS geometry used by sgdisk when the kernel does not report one
+DEFAULT_HEADS = 255
+DEFAULT_SECTORS_PER_TRACK = 63
+MAX_CYLINDERS = 1024
+
+
+@dataclass
+class GPTPartition:
+    number: int
+    first_lba: int
+    last_lba: int
+    type_guid: str
+    # sgdisk names new partitions after their type
+    name: str
+    attributes: int = 0
+    guid: uuid.UUID = field(default_factory=uuid.uuid4)
+
+
+def boot_disk_layout(total_sectors: int, sector_size: int, alignment: int = DEFAULT_ALIGNMENT) -> list[GPTPartition]:
+    """
+    Computes the same layout that
+        sgdisk -a4096 -n1:0:+1024K -t1:EF02 -A1:set:2
+        sgdisk -n2:0:+524288K -t2:EF00
+        sgdisk -n3:0:0 -t3:BF01
+    produces on an empty disk.
+
+    The EFI system and data partitions start at multiples of `alignment` bytes (1 MiB, like sgdisk, by default).
+    """
+    first_usable, last_usable = _usable_lbas(total_sectors, sector_size)
+    alignment = max(alignment // sector_size, 1)
+
+    bios_start = _align(first_usable, 4096)
+    bios_end = bios_start + 1024 * 1024 // sector_size - 1
+    efi_start = _align(bios_end + 1, alignment)
+    efi_end = efi_start + 524288 * 1024 // sector_size - 1
+    data_start = _align(efi_end + 1, alignment)
+    if data_start >= last_usable:
+        raise ValueError(f"Disk of {total_sectors} sectors is too small")
+
+    return [
+        GPTPartition(1, bios_start, bios_end, BIOS_BOOT_PARTITION, "BIOS boot partition", LEGACY_BIOS_BOOTABLE),
+        GPTPartition(2, efi_start, efi_end, EFI_SYSTEM_PARTITION, "EFI system partition"),
+        GPTPartition(3, data_start, last_usable, SOLARIS_USR_PARTITION, "Solaris /usr & Mac ZFS"),
+    ]
+
+
+def build_partition_table(total_sectors: int, sector_size: int, partitions: list[GPTPartition], set_pmbr: bool,
+                          disk_guid: uuid.UUID | None = None, geometry: tuple[int, int] | None = None):
+    """
+    Builds the on-disk GPT structures.
+
+    Returns `(primary, backup)`: the protective MBR, primary header and partition entries that belong at the start
+    of the disk, and the backup partition entries and header that end at its last sector.
+    """
+    first_usable, last_usable = _usable_lbas(total_sectors, sector_size)
+    entries_sectors = _entries_sectors(sector_size)
+    last_lba = total_sectors - 1
+
+    entries = bytearray(GPT_ENTRIES * GPT_ENTRY.size)
+    for partition in partitions:
+        GPT_ENTRY.pack_into(
+            entries,
+            (partition.number - 1) * GPT_ENTRY.size,
+            uuid.UUID(partition.type_guid).bytes_le,
+            partition.guid.bytes_le,
+            partition.first_lba,
+            partition.last_lba,
+            partition.attributes,
+            partition.name.encode("utf-16-le"),
+        )
+    entries = bytes(entries).ljust(entries_sectors * sector_size, b"\0")
+    entries_crc = zlib.crc32(entries[:GPT_ENTRIES * GPT_ENTRY.size])
+
+    disk_guid = disk_guid or uuid.uuid4()
+
+    def header(my_lba, alternate_lba, entries_lba):
+        fields = [GPT_SIGNATURE, GPT_REVISION, GPT_HEADER.size, 0, 0, my_lba, alternate_lba, first_usable,
+                  last_usable, disk_guid.bytes_le, entries_lba, GPT_ENTRIES, GPT_ENTRY.size, entries_crc]
+        fields[3] = zlib.crc32(GPT_HEADER.pack(*fields))
+        return GPT_HEADER.pack(*fields).ljust(sector_size, b"\0")
+
+    primary = (
+        _protective_mbr(total_sectors, set_pmbr, geometry).ljust(sector_size, b"\0") +
+        header(1, last_lba, 2) +
+        entries
+    )
+    backup = entries + header(last_lba, 1, last_lba - entries_sectors)
+    return primary, backup
+
+
+def write_partition_table(device: str, set_pmbr: bool, sector_size: int = 512,
+                          alignment: int = DEFAULT_ALIGNMENT) -> list[GPTPartition]:
+    """
+    Writes a fresh boot disk partition table to `device` (a block device or an image file) and asks the kernel to
+    re-read it.
+
+    `sector_size` is only used for image files, block devices report their own logical sector size.
+    """
+    fd = os.open(device, os.O_RDWR | os.O_CLOEXEC)
+    try:
+        is_block_device = stat.S_ISBLK(os.fstat(fd).st_mode)
+        geometry = None
+        if is_block_device:
+            sector_size = struct.unpack("i", fcntl.ioctl(fd, BLKSSZGET, b"\0" * 4))[0]
+            geometry = _geometry(fd)
+
+        total_sectors = os.lseek(fd, 0, os.SEEK_END) // sector_size
+        partitions = boot_disk_layout(total_sectors, sector_size, alignment)
+        primary, backup = build_partition_table(total_sectors, sector_size, partitions, set_pmbr, geometry=geometry)
+
+        os.pwrite(fd, primary, 0)
+        os.pwrite(fd, backup, total_sectors * sector_size - len(backup))
+        os.fsync(fd)
+
+        if is_block_device:
+            reread_partition_table(fd)
+    finally:
+        os.close(fd)
+
+    return partitions
+
+
+def read_device_partition_table(device: str, sector_size: int = 512) -> list[tuple[int, int, int]]:
+    """
+    Same as `read_partition_table`, for a block device (that reports its own logical sector size) or an image file.
+    """
+    fd = os.open(device, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        if stat.S_ISBLK(os.fstat(fd).st_mode):
+            sector_size = struct.unpack("i", fcntl.ioctl(fd, BLKSSZGET, b"\0" * 4))[0]
+
+        return read_partition_table(fd, sector_size)
+    finally:
+        os.close(fd)
+
+
+def read_partition_table(fd: int, sector_size: int) -> list[tuple[int, int, int]]:
+    """
+    Returns `(number, first_lba, last_lba)` for every partition in the primary GPT of the opened device.
+    """
+    header = os.pread(fd, GPT_HEADER.size, sector_size)
+    if len(header) < GPT_HEADER.size:
+        return []
+
+    fields = GPT_HEADER.unpack(header)
+    if fields[0] != GPT_SIGNATURE or zlib.crc32(GPT_HEADER.pack(*(fields[:3] + (0,) + fields[4:]))) != fields[3]:
+        return []
+
+    entries = os.pread(fd, fields[11] * fields[12], fields[10] * sector_size)
+    if zlib.crc32(entries) != fields[13]:
+        return []
+
+    partitions = []
+    for i in range(fields[11]):
+        type_guid, _, first_lba, last_lba, _, _ = GPT_ENTRY.unpack_from(entries, i * fields[12])
+        if type_guid != b"\0" * 16:
+            partitions.append((i + 1, first_lba, last_lba))
+
+    return partitions
+
+
+def reread_partition_table(fd: int):
+    """
+    Asks the kernel to re-read the partition table of the opened block device (`BLKRRPART`).
+
+    Partitions of the on-disk GPT that the kernel still does not know about afterwards (i.e. it was built without
+    GPT support) are registered one by one (`BLKPG`).
+    """
+    fcntl.ioctl(fd, BLKRRPART)
+
+    sysfs = f"/sys/dev/block/{os.major(os.fstat(fd).st_rdev)}:{os.minor(os.fstat(fd).st_rdev)}"
+    known = set()
+    with os.scandir(sysfs) as dir_contents:
+        for entry in dir_contents:
+            try:
+                with open(os.path.join(entry.path, "partition")) as f:
+                    known.add(int(f.read().strip()))
+            except (OSError, ValueError):
+                continue
+
+    sector_size = struct.unpack("i", fcntl.ioctl(fd, BLKSSZGET, b"\0" * 4))[0]
+    for number, first_lba, last_lba in read_partition_table(fd, sector_size):
+        if number in known:
+            continue
+
+        partition = ctypes.create_string_buffer(BLKPG_PARTITION.pack(
+            first_lba * sector_size, (last_lba - first_lba + 1) * sector_size, number, b"", b"",
+        ))
+        try:
+            fcntl.ioctl(fd, BLKPG, BLKPG_ARG.pack(
+                BLKPG_ADD_PARTITION, 0, BLKPG_PARTITION.size, ctypes.addressof(partition),
+            ))
+        except OSError:
+            # Overlaps with a partition that is still in use
+            continue
+
+
+def _protective_mbr(total_sectors: int, set_pmbr: bool, geometry: tuple[int, int] | None):
+    size = min(total_sectors - 1, 0xffffffff)
+    if set_pmbr:
+        # This is what `parted disk_set pmbr_boot on` writes
+        status = 0x80
+        last_chs = b"\xff\xff\xff"
+    else:
+        status = 0
+        last_chs = _lba_to_chs(size, geometry or (DEFAULT_HEADS, DEFAULT_SECTORS_PER_TRACK))
+
+    mbr = bytearray(MBR_SIZE)
+    mbr[MBR_PARTITION_OFFSET:MBR_PARTITION_OFFSET + 16] = (
+        bytes([status]) + b"\x00\x02\x00" + bytes([MBR_PROTECTIVE_TYPE]) + last_chs + struct.pack("<II", 1, size)
+    )
+    mbr[510:512] = MBR_SIGNATURE
+    return bytes(mbr)
+
+
+def _lba_to_chs(lba: int, geometry: tuple[int, int]):
+    heads, sectors_per_track = geometry
+    if lba >= heads * sectors_per_track * MAX_CYLINDERS:
+        return b"\xfe\xff\xff"
+
+    cylinder, remainder = divmod(lba, heads * sectors_per_track)
+    head, sector = divmod(remainder, sectors_per_track)
+    return bytes([head, (sector + 1) | ((cylinder >> 8) << 6), cylinder & 0xff])
+
+
+def _geometry(fd: int):
+    try:
+        heads, sectors_per_track = struct.unpack("BBHL", fcntl.ioctl(fd, HDIO_GETGEO, b"\0" * 16))[:2]
+    except OSError:
+        return None
+
+    if not heads or not sectors_per_track:
+        return None
+
+    return heads, sectors_per_track
+
+
+def _entries_sectors(sector_size: int):
+    return -(-GPT_ENTRIES * GPT_ENTRY.size // sector_size)
+
+
+def _usable_lbas(total_sectors: int, sector_size: int):
+    entries_sectors = _entries_sectors(sector_size)
+    return 2 + entries_sectors, total_sectors - 2 - entries_sectors
+
+
+def _align(lba: int, alignment: int):
+    return -(-lba // alignment) * alignment
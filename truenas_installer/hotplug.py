@@ -0,0 +1,142 @@
+import asyncio
+from dataclasses import dataclass
+import logging
+
+from .disks import VIRTUAL_DISK_PREFIXES
+from .rtnetlink import LinkMonitor
+from .uevent import UeventMonitor
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["HotplugEvent", "hotplug_monitor"]
+
+DISK_ACTIONS = ("add", "remove", "change")
+# Same as `list_network_interfaces`
+IGNORED_INTERFACES = ("lo",)
+
+
+@dataclass
+class HotplugEvent:
+    # `disk` or `network_interface`
+    type: str
+    # `add`, `remove`, `change` or `resync` (events were lost and `name` is `None`)
+    action: str
+    name: str | None
+    # Network interfaces only
+    up: bool | None = None
+    carrier: bool | None = None
+
+
+class HotplugMonitor:
+    """
+    Turns kernel block device uevents and rtnetlink link events into `HotplugEvent`s for disks and network
+    interfaces, and calls the listeners with them.
+
+    The netlink sockets are only open while there are listeners.
+    """
+
+    def __init__(self):
+        self.listeners = []
+        self.uevents = None
+        self.links = None
+        self.tasks = []
+        # Interface index -> last known `Link`
+        self.interfaces = {}
+        self.lock = asyncio.Lock()
+
+    async def on_shutdown(self, app):
+        self.stop()
+
+    async def add_listener(self, listener):
+        async with self.lock:
+            if not self.listeners:
+                await self.start()
+
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+        if not self.listeners:
+            self.stop()
+
+    async def start(self):
+        self.uevents = UeventMonitor("block")
+        try:
+            self.links = LinkMonitor()
+            await self.links.open()
+            # Interfaces that already exist must not be reported as added
+            for link in await self.links.dump():
+                self._link_event(link)
+        except BaseException:
+            self.stop()
+            raise
+
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self._receive_uevents()), loop.create_task(self._receive_links())]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+        for monitor in (self.uevents, self.links):
+            if monitor is not None:
+                monitor.close()
+        self.uevents = None
+        self.links = None
+        self.interfaces = {}
+
+    def emit(self, event: HotplugEvent):
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception:
+                logger.error("Unhandled exception in hotplug listener", exc_info=True)
+
+    async def _receive_uevents(self):
+        while True:
+            if (event := await self.uevents.receive()) is None:
+                self.emit(HotplugEvent("disk", "resync", None))
+                continue
+
+            if (
+                event.properties.get("DEVTYPE") == "disk" and
+                event.action in DISK_ACTIONS and
+                not event.name.startswith(VIRTUAL_DISK_PREFIXES)
+            ):
+                self.emit(HotplugEvent("disk", event.action, event.name))
+
+    async def _receive_links(self):
+        while True:
+            if (links := await self.links.receive()) is None:
+                self.emit(HotplugEvent("network_interface", "resync", None))
+                continue
+
+            for link in links:
+                if (event := self._link_event(link)) is not None and event.name not in IGNORED_INTERFACES:
+                    self.emit(event)
+
+    def _link_event(self, link) -> HotplugEvent | None:
+        if link.removed:
+            if self.interfaces.pop(link.index, None) is None:
+                return None
+
+            return HotplugEvent("network_interface", "remove", link.name, link.up, link.carrier)
+
+        previous = self.interfaces.get(link.index)
+        self.interfaces[link.index] = link
+        if link.dump:
+            return None
+
+        if previous is None:
+            action = "add"
+        elif (previous.name, previous.up, previous.carrier) != (link.name, link.up, link.carrier):
+            action = "change"
+        else:
+            # Statistics, MTU, addresses, etc.
+            return None
+
+        return HotplugEvent("network_interface", action, link.name, link.up, link.carrier)
+
+
+hotplug_monitor = HotplugMonitor()
@@ -1,89 +1,225 @@
 import asyncio
+from dataclasses import asdict
+import functools
 import json
 import os
 import subprocess
-import tempfile
 from typing import Callable
 
-from .disks import Disk
+from .disks import Disk, disk_inventory
 from .exception import InstallError
+from .geometry import MIN_ASHIFT, PoolGeometry, pool_geometry
+from .gpt import DEFAULT_ALIGNMENT, read_device_partition_table, write_partition_table
+from .journal import journal
 from .lock import installation_lock
-from .utils import get_partitions, run
+from .media import InstallMedia
+from .metrics import operations
+from .plan import Plan
+from .staging import media_stager
+from .trace import tracer
+from .utils import get_partitions, run, run_lines, to_thread
+from .wipe import wipe_disk
 
-__all__ = ["InstallError", "install"]
+__all__ = ["InstallError", "install", "install_plan"]
 
 BOOT_POOL = "boot-pool"
 
 
 async def install(destination_disks: list[Disk], wipe_disks: list[Disk], set_pmbr: bool, authentication: dict | None,
-                  post_install: dict | None, sql: str | None, callback: Callable):
+                  post_install: dict | None, sql: str | None, callback: Callable, dry_run: bool = False,
+                  discard: bool = False):
+    plan = install_plan(destination_disks, wipe_disks, set_pmbr, authentication, post_install, sql, callback,
+                        discard)
+
+    if dry_run:
+        for line in plan.describe():
+            callback(0, line)
+        return
+
     with installation_lock:
+        journal.open(_journal_parameters(destination_disks, wipe_disks, set_pmbr))
+        outcome = "failure"
         try:
-            if not os.path.exists("/etc/hostid"):
-                await run(["zgenhostid"])
-
-            for disk in destination_disks:
-                callback(0, f"Formatting disk {disk.name}")
-                await format_disk(disk, set_pmbr, callback)
-
-            for disk in wipe_disks:
-                callback(0, f"Wiping disk {disk.name}")
-                await wipe_disk(disk, callback)
-
-            disk_parts = list()
-            part_num = 3
-            for disk in destination_disks:
-                found = (await get_partitions(disk.device, [part_num]))[part_num]
-                if found is None:
-                    raise InstallError(f"Failed to find data partition on {disk.name}")
-                else:
-                    disk_parts.append(found)
-
-            callback(0, "Creating boot pool")
-            await create_boot_pool(disk_parts)
-            try:
-                await run_installer(
-                    [disk.name for disk in destination_disks],
-                    authentication,
-                    post_install,
-                    sql,
-                    callback,
-                )
-            finally:
-                await run(["zpool", "export", "-f", BOOT_POOL])
+            with tracer.recording(), tracer.span("install", "install"):
+                await plan.run()
+
+            journal.clear()
+            outcome = "success"
+        except asyncio.CancelledError:
+            outcome = "aborted"
+            raise
         except subprocess.CalledProcessError as e:
             raise InstallError(f"Command {' '.join(e.cmd)} failed:\n{e.stderr.rstrip()}")
+        finally:
+            operations.inc("install", outcome)
+            # Partition tables and ZFS labels have changed
+            disk_inventory.invalidate()
+            try:
+                tracer.dump()
+            except OSError:
+                pass
+
+
+def install_plan(destination_disks: list[Disk], wipe_disks: list[Disk], set_pmbr: bool, authentication: dict | None,
+                 post_install: dict | None, sql: str | None, callback: Callable, discard: bool = False) -> Plan:
+    plan = Plan(journal=journal)
+    media = InstallMedia(stager=media_stager)
+
+    # The installation image is checked and hashed from the very beginning and mounted in the meantime. Both the quick
+    # check and the full checksum have to pass before any disk is touched (the checksum is usually known by then: the
+    # stager computes it in the background while the installation is being set up).
+    plan.add("check_media", functools.partial(to_thread, media.check))
+    plan.add("verify_media", functools.partial(media.verify, callback), bounded=False)
+    plan.add("mount_media", media.mount, requires=["check_media"])
+
+    async def generate_hostid():
+        if not os.path.exists("/etc/hostid"):
+            await run(["zgenhostid"])
+
+    plan.add("hostid", generate_hostid)
+
+    async def geometry():
+        with tracer.span("geometry", "geometry") as args:
+            result = await to_thread(pool_geometry, [disk.name for disk in destination_disks])
+            args.update(asdict(result))
+
+        return result
 
+    # The partition alignment and the pool ashift are chosen for the largest geometry among the mirrored disks
+    plan.add("geometry", geometry)
 
-async def wipe_disk(disk: Disk, callback: Callable):
-    for zfs_member in disk.zfs_members:
-        if (result := await run(["zpool", "labelclear", "-f", f"/dev/{zfs_member.name}"],
-                                check=False)).returncode != 0:
-            callback(0, f"Warning: unable to wipe ZFS label from {zfs_member.name}: {result.stderr.rstrip()}")
-        pass
+    async def format_(disk):
+        return await _format_disk(disk, set_pmbr, plan.results["geometry"], callback, discard)
 
-    if (result := await run(["wipefs", "-a", disk.device], check=False)).returncode != 0:
-        callback(0, f"Warning: unable to wipe partition table for {disk.name}: {result.stderr.rstrip()}")
+    for disk in destination_disks:
+        # If a previous installation attempt has failed, the disks it has already formatted (and the boot pool it
+        # has already created) are reused
+        plan.add(f"format:{disk.name}", functools.partial(format_, disk),
+                 requires=["check_media", "verify_media", "geometry"],
+                 resume=functools.partial(_resume_format_disk, disk, callback))
+        plan.add(f"partitions:{disk.name}", functools.partial(_find_data_partition, disk),
+                 requires=[f"format:{disk.name}"])
 
-    await run(["sgdisk", "-Z", disk.device], check=False)
+    for disk in wipe_disks:
+        plan.add(f"wipe:{disk.name}", functools.partial(_wipe_disk, disk, callback, discard),
+                 requires=["check_media", "verify_media"])
 
+    async def create_pool():
+        callback(0, "Creating boot pool")
+        await create_boot_pool([plan.results[f"partitions:{disk.name}"] for disk in destination_disks],
+                               plan.results["geometry"])
+        return (await run(["zpool", "get", "-H", "-o", "value", "guid", BOOT_POOL])).stdout.strip()
 
-async def format_disk(disk: Disk, set_pmbr: bool, callback: Callable):
-    await wipe_disk(disk, callback)
+    async def resume_pool(guid):
+        if not await reuse_boot_pool(guid):
+            return False
+
+        callback(0, "Reusing boot pool")
+        return True
+
+    plan.add(
+        "create_boot_pool",
+        create_pool,
+        requires=(
+            ["verify_media", "hostid", "geometry"] +
+            [f"partitions:{disk.name}" for disk in destination_disks] +
+            [f"wipe:{disk.name}" for disk in wipe_disks]
+        ),
+        resume=resume_pool,
+    )
+
+    async def install_image():
+        await run_installer(
+            [disk.name for disk in destination_disks],
+            authentication,
+            post_install,
+            sql,
+            media.mountpoint,
+            callback,
+        )
+
+    plan.add("install_image", install_image, requires=["create_boot_pool", "mount_media"])
+    plan.add("unmount_media", media.unmount, requires=["mount_media"], after=["install_image"])
+
+    async def export_pool():
+        await run(["zpool", "export", "-f", BOOT_POOL])
+
+    # The boot pool must be exported even if the installation itself has failed
+    plan.add("export_boot_pool", export_pool, requires=["create_boot_pool"], after=["install_image"])
+
+    return plan
+
+
+def _journal_parameters(destination_disks: list[Disk], wipe_disks: list[Disk], set_pmbr: bool):
+    return {
+        "destination_disks": [_disk_identity(disk) for disk in destination_disks],
+        "wipe_disks": [_disk_identity(disk) for disk in wipe_disks],
+        "set_pmbr": set_pmbr,
+    }
+
+
+def _disk_identity(disk: Disk):
+    wwid = None
+    for path in [f"/sys/block/{disk.name}/wwid", f"/sys/block/{disk.name}/device/wwid"]:
+        try:
+            with open(path) as f:
+                wwid = f.read().strip()
+            break
+        except OSError:
+            pass
 
-    # Create BIOS boot partition
-    await run(["sgdisk", "-a4096", "-n1:0:+1024K", "-t1:EF02", "-A1:set:2", disk.device])
+    return {"name": disk.name, "size": disk.size, "model": disk.model, "wwid": wwid}
 
-    # Create EFI partition (Even if not used, allows user to switch to UEFI later)
-    await run(["sgdisk", "-n2:0:+524288K", "-t2:EF00", disk.device])
 
-    # Create data partition
-    await run(["sgdisk", "-n3:0:0", "-t3:BF01", disk.device])
+async def _format_disk(disk: Disk, set_pmbr: bool, geometry: PoolGeometry, callback: Callable, discard: bool):
+    callback(0, f"Formatting disk {disk.name}")
+    await format_disk(disk, set_pmbr, callback, geometry.alignment, discard)
+    return [list(partition) for partition in await to_thread(read_device_partition_table, disk.device)]
+
+
+async def _resume_format_disk(disk: Disk, callback: Callable, partitions: list[list[int]]):
+    try:
+        layout = await to_thread(read_device_partition_table, disk.device)
+    except OSError:
+        return False
+
+    if [list(partition) for partition in layout] != partitions:
+        return False
+
+    if not all((await get_partitions(disk.device, [partition[0] for partition in partitions])).values()):
+        return False
+
+    callback(0, f"Reusing partitions on disk {disk.name}")
+    return True
+
+
+async def _wipe_disk(disk: Disk, callback: Callable, discard: bool):
+    callback(0, f"Wiping disk {disk.name}")
+    await wipe_disk(disk, callback, discard)
+
+
+async def _find_data_partition(disk: Disk):
+    part_num = 3
+    found = (await get_partitions(disk.device, [part_num]))[part_num]
+    if found is None:
+        raise InstallError(f"Failed to find data partition on {disk.name}")
+
+    return found
+
+
+async def format_disk(disk: Disk, set_pmbr: bool, callback: Callable, alignment: int = DEFAULT_ALIGNMENT,
+                      discard: bool = False):
+    await wipe_disk(disk, callback, discard)
+
+    # Create BIOS boot, EFI (even if not used, allows user to switch to UEFI later) and data partitions
+    try:
+        await to_thread(write_partition_table, disk.device, set_pmbr, alignment=alignment)
+    except OSError as e:
+        raise InstallError(f"Failed to write partition table on {disk.name}: {e}")
 
     # Bad hardware is bad, but we've seen a few users
-    # state that by the time we run `parted` command
-    # down below OR the caller of this function tries
-    # to do something with the partition(s), they won't
+    # state that by the time the caller of this function
+    # tries to do something with the partition(s), they won't
     # be present. This is almost _exclusively_ related
     # to bad hardware, but we will wait up to 30 seconds
     # for the partitions to show up in sysfs.
@@ -92,15 +228,15 @@ async def format_disk(disk: Disk, set_pmbr: bool, callback: Callable):
         if part_device is None:
             raise InstallError(f"Failed to find partition number {partnum} on {disk.name}")
 
-    if set_pmbr:
-        await run(["parted", "-s", disk.device, "disk_set", "pmbr_boot", "on"], check=False)
 
-
-async def create_boot_pool(devices):
+async def create_boot_pool(devices, geometry: PoolGeometry | None = None):
     await run(
         [
             "zpool", "create", "-f",
-            "-o", "ashift=12",
+            "-o", f"ashift={geometry.ashift if geometry else MIN_ASHIFT}",
+        ] +
+        (["-o", "autotrim=on"] if geometry and geometry.autotrim else []) +
+        [
             "-o", "cachefile=none",
             "-o", "compatibility=grub2",
             "-O", "acltype=off",
@@ -120,56 +256,70 @@ async def create_boot_pool(devices):
     await run(["zfs", "create", "-o", "canmount=off", "-o", "mountpoint=legacy", f"{BOOT_POOL}/grub"])
 
 
-async def run_installer(disks, authentication, post_install, sql, callback):
-    with tempfile.TemporaryDirectory() as src:
-        await run(["mount", "/cdrom/TrueNAS-SCALE.update", src, "-t", "squashfs", "-o", "loop"])
+async def reuse_boot_pool(guid: str):
+    """
+    Imports the boot pool that was created by a previous installation attempt (unless it is still imported) and
+    removes the boot environments that attempt has left behind. Returns `False` if the pool is gone.
+    """
+    result = await run(["zpool", "get", "-H", "-o", "value", "guid", BOOT_POOL], check=False)
+    if result.returncode == 0:
+        if result.stdout.strip() != guid:
+            return False
+    else:
+        if (await run(["zpool", "import", "-f", "-N", "-o", "cachefile=none", guid], check=False)).returncode != 0:
+            return False
+
+    try:
+        datasets = (await run(["zfs", "list", "-H", "-o", "name", "-d", "1", f"{BOOT_POOL}/ROOT"])).stdout.split()
+        for dataset in datasets:
+            if dataset != f"{BOOT_POOL}/ROOT":
+                await run(["zfs", "destroy", "-r", dataset])
+    except subprocess.CalledProcessError:
+        # The pool has to be created once again
+        await run(["zpool", "export", "-f", BOOT_POOL], check=False)
+        return False
+
+    return True
+
+
+async def run_installer(disks, authentication, post_install, sql, src, callback, old_root=None):
+    params = {
+        "authentication_method": authentication,
+        "disks": disks,
+        "json": True,
+        "pool_name": BOOT_POOL,
+        "post_install": post_install,
+        "sql": sql,
+        "src": src,
+    }
+    if old_root is not None:
+        # The root filesystem of the boot environment being upgraded, so that its configuration is carried over
+        params["old_root"] = old_root
+    error = None
+    stderr = ""
+
+    def on_line(line):
+        nonlocal error, stderr
+
         try:
-            params = {
-                "authentication_method": authentication,
-                "disks": disks,
-                "json": True,
-                "pool_name": BOOT_POOL,
-                "post_install": post_install,
-                "sql": sql,
-                "src": src,
-            }
-            process = await asyncio.create_subprocess_exec(
-                "python3", "-m", "truenas_install",
-                cwd=src,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-            )
-            process.stdin.write(json.dumps(params).encode("utf-8"))
-            process.stdin.close()
-            error = None
-            stderr = ""
-            while True:
-                line = await process.stdout.readline()
-                if not line:
-                    break
-
-                line = line.decode("utf-8", "ignore")
-
-                try:
-                    data = json.loads(line)
-                except ValueError:
-                    stderr += line
-                else:
-                    if "progress" in data and "message" in data:
-                        callback(data["progress"], data["message"])
-                    elif "error" in data:
-                        error = data["error"]
-                    else:
-                        raise ValueError(f"Invalid truenas_install JSON: {data!r}")
-            await process.wait()
-
-            if error is not None:
-                result = error
+            data = json.loads(line)
+        except ValueError:
+            stderr += line
+        else:
+            if "progress" in data and "message" in data:
+                callback(data["progress"], data["message"])
+            elif "error" in data:
+                error = data["error"]
             else:
-                result = stderr
+                raise ValueError(f"Invalid truenas_install JSON: {data!r}")
 
-            if process.returncode != 0:
-                raise InstallError(result or f"Abnormal installer process termination with code {process.returncode}")
-        finally:
-            await run(["umount", "-f", src])
+    returncode = await run_lines(["python3", "-m", "truenas_install"], on_line, json.dumps(params).encode("utf-8"),
+                                 src)
+
+    if error is not None:
+        result = error
+    else:
+        result = stderr
+
+    if returncode != 0:
+        raise InstallError(result or f"Abnormal installer process termination with code {returncode}")
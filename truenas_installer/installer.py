@@ -1,9 +1,15 @@
+import functools
 import os
 
 
 class Installer:
-    def __init__(self, version, dmi, vendor):
+    def __init__(self, version, vendor):
         self.version = version
-        self.dmi = dmi
         self.efi = os.path.exists("/sys/firmware/efi")
         self.vendor = vendor
+
+    @functools.cached_property
+    def dmi(self):
+        # `ixhardware` reads the whole DMI table through `dmidecode`, only pay for it when it is actually used
+        from ixhardware import parse_dmi
+        return parse_dmi()
@@ -2,22 +2,35 @@ import asyncio
 import os
 import sys
 
-import humanfriendly
-
 from .dialog import dialog_checklist, dialog_menu, dialog_msgbox, dialog_password, dialog_yesno
 from .disks import Disk, list_disks
 from .exception import InstallError
 from .install import install
+from .performance import cached_performance, performance_key, probe_disks
 from .serial import serial_sql
+from .upgrade import boot_pool_disks, stale_boot_pool_disks, upgrade
+
+TUI_PROBE_DURATION = 0.5
 
 
 class InstallerMenu:
     def __init__(self, installer):
         self.installer = installer
+        self.probe_task = None
 
     async def run(self):
+        # Disks are probed once, in the background, while the main menu is shown. Later passes through the menu reuse
+        # the cached results rather than reading every disk once again.
+        self.probe_task = asyncio.create_task(self._probe_disks())
         await self._main_menu()
 
+    async def _probe_disks(self):
+        try:
+            await probe_disks(await list_disks(), TUI_PROBE_DURATION)
+        except Exception:
+            # The disks are listed in their original order then
+            pass
+
     async def _main_menu(self):
         await dialog_menu(
             f"{self.installer.vendor} {self.installer.version} Console Setup",
@@ -35,9 +48,20 @@ class InstallerMenu:
             await self._main_menu()
 
     async def _install_upgrade_internal(self):
+        # Not needed before the first dialog
+        import humanfriendly
+
         disks = await list_disks()
         vendor = self.installer.vendor
 
+        # List the fastest disks first, so that the installation does not end up on a slow USB stick by accident
+        if self.probe_task is not None:
+            await self.probe_task
+        for disk in disks:
+            if disk.performance is None:
+                disk.performance = cached_performance(disk)
+        disks.sort(key=performance_key)
+
         if not disks:
             await dialog_msgbox("Choose Destination Media", "No drives available")
             return False
@@ -47,16 +71,16 @@ class InstallerMenu:
                 "Choose Destination Media",
                 (
                     f"Install {vendor} to a drive. If desired, select multiple drives to provide redundancy. {vendor} "
-                    "installation drive(s) are not available for use in storage pools. Use arrow keys to navigate "
-                    "options. Press spacebar to select."
+                    "installation drive(s) are not available for use in storage pools. Drives are listed fastest "
+                    "first. Use arrow keys to navigate options. Press spacebar to select."
                 ),
                 {
                     disk.name: " ".join([
                         disk.model[:15].ljust(15, " "),
                         disk.label[:15].ljust(15, " "),
                         "--",
-                        humanfriendly.format_size(disk.size, binary=True)
-                    ])
+                        humanfriendly.format_size(disk.size, binary=True),
+                    ] + self._performance(disk))
                     for disk in disks
                 }
             )
@@ -72,6 +96,20 @@ class InstallerMenu:
                 )
                 continue
 
+            if sorted(destination_disks) == sorted(disk.name for disk in boot_pool_disks(disks)):
+                action = await dialog_menu(
+                    f"{vendor} Installation",
+                    {
+                        "Upgrade (keep the existing configuration and boot environments)": self._action_upgrade,
+                        "Fresh Install (erase ALL data on the selected drives)": self._action_fresh_install,
+                    }
+                )
+                if action is None:
+                    continue
+
+                if action == "upgrade":
+                    return await self._upgrade(self._select_disks(disks, destination_disks))
+
             wipe_disks = [
                 disk.name
                 for disk in disks
@@ -82,10 +120,16 @@ class InstallerMenu:
             ]
             if wipe_disks:
                 # The presence of multiple `boot-pool` disks with different guids leads to boot pool import error
-                text = "\n".join([
-                    f"Disk(s) {', '.join(wipe_disks)} contain existing TrueNAS boot pool, but they were not "
-                    f"selected for TrueNAS installation. This configuration will not work unless these disks "
-                    "are erased.",
+                stale_disks = {disk.name for disk in stale_boot_pool_disks(disks)}
+                lines = []
+                if existing := [name for name in wipe_disks if name not in stale_disks]:
+                    lines.append(f"Disk(s) {', '.join(existing)} contain existing TrueNAS boot pool, but they were not "
+                                 f"selected for TrueNAS installation.")
+                if stale := [name for name in wipe_disks if name in stale_disks]:
+                    lines.append(f"Disk(s) {', '.join(stale)} contain stale TrueNAS boot pool(s) left over from "
+                                 f"previous installations.")
+                text = "\n".join(lines + [
+                    "This configuration will not work unless these disks are erased.",
                     "",
                     f"Proceed with erasing {', '.join(wipe_disks)}?"
                 ])
@@ -157,6 +201,50 @@ class InstallerMenu:
         )
         return True
 
+    def _performance(self, disk: Disk):
+        if disk.performance is None:
+            return []
+
+        return [
+            "--",
+            f"{disk.performance.sequential_read:.0f} MB/s",
+            # Spinning disks are slow whatever they are connected with
+            "HDD" if disk.performance.rotational else (disk.performance.transport or "").upper(),
+        ]
+
+    async def _action_upgrade(self):
+        return "upgrade"
+
+    async def _action_fresh_install(self):
+        return "install"
+
+    async def _upgrade(self, disks: list[Disk]):
+        disk_names = ", ".join(disk.name for disk in disks)
+        text = "\n".join([
+            f"- A new boot environment will be created on {disk_names} and the existing configuration will be "
+            "carried over to it.",
+            "- The current boot environment will remain available as a rollback target.",
+            "",
+            "Proceed with the upgrade?"
+        ])
+        if not await dialog_yesno(f"{self.installer.vendor} Upgrade", text):
+            return False
+
+        try:
+            await upgrade(disks, await serial_sql(), self._callback)
+        except InstallError as e:
+            await dialog_msgbox("Upgrade Error", e.message)
+            return False
+
+        await dialog_msgbox(
+            "Upgrade Succeeded",
+            (
+                f"The {self.installer.vendor} upgrade on {disk_names} succeeded!\n"
+                "Please reboot and remove the installation media."
+            ),
+        )
+        return True
+
     def _select_disks(self, disks: list[Disk], disks_names: list[str]):
         disks_dict = {disk.name: disk for disk in disks}
         return [disks_dict[disk_name] for disk_name in disks_names]
@@ -0,0 +1,71 @@
+import json
+import os
+
+__all__ = ["journal"]
+
+JOURNAL_PATH = "/run/truenas_installer_journal.json"
+
+
+class Journal:
+    """
+    Records the installation steps that have completed (and their results, i.e. the partition layout that was
+    written) so that an installation that is retried with the same parameters can verify and reuse their outcome
+    instead of doing them once again.
+
+    The journal lives in `/run`, so it does not outlive the installer environment.
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH):
+        self.path = path
+        self.parameters = None
+        self.steps = {}
+
+    def open(self, parameters: dict):
+        """
+        Starts recording an installation with the given `parameters`. The steps recorded by a previous installation
+        are kept only if it had the same parameters.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+
+        self.parameters = parameters
+        self.steps = data.get("steps", {}) if data.get("parameters") == parameters else {}
+        self._write()
+
+    def get(self, step: str):
+        """
+        Returns `(completed, result)` for the step.
+        """
+        if step in self.steps:
+            return True, self.steps[step]
+
+        return False, None
+
+    def complete(self, step: str, result):
+        self.steps[step] = result
+        self._write()
+
+    def forget(self, step: str):
+        if step in self.steps:
+            del self.steps[step]
+            self._write()
+
+    def clear(self):
+        self.parameters = None
+        self.steps = {}
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"parameters": self.parameters, "steps": self.steps}, f)
+        os.rename(tmp_path, self.path)
+
+
+journal = Journal()
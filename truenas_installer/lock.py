@@ -1,25 +1,42 @@
+import contextvars
 import pathlib
 
 from .exception import InstallError
 
-__all__ = ["installation_lock"]
+__all__ = ["InstallationLock", "installation_lock"]
 
 
 class InstallationLock:
     def __init__(self):
         self.path = pathlib.Path("/run/truenas_installer.lock")
+        # How many times the lock has been acquired by the current operation. Tasks inherit it from the context they
+        # have been created in, so an installation job that is started holding the lock can enter it once again.
+        self.depth = contextvars.ContextVar("installation_lock_depth", default=0)
 
     def locked(self):
         return self.path.exists()
 
-    def __enter__(self):
-        if self.locked():
-            raise InstallError("Installation is already in progress")
+    def acquire(self):
+        depth = self.depth.get()
+        if depth == 0:
+            if self.locked():
+                raise InstallError("Installation is already in progress")
+
+            self.path.write_text("")
+
+        self.depth.set(depth + 1)
 
-        self.path.write_text("")
+    def release(self):
+        depth = self.depth.get() - 1
+        self.depth.set(depth)
+        if depth == 0:
+            self.path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        self.acquire()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.path.unlink(missing_ok=True)
+        self.release()
 
 
 installation_lock = InstallationLock()
@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from typing import Callable
+
+from .exception import InstallError
+from .utils import run
+
+__all__ = ["InstallMedia"]
+
+IMAGE_PATH = "/cdrom/TrueNAS-SCALE.update"
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+SQUASHFS_MAGIC = b"hsqs"
+SQUASHFS_SUPERBLOCK = struct.Struct("<4sIIIIHHHHHHQQQQQQQQ")
+
+
+class InstallMedia:
+    """
+    The squashfs image that contains the system being installed.
+
+    The image is expected to be accompanied by `<image>.sha256` (`sha256sum` output). Media without a checksum file
+    can not be verified (which is reported as a warning).
+
+    If a `stager` (see `staging.MediaStager`) is reading the image in the background, its checksum and its copy of
+    the image are used instead of reading the original media once again.
+    """
+
+    def __init__(self, path: str = IMAGE_PATH, stager=None):
+        self.path = path
+        self.checksum_path = f"{path}.sha256"
+        self.stager = stager if stager is not None and stager.path == path else None
+        self.mountpoint = None
+        self.loop_device = None
+
+    def check(self):
+        """
+        Quickly checks that the image is a complete squashfs filesystem without reading all of it.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                superblock = f.read(SQUASHFS_SUPERBLOCK.size)
+                size = os.fstat(f.fileno()).st_size
+        except OSError as e:
+            raise InstallError(f"Unable to read installation image {self.path}: {e.strerror}")
+
+        if len(superblock) < SQUASHFS_SUPERBLOCK.size:
+            raise InstallError(f"Installation image {self.path} is truncated")
+
+        fields = SQUASHFS_SUPERBLOCK.unpack(superblock)
+        magic, major, bytes_used = fields[0], fields[9], fields[12]
+        if magic != SQUASHFS_MAGIC or major != 4:
+            raise InstallError(f"Installation image {self.path} is not a squashfs image")
+
+        if bytes_used > size:
+            raise InstallError(f"Installation image {self.path} is truncated ({size} bytes out of {bytes_used})")
+
+    async def verify(self, callback: Callable | None = None):
+        """
+        Verifies the image checksum. Hashing runs in a worker thread so the event loop remains responsive.
+
+        If there is no checksum file, `callback` (if given) is warned that the image is not verified.
+        """
+        try:
+            with open(self.checksum_path) as f:
+                expected = f.read().split()[0].lower()
+        except FileNotFoundError:
+            if callback is not None:
+                callback(0, f"Warning: installation image {self.path} has no checksum file ({self.checksum_path}), it "
+                            "can not be verified")
+            return
+        except (OSError, IndexError) as e:
+            raise InstallError(f"Unable to read installation image checksum {self.checksum_path}: {e}")
+
+        actual = None
+        if self.stager is not None:
+            await self.stager.wait()
+            actual = self.stager.sha256
+
+        try:
+            if actual is None:
+                actual = await asyncio.to_thread(self._sha256)
+        except (OSError, ValueError) as e:
+            raise InstallError(f"Unable to read installation image {self.path}: {e}")
+
+        if actual != expected:
+            raise InstallError(f"Installation image {self.path} is corrupt: SHA256 checksum is {actual}, expected "
+                               f"{expected}")
+
+    def _sha256(self):
+        sha256 = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                m.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(m) as view:
+                    for offset in range(0, len(m), HASH_CHUNK_SIZE):
+                        sha256.update(view[offset:offset + HASH_CHUNK_SIZE])
+
+        return sha256.hexdigest()
+
+    async def mount(self):
+        source, direct_io = self.path, False
+        if self.stager is not None:
+            source, direct_io = await self.stager.mount_source()
+
+        mountpoint = tempfile.mkdtemp()
+        try:
+            if direct_io:
+                self.loop_device = await self._attach_loop_device(source)
+                await run(["mount", self.loop_device, mountpoint, "-t", "squashfs", "-o", "ro"])
+            else:
+                await run(["mount", source, mountpoint, "-t", "squashfs", "-o", "loop"])
+        except Exception:
+            os.rmdir(mountpoint)
+            await self._detach_loop_device()
+            raise
+
+        self.mountpoint = mountpoint
+        return mountpoint
+
+    async def unmount(self):
+        if self.mountpoint is not None:
+            await run(["umount", "-f", self.mountpoint])
+            os.rmdir(self.mountpoint)
+            self.mountpoint = None
+
+        await self._detach_loop_device()
+
+        if self.stager is not None:
+            # The staged copy is no longer needed
+            self.stager.release()
+
+    async def _attach_loop_device(self, source):
+        args = ["losetup", "-f", "--show", "--read-only"]
+        # Older kernels can not do direct I/O on tmpfs
+        result = await run(args + ["--direct-io=on", source], check=False)
+        if result.returncode != 0:
+            result = await run(args + [source])
+
+        return result.stdout.strip()
+
+    async def _detach_loop_device(self):
+        if self.loop_device is not None:
+            await run(["losetup", "-d", self.loop_device], check=False)
+            self.loop_device = None
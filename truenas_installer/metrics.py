@@ -0,0 +1,150 @@
+import asyncio
+import bisect
+import math
+
+__all__ = ["Counter", "Gauge", "Histogram", "Registry", "registry", "rpc_calls", "rpc_duration", "subprocesses",
+           "subprocess_duration", "step_duration", "operations", "websockets", "loop_lag", "loop_lag_monitor"]
+
+# Seconds
+FAST_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200)
+LOOP_LAG_INTERVAL = 1
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...] = (), registry_: Registry | None = None):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        # Label values -> value
+        self.values = {}
+        (registry_ or registry).metrics.append(self)
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = FAST_BUCKETS,
+                 registry_: Registry | None = None):
+        super().__init__(name, help_, labels, registry_)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        if (state := self.values.get(labels)) is None:
+            # Non-cumulative counts of every bucket (and of +Inf), sum
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        samples = []
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + (_number(bound),))} "
+                               f"{cumulative}")
+
+            samples.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            samples.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+
+        return samples
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task that sleeps for a second, which is how long everything else
+    (i.e. RPC calls) is delayed by blocking code.
+    """
+
+    def __init__(self):
+        self.task = None
+
+    async def on_startup(self, app):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def on_shutdown(self, app):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            loop_lag.observe(max(loop.time() - start - LOOP_LAG_INTERVAL, 0))
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+rpc_calls = Counter("truenas_installer_rpc_calls_total", "RPC calls by method and outcome", ("method", "outcome"))
+rpc_duration = Histogram("truenas_installer_rpc_call_duration_seconds", "RPC call durations", ("method",))
+subprocesses = Counter("truenas_installer_subprocesses_total", "Commands run by command and outcome",
+                       ("command", "outcome"))
+subprocess_duration = Histogram("truenas_installer_subprocess_duration_seconds", "Command durations", ("command",),
+                                SLOW_BUCKETS)
+step_duration = Histogram("truenas_installer_step_duration_seconds",
+                          "Installation and upgrade step durations by step and outcome", ("step", "outcome"),
+                          SLOW_BUCKETS)
+operations = Counter("truenas_installer_operations_total", "Installations and upgrades by outcome",
+                     ("operation", "outcome"))
+websockets = Gauge("truenas_installer_websockets", "Currently connected websockets")
+loop_lag = Histogram("truenas_installer_event_loop_lag_seconds", "How late the event loop runs scheduled tasks")
+loop_lag_monitor = LoopLagMonitor()
@@ -1,7 +1,5 @@
 from dataclasses import dataclass
 
-from pyroute2 import IPRoute, NetlinkDumpInterrupted
-
 __all__ = ["list_network_interfaces"]
 
 
@@ -11,6 +9,9 @@ class NetworkInterface:
 
 
 async def list_network_interfaces():
+    # `pyroute2` takes longer to import than the rest of the server
+    from pyroute2 import IPRoute, NetlinkDumpInterrupted
+
     max_retries = 3
     for attempt in range(1, max_retries + 1):
         try:
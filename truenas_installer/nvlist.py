@@ -0,0 +1,175 @@
+import struct
+
+__all__ = ["NVListError", "unpack_nvlist"]
+
+NV_ENCODE_XDR = 1
+
+DATA_TYPE_BOOLEAN = 1
+DATA_TYPE_BYTE = 2
+DATA_TYPE_INT16 = 3
+DATA_TYPE_UINT16 = 4
+DATA_TYPE_INT32 = 5
+DATA_TYPE_UINT32 = 6
+DATA_TYPE_INT64 = 7
+DATA_TYPE_UINT64 = 8
+DATA_TYPE_STRING = 9
+DATA_TYPE_BYTE_ARRAY = 10
+DATA_TYPE_INT16_ARRAY = 11
+DATA_TYPE_UINT16_ARRAY = 12
+DATA_TYPE_INT32_ARRAY = 13
+DATA_TYPE_UINT32_ARRAY = 14
+DATA_TYPE_INT64_ARRAY = 15
+DATA_TYPE_UINT64_ARRAY = 16
+DATA_TYPE_STRING_ARRAY = 17
+DATA_TYPE_HRTIME = 18
+DATA_TYPE_NVLIST = 19
+DATA_TYPE_NVLIST_ARRAY = 20
+DATA_TYPE_BOOLEAN_VALUE = 21
+DATA_TYPE_INT8 = 22
+DATA_TYPE_UINT8 = 23
+DATA_TYPE_BOOLEAN_ARRAY = 24
+DATA_TYPE_INT8_ARRAY = 25
+DATA_TYPE_UINT8_ARRAY = 26
+
+# XDR encodes everything shorter than 32 bits as a 32-bit integer
+INTEGERS = {
+    DATA_TYPE_BYTE: ">I",
+    DATA_TYPE_INT8: ">i",
+    DATA_TYPE_UINT8: ">I",
+    DATA_TYPE_INT16: ">i",
+    DATA_TYPE_UINT16: ">I",
+    DATA_TYPE_INT32: ">i",
+    DATA_TYPE_UINT32: ">I",
+    DATA_TYPE_INT64: ">q",
+    DATA_TYPE_UINT64: ">Q",
+    DATA_TYPE_HRTIME: ">q",
+    DATA_TYPE_BOOLEAN_VALUE: ">I",
+}
+INTEGER_ARRAYS = {
+    DATA_TYPE_INT8_ARRAY: DATA_TYPE_INT8,
+    DATA_TYPE_UINT8_ARRAY: DATA_TYPE_UINT8,
+    DATA_TYPE_INT16_ARRAY: DATA_TYPE_INT16,
+    DATA_TYPE_UINT16_ARRAY: DATA_TYPE_UINT16,
+    DATA_TYPE_INT32_ARRAY: DATA_TYPE_INT32,
+    DATA_TYPE_UINT32_ARRAY: DATA_TYPE_UINT32,
+    DATA_TYPE_INT64_ARRAY: DATA_TYPE_INT64,
+    DATA_TYPE_UINT64_ARRAY: DATA_TYPE_UINT64,
+    DATA_TYPE_BOOLEAN_ARRAY: DATA_TYPE_BOOLEAN_VALUE,
+}
+
+
+class NVListError(ValueError):
+    pass
+
+
+def unpack_nvlist(data: bytes) -> dict:
+    """
+    Decodes an XDR-encoded (i.e. stored in a ZFS vdev label) name-value list.
+
+    Booleans without a value decode as `True`, nested lists as dictionaries. Pairs of unknown types are skipped.
+    """
+    if len(data) < 4:
+        raise NVListError("Truncated nvlist")
+
+    if data[0] != NV_ENCODE_XDR:
+        raise NVListError(f"Unsupported nvlist encoding {data[0]}")
+
+    try:
+        result, _ = _unpack_list(data, 4)
+    except struct.error:
+        raise NVListError("Truncated nvlist") from None
+
+    return result
+
+
+def _unpack_list(data: bytes, offset: int):
+    # version, flags
+    offset += 8
+    result = {}
+    while True:
+        encoded_size, decoded_size = struct.unpack_from(">ii", data, offset)
+        if encoded_size == 0 and decoded_size == 0:
+            return result, offset + 8
+
+        if encoded_size < 0 or offset + encoded_size > len(data):
+            raise NVListError("Invalid nvpair size")
+
+        end = offset + encoded_size
+        name, position = _unpack_string(data, offset + 8)
+        type_, count = struct.unpack_from(">ii", data, position)
+        position += 8
+
+        value, position = _unpack_value(data, position, type_, count)
+        if value is not _UNKNOWN:
+            result[name] = value
+
+        # Nested lists are not included in the size of the pair
+        offset = position if type_ in (DATA_TYPE_NVLIST, DATA_TYPE_NVLIST_ARRAY) else end
+
+
+_UNKNOWN = object()
+
+
+def _unpack_value(data: bytes, offset: int, type_: int, count: int):
+    if type_ == DATA_TYPE_BOOLEAN:
+        return True, offset
+
+    if type_ in INTEGERS:
+        return _unpack_integer(data, offset, type_)
+
+    if type_ == DATA_TYPE_STRING:
+        return _unpack_string(data, offset)
+
+    if type_ == DATA_TYPE_BYTE_ARRAY:
+        return bytes(data[offset:offset + count]), offset + _align4(count)
+
+    if type_ in INTEGER_ARRAYS:
+        values = []
+        for _ in range(count):
+            value, offset = _unpack_integer(data, offset, INTEGER_ARRAYS[type_])
+            values.append(value)
+
+        return values, offset
+
+    if type_ == DATA_TYPE_STRING_ARRAY:
+        values = []
+        for _ in range(count):
+            value, offset = _unpack_string(data, offset)
+            values.append(value)
+
+        return values, offset
+
+    if type_ == DATA_TYPE_NVLIST:
+        return _unpack_list(data, offset)
+
+    if type_ == DATA_TYPE_NVLIST_ARRAY:
+        values = []
+        for _ in range(count):
+            value, offset = _unpack_list(data, offset)
+            values.append(value)
+
+        return values, offset
+
+    return _UNKNOWN, offset
+
+
+def _unpack_integer(data: bytes, offset: int, type_: int):
+    fmt = INTEGERS[type_]
+    value = struct.unpack_from(fmt, data, offset)[0]
+    if type_ == DATA_TYPE_BOOLEAN_VALUE:
+        value = bool(value)
+
+    return value, offset + struct.calcsize(fmt)
+
+
+def _unpack_string(data: bytes, offset: int):
+    length = struct.unpack_from(">I", data, offset)[0]
+    offset += 4
+    if offset + length > len(data):
+        raise NVListError("Invalid string length")
+
+    return data[offset:offset + length].decode("utf-8", "replace"), offset + _align4(length)
+
+
+def _align4(n: int):
+    return (n + 3) & ~3
@@ -0,0 +1,152 @@
+import asyncio
+from dataclasses import dataclass
+import mmap
+import os
+import random
+import time
+
+__all__ = ["DiskPerformance", "cached_performance", "measure", "performance_key", "probe_disks"]
+
+# Per disk, split evenly between sequential and random reads
+PROBE_DURATION = 1.0
+SEQUENTIAL_BLOCK_SIZE = 1024 * 1024
+SEQUENTIAL_MAX_BYTES = 256 * 1024 * 1024
+RANDOM_BLOCK_SIZE = 4096
+RANDOM_MAX_READS = 4096
+
+# `(name, size, model)` -> `DiskPerformance`
+_cache = {}
+
+
+@dataclass
+class DiskPerformance:
+    # MB/s (10^6 bytes per second)
+    sequential_read: float
+    random_read_iops: float
+    rotational: bool | None
+    # `nvme`, `sata`, `sas`, `usb`, `mmc`, `virtio` or `None` if unknown
+    transport: str | None
+
+
+async def probe_disks(disks: list, duration: float = PROBE_DURATION):
+    """
+    Measures the read performance of the disks (in parallel) and sets their `performance`.
+
+    Every disk is read for at most `duration` seconds (and at most `SEQUENTIAL_MAX_BYTES` and `RANDOM_MAX_READS`).
+    Nothing is written. Results are cached until the disk is replaced.
+    """
+    results = await asyncio.gather(*[asyncio.to_thread(measure, disk.name, duration) for disk in disks])
+    for disk, performance in zip(disks, results):
+        if performance is not None:
+            _cache[(disk.name, disk.size, disk.model)] = performance
+        disk.performance = performance
+
+
+def cached_performance(disk) -> "DiskPerformance | None":
+    return _cache.get((disk.name, disk.size, disk.model))
+
+
+def performance_key(disk):
+    """
+    Sorts the fastest disks first. Disks that were not probed go last, in their original order.
+    """
+    if disk.performance is None:
+        return 1, 0, 0
+
+    return 0, -disk.performance.sequential_read, -disk.performance.random_read_iops
+
+
+def measure(name: str, duration: float = PROBE_DURATION, dev: str = "/dev",
+            sys_block: str = "/sys/block") -> DiskPerformance | None:
+    """
+    Times short sequential (1 MiB) and random (4 KiB) reads from the start of the device, bypassing the page cache.
+
+    Returns `None` if the device can not be read.
+    """
+    try:
+        fd = os.open(os.path.join(dev, name), os.O_RDONLY | os.O_DIRECT | os.O_CLOEXEC)
+    except OSError:
+        try:
+            # Some filesystems (used for image files) do not support direct I/O
+            fd = os.open(os.path.join(dev, name), os.O_RDONLY | os.O_CLOEXEC)
+        except OSError:
+            return None
+
+    # Direct I/O requires aligned buffers, anonymous mappings are page-aligned
+    buffer = mmap.mmap(-1, SEQUENTIAL_BLOCK_SIZE)
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+        if size < SEQUENTIAL_BLOCK_SIZE:
+            return None
+
+        sequential_read = _sequential(fd, buffer, size, duration / 2)
+        random_read_iops = _random(fd, buffer, size, duration / 2)
+    except OSError:
+        return None
+    finally:
+        buffer.close()
+        os.close(fd)
+
+    rotational = _read(os.path.join(sys_block, name, "queue/rotational"))
+    return DiskPerformance(
+        round(sequential_read, 1),
+        round(random_read_iops),
+        None if rotational is None else rotational == "1",
+        _transport(name, sys_block),
+    )
+
+
+def _sequential(fd: int, buffer: mmap.mmap, size: int, duration: float) -> float:
+    offset = 0
+    start = time.monotonic()
+    deadline = start + duration
+    limit = min(size, SEQUENTIAL_MAX_BYTES) // SEQUENTIAL_BLOCK_SIZE * SEQUENTIAL_BLOCK_SIZE
+    while offset < limit and time.monotonic() < deadline:
+        if (read := os.preadv(fd, [buffer], offset)) <= 0:
+            break
+        offset += read
+
+    return offset / max(time.monotonic() - start, 1e-6) / 1e6
+
+
+def _random(fd: int, buffer: mmap.mmap, size: int, duration: float) -> float:
+    block = memoryview(buffer)[:RANDOM_BLOCK_SIZE]
+    # Same offsets every time, so that measurements are comparable
+    rng = random.Random(0)
+    blocks = size // RANDOM_BLOCK_SIZE
+    reads = 0
+    try:
+        start = time.monotonic()
+        deadline = start + duration
+        while reads < RANDOM_MAX_READS and time.monotonic() < deadline:
+            os.preadv(fd, [block], rng.randrange(blocks) * RANDOM_BLOCK_SIZE)
+            reads += 1
+
+        return reads / max(time.monotonic() - start, 1e-6)
+    finally:
+        block.release()
+
+
+def _transport(name: str, sys_block: str) -> str | None:
+    if name.startswith("nvme"):
+        return "nvme"
+    if name.startswith("vd"):
+        return "virtio"
+    if name.startswith("mmcblk"):
+        return "mmc"
+
+    # The transport is only known from the path of the device in the sysfs device tree
+    path = os.path.realpath(os.path.join(sys_block, name, "device"))
+    for component, transport in [("/usb", "usb"), ("/ata", "sata"), ("/end_device-", "sas"), ("/virtio", "virtio")]:
+        if component in path:
+            return transport
+
+    return None
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
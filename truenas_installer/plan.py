@@ -0,0 +1,201 @@
+import asyncio
+import contextlib
+from dataclasses import dataclass, field
+import time
+from typing import Awaitable, Callable
+
+from .metrics import step_duration
+from .trace import tracer
+
+__all__ = ["Plan", "Step"]
+
+DEFAULT_CONCURRENCY = 4
+
+
+class StepSkipped(Exception):
+    pass
+
+
+@dataclass
+class Step:
+    name: str
+    fn: Callable[[], Awaitable]
+    # Steps that must succeed before this step can run
+    requires: list[str] = field(default_factory=list)
+    # Steps that must finish (with any outcome) before this step can run
+    after: list[str] = field(default_factory=list)
+    # Steps that mostly wait for something other than the disks (i.e. hashing in a worker thread) do not need to
+    # count against the concurrency limit
+    bounded: bool = True
+    # Verifies that the result of this step recorded in the journal by a previous run still holds, so the step does
+    # not need to run once again. Only steps that have it are recorded in the journal.
+    resume: Callable[[object], Awaitable[bool]] | None = None
+
+    @property
+    def dependencies(self):
+        return self.requires + self.after
+
+
+class Plan:
+    def __init__(self, journal=None):
+        self.steps = {}
+        self.results = {}
+        self.journal = journal
+        # Steps that have changed something on this run (or depend on such a step), so steps that depend on them can
+        # not reuse the results recorded in the journal
+        self.changed = set()
+
+    def add(self, name: str, fn: Callable[[], Awaitable], requires=(), after=(), bounded=True, resume=None):
+        if name in self.steps:
+            raise ValueError(f"Step {name!r} is already defined")
+
+        self.steps[name] = Step(name, fn, list(requires), list(after), bounded, resume)
+        return self.steps[name]
+
+    def stages(self) -> list[list[Step]]:
+        """
+        Groups steps into stages: every step only depends on steps from the previous stages, so all steps within a
+        single stage can run concurrently.
+        """
+        for step in self.steps.values():
+            for dependency in step.dependencies:
+                if dependency not in self.steps:
+                    raise ValueError(f"Step {step.name!r} depends on unknown step {dependency!r}")
+
+        stages = []
+        scheduled = set()
+        while len(scheduled) < len(self.steps):
+            stage = [
+                step for step in self.steps.values()
+                if step.name not in scheduled and all(dependency in scheduled for dependency in step.dependencies)
+            ]
+            if not stage:
+                raise ValueError("Dependency cycle between steps " +
+                                 ", ".join(sorted(set(self.steps) - scheduled)))
+
+            stages.append(stage)
+            scheduled.update(step.name for step in stage)
+
+        return stages
+
+    def describe(self) -> list[str]:
+        lines = []
+        for i, stage in enumerate(self.stages(), start=1):
+            lines.append(f"Stage {i}: {', '.join(step.name for step in stage)}" +
+                         (" (concurrently)" if len(stage) > 1 else ""))
+            for step in stage:
+                dependencies = step.requires + [f"{name} (any outcome)" for name in step.after]
+                if dependencies:
+                    lines.append(f"  {step.name} <- {', '.join(dependencies)}")
+
+        return lines
+
+    async def run(self, concurrency: int = DEFAULT_CONCURRENCY):
+        """
+        Runs all steps, at most `concurrency` at a time, each as soon as its dependencies are satisfied.
+
+        When a step fails, steps that are already running are allowed to finish, steps that require it are skipped,
+        and the first error is raised once nothing else can run.
+
+        When the run is cancelled, the running steps are cancelled, and then the cleanup steps (the ones that run
+        `after` others) whose required steps have succeeded are run one by one before the cancellation propagates.
+
+        With a `journal`, steps that have completed on a previous run are not run once again if their recorded result
+        can still be verified and none of the steps they require had to run this time.
+        """
+        self.stages()
+
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = {}
+        errors = []
+
+        async def run_step(step):
+            if step.dependencies:
+                await asyncio.wait([tasks[name] for name in step.dependencies])
+
+            for name in step.requires:
+                if tasks[name].exception() is not None:
+                    raise StepSkipped(name)
+
+            async with semaphore if step.bounded else contextlib.nullcontext():
+                start = time.perf_counter()
+                outcome = "cancelled"
+                with tracer.span(step.name, "step") as args:
+                    try:
+                        if await self._resume(step):
+                            args["resumed"] = True
+                            outcome = "resumed"
+                        else:
+                            self.results[step.name] = await step.fn()
+                            outcome = "success"
+                            if step.resume is not None:
+                                self.changed.add(step.name)
+                                if self.journal is not None:
+                                    self.journal.complete(step.name, self.results[step.name])
+                    except Exception as e:
+                        args["error"] = repr(e)
+                        outcome = "failure"
+                        errors.append(e)
+                        raise
+                    finally:
+                        _observe(step, outcome, start)
+
+            if any(name in self.changed for name in step.requires):
+                self.changed.add(step.name)
+
+        for step in self.steps.values():
+            tasks[step.name] = asyncio.create_task(run_step(step), name=step.name)
+
+        try:
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        except asyncio.CancelledError:
+            # `gather` has cancelled the steps and waited for them
+            await self._cleanup(tasks)
+            raise
+
+        if errors:
+            raise errors[0]
+
+        return self.results
+
+    async def _cleanup(self, tasks: dict[str, asyncio.Task]):
+        succeeded = {
+            name for name, task in tasks.items()
+            if task.done() and not task.cancelled() and task.exception() is None
+        }
+        for stage in self.stages():
+            for step in stage:
+                if step.after and step.name not in succeeded and all(name in succeeded for name in step.requires):
+                    start = time.perf_counter()
+                    with tracer.span(step.name, "step", cleanup=True) as args:
+                        try:
+                            self.results[step.name] = await step.fn()
+                            succeeded.add(step.name)
+                            _observe(step, "success", start)
+                        except Exception as e:
+                            args["error"] = repr(e)
+                            _observe(step, "failure", start)
+
+    async def _resume(self, step: Step):
+        if step.resume is None or self.journal is None:
+            return False
+
+        if any(name in self.changed for name in step.requires):
+            self.journal.forget(step.name)
+            return False
+
+        completed, result = self.journal.get(step.name)
+        if not completed:
+            return False
+
+        if not await step.resume(result):
+            self.journal.forget(step.name)
+            return False
+
+        self.results[step.name] = result
+        return True
+
+
+def _observe(step: Step, outcome: str, start: float):
+    # Per-disk steps (i.e. `format:sda`) are counted together
+    step_duration.observe(time.perf_counter() - start, step.name.split(":")[0], outcome)
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+import errno
+
+__all__ = ["Link", "LinkMonitor", "link_from_message"]
+
+RTMGRP_LINK = 1
+IFF_UP = 0x1
+IFF_LOWER_UP = 0x10000
+LINK_EVENTS = ("RTM_NEWLINK", "RTM_DELLINK")
+
+
+@dataclass
+class Link:
+    index: int
+    name: str
+    up: bool
+    carrier: bool
+    # `RTM_DELLINK`
+    removed: bool = False
+    # Returned by `dump` rather than received as an event
+    dump: bool = False
+
+
+class LinkMonitor:
+    """
+    Receives rtnetlink link events (interfaces appearing, disappearing and changing their state) using pyroute2.
+
+    Like `UeventMonitor`, no event that happens after `open` has returned is missed.
+    """
+
+    def __init__(self):
+        # pyroute2 takes longer to import than the rest of the server, only hotplug subscriptions need it
+        from pyroute2 import AsyncIPRoute
+
+        self.ipr = AsyncIPRoute()
+
+    async def open(self):
+        await self.ipr.bind(groups=RTMGRP_LINK)
+
+    def close(self):
+        self.ipr.close()
+
+    async def dump(self) -> list[Link]:
+        """
+        Returns all existing links (with `dump` set).
+        """
+        return [
+            link_from_message(message, True)
+            async for message in await self.ipr.link("dump")
+            if message.get_attr("IFLA_IFNAME") is not None
+        ]
+
+    async def receive(self) -> list[Link] | None:
+        """
+        Waits for the next batch of link events.
+
+        Returns `None` if events were lost because the receive buffer has overflown.
+        """
+        from pyroute2.netlink.exceptions import NetlinkError
+
+        while True:
+            try:
+                links = [
+                    link_from_message(message)
+                    async for message in self.ipr.get()
+                    if message.get("event") in LINK_EVENTS and message.get_attr("IFLA_IFNAME") is not None
+                ]
+            except NetlinkError as e:
+                if e.code == errno.ENOBUFS:
+                    return None
+
+                raise
+
+            if links:
+                return links
+
+
+def link_from_message(message, dump: bool = False) -> Link:
+    """
+    Converts a pyroute2 `ifinfmsg` to a `Link`.
+    """
+    return Link(
+        message["index"],
+        message.get_attr("IFLA_IFNAME"),
+        bool(message["flags"] & IFF_UP),
+        bool(message["flags"] & IFF_LOWER_UP),
+        message.get("event") == "RTM_DELLINK",
+        dump,
+    )
@@ -1,24 +1,60 @@
+import functools
+import secrets
+
+from aiohttp import web
 import aiohttp_rpc
 
+from truenas_installer.metrics import registry, websockets
 import truenas_installer.server.api  # noqa
 from truenas_installer.server.api.adoption import adoption_middleware
+from .broadcast import BroadcastHub, HubWebSocketResponse
 from .error import exception_middleware
+from .jobs import JobManager
 from .method import methods
 
 __all__ = ["InstallerRPCServer"]
 
 
 class InstallerRPCServer(aiohttp_rpc.WsJsonRpcServer):
-    def __init__(self, installer):
+    def __init__(self, installer, validate_results=False):
         self.installer = installer
+        # Check method results against their `result_schema` (for development and testing)
+        self.validate_results = validate_results
+        # Notifications (`installation_progress`, `hotplug_event`)
+        self.progress_hub = BroadcastHub(self)
+        self.jobs = JobManager()
+        # Set by `adopt`
+        self.access_key = None
         super().__init__(
             middlewares=(
-                adoption_middleware,
+                functools.partial(adoption_middleware, self),
                 exception_middleware,
                 aiohttp_rpc.middlewares.extra_args_middleware,
             ),
+            ws_response_cls=HubWebSocketResponse,
+            ws_response_kwargs={"hub": self.progress_hub},
         )
 
         for method in methods.values():
-            method.server = self
-            self.add_method(aiohttp_rpc.protocol.JsonRpcMethod(method.call, name=method.name))
+            self.add_method(aiohttp_rpc.protocol.JsonRpcMethod(method.bind(self).call, name=method.name))
+
+    async def on_shutdown(self, app):
+        await super().on_shutdown(app)
+        self.progress_hub.close()
+        await self.jobs.close()
+
+    async def handle_metrics(self, http_request):
+        """
+        Serves the metrics in the Prometheus text format.
+
+        Like the RPC methods, they are available to anyone until the system is adopted. From then on, the access key
+        must be sent as a bearer token (`Authorization: Bearer <access key>`).
+        """
+        if self.access_key is not None and not secrets.compare_digest(
+            http_request.headers.get("Authorization", ""), f"Bearer {self.access_key}",
+        ):
+            raise web.HTTPUnauthorized(headers={"WWW-Authenticate": "Bearer"})
+
+        websockets.set(len(self.rcp_websockets))
+        return web.Response(body=registry.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
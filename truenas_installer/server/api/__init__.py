@@ -1,4 +1,7 @@
 import truenas_installer.server.api.adoption  # noqa
+import truenas_installer.server.api.hotplug  # noqa
 import truenas_installer.server.api.info  # noqa
 import truenas_installer.server.api.install  # noqa
+import truenas_installer.server.api.jobs  # noqa
 import truenas_installer.server.api.power  # noqa
+import truenas_installer.server.api.upgrade  # noqa
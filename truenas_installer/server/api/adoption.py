@@ -9,8 +9,6 @@ from truenas_installer.server.method import method
 
 __all__ = ["is_adopted", "adopt", "authenticate"]
 
-access_key = None
-
 
 @method(None, {"type": "boolean"})
 async def is_adopted(context):
@@ -21,7 +19,7 @@ async def is_adopted(context):
     `authenticate` method before trying to do anything else.
     """
 
-    return access_key is not None
+    return context.server.access_key is not None
 
 
 @method(None, {"type": "string"})
@@ -31,16 +29,14 @@ async def adopt(context):
     re-connecting.
     """
 
-    global access_key
-
-    if access_key is not None:
+    if context.server.access_key is not None:
         raise Error("System is already adopted")
 
-    access_key = secrets.token_urlsafe(32)
+    context.server.access_key = secrets.token_urlsafe(32)
 
     setattr(context.rpc_request.context["http_request"], "_authenticated", True)
 
-    return access_key
+    return context.server.access_key
 
 
 @method({"type": "string"}, None)
@@ -49,12 +45,10 @@ async def authenticate(context, key):
     Authenticate the connection on the “adopted” system.
     """
 
-    global access_key
-
-    if access_key is None:
+    if context.server.access_key is None:
         raise Error("The system is not adopted")
 
-    if key != access_key:
+    if key != context.server.access_key:
         raise Error("Invalid access key", errno.EINVAL)
 
     setattr(context.rpc_request.context["http_request"], "_authenticated", True)
@@ -62,8 +56,9 @@ async def authenticate(context, key):
     return True
 
 
-async def adoption_middleware(request: protocol.JsonRpcRequest, handler: typing.Callable) -> protocol.JsonRpcResponse:
-    if access_key is not None:
+async def adoption_middleware(server, request: protocol.JsonRpcRequest,
+                              handler: typing.Callable) -> protocol.JsonRpcResponse:
+    if server.access_key is not None:
         if not (
             request.method_name in ["is_adopted", "authenticate"] or
             getattr(request.context["http_request"], "_authenticated", False)
@@ -0,0 +1,127 @@
+from dataclasses import asdict, dataclass
+import errno
+import fnmatch
+import functools
+import itertools
+
+from truenas_installer.hotplug import HotplugEvent, hotplug_monitor
+from truenas_installer.server.error import Error
+from truenas_installer.server.method import method
+
+__all__ = ["subscribe_hotplug", "unsubscribe_hotplug"]
+
+TYPES = ["disk", "network_interface"]
+ACTIONS = ["add", "remove", "change"]
+
+
+@dataclass
+class Subscription:
+    id: int
+    server: object
+    ws: object
+    types: list[str]
+    actions: list[str]
+    # `fnmatch` patterns, `None` matches every name
+    names: list[str] | None
+
+    def matches(self, event: HotplugEvent):
+        if event.type not in self.types:
+            return False
+
+        if event.action == "resync":
+            return True
+
+        return event.action in self.actions and (
+            self.names is None or any(fnmatch.fnmatchcase(event.name, name) for name in self.names)
+        )
+
+    def dispatch(self, event: HotplugEvent):
+        if self.matches(event):
+            self.server.progress_hub.send(self.ws, "hotplug_event", {"subscription_id": self.id, **asdict(event)})
+
+
+subscriptions = {}
+subscription_ids = itertools.count(1)
+
+
+@method({
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "types": {
+            "type": "array",
+            "items": {"type": "string", "enum": TYPES},
+        },
+        "actions": {
+            "type": "array",
+            "items": {"type": "string", "enum": ACTIONS},
+        },
+        "names": {
+            "type": "array",
+            "items": {"type": "string"},
+        },
+    },
+}, {"type": "integer"})
+async def subscribe_hotplug(context, params):
+    """
+    Subscribes the connection to disks and network interfaces being added, removed or changed (network interfaces
+    change when they go up/down or gain/lose carrier), so that `list_disks` and `list_network_interfaces` do not have
+    to be polled. Returns the subscription id.
+
+    Events can be filtered by `types` (`disk`, `network_interface`), `actions` (`add`, `remove`, `change`) and
+    `names` (shell-style patterns, i.e. `nvme*`). Everything is delivered by default.
+
+    Every matching event is sent as a `hotplug_event` notification. The `resync` action (with a `null` name) means
+    that events of that type were lost and the list should be fetched again; it is delivered regardless of the
+    `actions` and `names` filters.
+
+        {"jsonrpc": "2.0", "method": "hotplug_event", "params": [{"subscription_id": 1, "type": "disk",
+                                                                  "action": "add", "name": "sdc",
+                                                                  "up": null, "carrier": null}]}
+        {"jsonrpc": "2.0", "method": "hotplug_event", "params": [{"subscription_id": 1, "type": "network_interface",
+                                                                  "action": "change", "name": "eno1",
+                                                                  "up": true, "carrier": true}]}
+
+    Notifications are queued like `installation_progress` ones: a connection that falls too far behind loses the
+    oldest ones. Subscriptions end when the connection is closed.
+    """
+    subscription = Subscription(
+        next(subscription_ids),
+        context.server,
+        context.rpc_request.context["ws_connect"],
+        params.get("types", TYPES),
+        params.get("actions", ACTIONS),
+        params.get("names"),
+    )
+
+    # Every subscription is a listener of its own: if the monitor can not be started, concurrent subscriptions all fail
+    # (rather than some of them being registered with nothing behind them)
+    try:
+        await hotplug_monitor.add_listener(subscription.dispatch)
+    except OSError as e:
+        raise Error(f"Unable to receive hotplug events: {e.strerror}", e.errno)
+
+    subscriptions[subscription.id] = subscription
+    if not context.server.progress_hub.on_close(subscription.ws, functools.partial(_remove, subscription)):
+        # Already disconnected
+        _remove(subscription)
+        raise Error("Connection is closed", errno.ECONNRESET)
+
+    return subscription.id
+
+
+@method({"type": "integer"}, None)
+async def unsubscribe_hotplug(context, id_):
+    """
+    Ends a `subscribe_hotplug` subscription of this connection.
+    """
+    subscription = subscriptions.get(id_)
+    if subscription is None or subscription.ws is not context.rpc_request.context["ws_connect"]:
+        raise Error(f"Subscription {id_} does not exist", errno.ENOENT)
+
+    _remove(subscription)
+
+
+def _remove(subscription: Subscription):
+    if subscriptions.pop(subscription.id, None) is not None:
+        hotplug_monitor.remove_listener(subscription.dispatch)
@@ -1,11 +1,17 @@
 from dataclasses import asdict
+import errno
 
-from truenas_installer.disks import list_disks as _list_disks
+from truenas_installer.disks import disk_inventory, list_disks as _list_disks
 from truenas_installer.network_interfaces import list_network_interfaces as _list_network_interfaces
 from truenas_installer.lock import installation_lock
+from truenas_installer.performance import PROBE_DURATION, performance_key, probe_disks as _probe_disks
+from truenas_installer.server.error import Error
 from truenas_installer.server.method import method
+from truenas_installer.server.notification import notification
+from truenas_installer.staging import media_stager
 
-__all__ = ["system_info", "list_disks", "list_network_interfaces"]
+__all__ = ["system_info", "list_disks", "list_all_disks", "list_disks_stream", "probe_disks", "list_network_interfaces",
+           "progress_clients"]
 
 
 @method(None, {
@@ -14,20 +20,41 @@ __all__ = ["system_info", "list_disks", "list_network_interfaces"]
         "installation_running": {"type": "boolean"},
         "version": {"type": "string"},
         "efi": {"type": "boolean"},
+        "staging": {
+            "type": "object",
+            "properties": {
+                "state": {
+                    "type": "string",
+                    "enum": ["idle", "staging", "caching", "staged", "cached", "released", "failed"],
+                },
+                "progress": {"type": "number"},
+                "size": {"type": "integer"},
+            },
+        },
+        "disks_generation": {"type": "integer"},
     },
 })
 async def system_info(context):
     """
     Provides auxiliary system information.
+
+    `staging` reports the progress of reading the installation image into RAM (`staging`, `staged`) or, when there
+    is not enough RAM for that, into the page cache (`caching`, `cached`). The copy in RAM is removed once an
+    installation or an upgrade has finished with it (`released`).
+
+    `disks_generation` changes every time the list of disks is rebuilt, so clients that poll `list_disks` can skip
+    the call if it has not changed.
     """
     return {
         "installation_running": installation_lock.locked(),
         "version": context.server.installer.version,
         "efi": context.server.installer.efi,
+        "staging": media_stager.status(),
+        "disks_generation": disk_inventory.generation,
     }
 
 
-@method(None, {
+DISKS_SCHEMA = {
     "type": "array",
     "items": {
         "type": "object",
@@ -43,18 +70,130 @@ async def system_info(context):
                     "properties": {
                         "name": {"type": "string"},
                         "pool": {"type": "string"},
+                        "pool_guid": {"type": ["string", "null"]},
+                        "txg": {"type": ["integer", "null"]},
+                        "timestamp": {"type": ["integer", "null"]},
+                        "hostid": {"type": ["integer", "null"]},
                     },
                 },
             },
             "removable": {"type": "boolean"},
+            "busy_reasons": {
+                "type": "array",
+                "items": {"type": "string"},
+            },
+            "performance": {
+                "type": ["object", "null"],
+                "properties": {
+                    "sequential_read": {"type": "number"},
+                    "random_read_iops": {"type": "number"},
+                    "rotational": {"type": ["boolean", "null"]},
+                    "transport": {"type": ["string", "null"]},
+                },
+            },
         },
     },
-})
+}
+
+
+@method(None, DISKS_SCHEMA)
 async def list_disks(context):
     """
     Provides list of available disks.
+
+    The list is cached and kept up to date using kernel block device events.
+
+    Disks that are in use (mounted, used as swap or by `md`/device-mapper devices) can not be used for installation
+    and are not listed (see `list_all_disks`).
+
+    `zfs_members` details (`pool_guid`, the last `txg` written, its `timestamp` and the `hostid` of the system that
+    wrote it) are read from the vdev labels and are `null` if the labels can not be read.
+
+    `performance` is `null` until the disk is measured with `probe_disks`. Measured disks are listed first, fastest
+    first.
+    """
+    return [asdict(disk) for disk in sorted(await _list_disks(), key=performance_key)]
+
+
+@method(None, DISKS_SCHEMA)
+async def list_all_disks(context):
+    """
+    Same as `list_disks`, but also lists the disks that are in use, with non-empty `busy_reasons` (i.e. `mounted`,
+    `swap` or `holders`).
     """
-    return [asdict(disk) for disk in await _list_disks()]
+    return [asdict(disk) for disk in sorted(await _list_disks(include_busy=True), key=performance_key)]
+
+
+@method({
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "force_rescan": {"type": "boolean"},
+        "include_busy": {"type": "boolean"},
+    },
+}, {"type": "integer"})
+async def list_disks_stream(context, params):
+    """
+    Same as `list_disks`, but instead of returning the list, sends every disk to the caller as a `disk_discovered`
+    notification as soon as it has been discovered (in no particular order), followed by a
+    `disk_discovery_finished` notification. Both carry the `request_id` of the call. Returns the number of disks.
+
+    Unless `force_rescan` is set, the disks are sent from the cached list right away if it is up to date. Disks that
+    are in use are only sent with `include_busy` set (see `list_all_disks`).
+
+        {"jsonrpc": "2.0", "method": "disk_discovered", "params": [{"request_id": 1, "disk": {"name": "sda", ...}}]}
+        {"jsonrpc": "2.0", "method": "disk_discovery_finished", "params": [{"request_id": 1, "count": 24}]}
+    """
+    ws = context.rpc_request.context["ws_connect"]
+    request_id = context.rpc_request.id
+    count = 0
+    async for disk in disk_inventory.stream(params.get("force_rescan", False)):
+        if disk.busy_reasons and not params.get("include_busy", False):
+            continue
+
+        await ws.send_str(notification(context.server, "disk_discovered", {
+            "request_id": request_id,
+            "disk": asdict(disk),
+        }))
+        count += 1
+
+    await ws.send_str(notification(context.server, "disk_discovery_finished", {
+        "request_id": request_id,
+        "count": count,
+    }))
+    return count
+
+
+@method({
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "disks": {
+            "type": "array",
+            "items": {"type": "string"},
+        },
+        "duration": {"type": "number", "exclusiveMinimum": 0, "maximum": 10},
+    },
+}, DISKS_SCHEMA)
+async def probe_disks(context, params):
+    """
+    Measures sequential read throughput (MB/s) and random read IOPS of `disks` (all disks that are not in use by
+    default), in parallel, reading each one for at most `duration` seconds (1 by default). Nothing is written.
+
+    Returns the measured disks (like `list_disks`), fastest first. The results are also included in `list_disks`.
+    """
+    disks = await _list_disks(include_busy=True)
+    if "disks" in params:
+        by_name = {disk.name: disk for disk in disks}
+        try:
+            disks = [by_name[disk_name] for disk_name in params["disks"]]
+        except KeyError as e:
+            raise Error(f"Disk {e.args[0]!r} does not exist", errno.EFAULT)
+    else:
+        disks = [disk for disk in disks if not disk.busy_reasons]
+
+    await _probe_disks(disks, params.get("duration", PROBE_DURATION))
+    return [asdict(disk) for disk in sorted(disks, key=performance_key)]
 
 
 @method(None, {
@@ -71,3 +210,28 @@ async def list_network_interfaces(context):
     Provides list of available network interfaces.
     """
     return [asdict(interface) for interface in await _list_network_interfaces()]
+
+
+@method(None, {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "remote": {"type": ["string", "null"]},
+            "queued": {"type": "integer"},
+            "lag": {"type": "number"},
+            "sent": {"type": "integer"},
+            "coalesced": {"type": "integer"},
+            "dropped": {"type": "integer"},
+        },
+    },
+})
+async def progress_clients(context):
+    """
+    Reports how well the connected clients keep up with `installation_progress` notifications.
+
+    `queued` notifications have not been sent yet, the oldest of them `lag` seconds ago. A client that does not keep
+    up only receives the latest progress of every installation step (the rest is `coalesced`), and once more than 64
+    notifications are queued, the oldest ones are `dropped`.
+    """
+    return context.server.progress_hub.stats()
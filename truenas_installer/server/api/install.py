@@ -1,20 +1,19 @@
-import asyncio
+import contextvars
 import errno
 import functools
 
-from aiohttp_rpc.protocol import JsonRpcRequest
-
 from truenas_installer.disks import list_disks
 from truenas_installer.exception import InstallError
 from truenas_installer.install import install as install_
+from truenas_installer.lock import installation_lock
 from truenas_installer.serial import serial_sql
 from truenas_installer.server.error import Error
 from truenas_installer.server.method import method
+from truenas_installer.trace import tracer
 
-__all__ = ["install"]
-
+__all__ = ["install", "install_start", "install_trace"]
 
-@method({
+INSTALL_SCHEMA = {
     "type": "object",
     "required": ["disks", "set_pmbr", "authentication"],
     "additionalProperties": False,
@@ -28,6 +27,8 @@ __all__ = ["install"]
             "items": {"type": "string"},
         },
         "set_pmbr": {"type": "boolean"},
+        "dry_run": {"type": "boolean"},
+        "discard": {"type": "boolean"},
         "authentication": {
             "type": ["object", "null"],
             "required": ["username", "password"],
@@ -76,12 +77,60 @@ __all__ = ["install"]
             },
         },
     },
-}, None)
+}
+
+
+@method(INSTALL_SCHEMA, None)
 async def install(context, params):
     """
     Performs system installation.
+
+    With `dry_run` set, nothing is changed on the system: the installation steps, their dependencies and the steps
+    that can run concurrently are reported using `installation_progress` notifications instead.
+
+    With `discard` set, destination disks and `wipe_disks` are discarded as a whole before they are wiped, which
+    quickly erases all of their data on SSDs. Disks that do not support discard are only wiped (with a warning).
+
+    Disks that are in use (see `busy_reasons` in `list_all_disks`) can not be installed to or wiped.
     """
-    disks = {disk.name: disk for disk in await list_disks()}
+    destination_disks, wipe_disks = await _install_disks(params)
+    await _install(context.server, params, destination_disks, wipe_disks, functools.partial(callback, context.server))
+
+
+@method(INSTALL_SCHEMA, {"type": "integer"})
+async def install_start(context, params):
+    """
+    Same as `install`, but returns right after the parameters have been checked, with the id of the job that
+    performs the installation in the background. The installation does not depend on the connection that has
+    started it: use `job_status` or `job_wait` to get its outcome and `job_abort` to abort it.
+
+    Progress is reported using `installation_progress` notifications, and the last one is also available in the
+    job status.
+    """
+    destination_disks, wipe_disks = await _install_disks(params)
+
+    # Nothing is awaited from here until the job is started, so concurrent calls can not both start one. The job runs
+    # in `lock_context` and holds the lock until it is done (even if it is aborted before it has started running).
+    lock_context = contextvars.copy_context()
+    try:
+        lock_context.run(installation_lock.acquire)
+    except InstallError as e:
+        raise Error(e.message, errno.EBUSY)
+
+    def run(job):
+        def job_callback(progress, message):
+            job.set_progress(progress, message)
+            callback(context.server, progress, message)
+
+        return _install(context.server, params, destination_disks, wipe_disks, job_callback)
+
+    job = context.server.jobs.start("install", run, lock_context)
+    job.task.add_done_callback(lambda task: installation_lock.release(), context=lock_context)
+    return job.id
+
+
+async def _install_disks(params):
+    disks = {disk.name: disk for disk in await list_disks(force_rescan=True, include_busy=True)}
 
     try:
         destination_disks = [disks[disk_name] for disk_name in params["disks"]]
@@ -93,6 +142,12 @@ async def install(context, params):
     except KeyError as e:
         raise Error(f"Disk {e.args[0]!r} does not exist", errno.EFAULT)
 
+    check_not_busy(destination_disks + wipe_disks)
+    return destination_disks, wipe_disks
+
+
+async def _install(server, params, destination_disks, wipe_disks, progress_callback):
+    server.progress_hub.reset()
     try:
         await install_(
             destination_disks,
@@ -101,19 +156,41 @@ async def install(context, params):
             params["authentication"],
             params.get("post_install", None),
             await serial_sql(),
-            functools.partial(callback, context.server),
+            progress_callback,
+            params.get("dry_run", False),
+            params.get("discard", False),
         )
     except InstallError as e:
         raise Error(e.message, errno.EFAULT)
 
 
+@method(None, {
+    "type": "object",
+    "properties": {
+        "traceEvents": {"type": "array"},
+        "displayTimeUnit": {"type": "string"},
+    },
+})
+async def install_trace(context):
+    """
+    Returns the timings of the last installation in the Chrome trace event format (it can be opened in Perfetto or
+    chrome://tracing): a span for every installation step and for every command it has run. While an installation is
+    running, returns its trace so far.
+    """
+    if tracer.events:
+        return tracer.trace()
+
+    return tracer.load()
+
+
+def check_not_busy(disks):
+    if busy := [disk for disk in disks if disk.busy_reasons]:
+        raise Error(
+            "Disk(s) are in use: " + "; ".join(f"{disk.name} ({', '.join(disk.busy_reasons)})" for disk in busy),
+            errno.EBUSY,
+        )
+
+
 def callback(server, progress, message):
-    request = server.json_serialize(
-        JsonRpcRequest(
-            "installation_progress",
-            params=[{"progress": progress, "message": message}]
-        ).dump()
-    )
-
-    for other in server.rcp_websockets:
-        asyncio.ensure_future(other.send_str(request))
+    # Progress updates of the same step supersede each other
+    server.progress_hub.publish("installation_progress", {"progress": progress, "message": message}, key=message)
@@ -0,0 +1,68 @@
+from truenas_installer.server.method import method
+
+__all__ = ["job_status", "job_wait", "job_abort"]
+
+JOB_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "integer"},
+        "method": {"type": "string"},
+        "state": {
+            "type": "string",
+            "enum": ["RUNNING", "SUCCESS", "FAILED", "ABORTED"],
+        },
+        "progress": {
+            "type": ["object", "null"],
+            "properties": {
+                "progress": {"type": "number"},
+                "message": {"type": "string"},
+            },
+        },
+        "result": {},
+        "error": {
+            "type": ["object", "null"],
+            "properties": {
+                "message": {"type": "string"},
+                "errno": {"type": ["string", "null"]},
+            },
+        },
+        "started": {"type": "number"},
+        "finished": {"type": ["number", "null"]},
+    },
+}
+
+
+@method({"type": "integer"}, JOB_SCHEMA)
+async def job_status(context, id_):
+    """
+    Returns the state of the job, its last progress and, once it has finished, its result or error. The last 16
+    finished jobs are kept.
+    """
+    return context.server.jobs.get(id_).status()
+
+
+@method({
+    "type": "object",
+    "required": ["id"],
+    "additionalProperties": False,
+    "properties": {
+        "id": {"type": "integer"},
+        "timeout": {"type": "number", "minimum": 0},
+    },
+}, JOB_SCHEMA)
+async def job_wait(context, params):
+    """
+    Waits until the job has finished (or for at most `timeout` seconds) and returns its status, like `job_status`.
+    """
+    return (await context.server.jobs.wait(params["id"], params.get("timeout"))).status()
+
+
+@method({"type": "integer"}, JOB_SCHEMA)
+async def job_abort(context, id_):
+    """
+    Aborts the job: the commands it is running are terminated and the cleanup steps (unmounting the installation
+    media, exporting the boot pool) are run. Returns once that is done, with the job status.
+
+    Disks may be left partially formatted. Starting the installation again resumes where it has stopped.
+    """
+    return (await context.server.jobs.abort(id_)).status()
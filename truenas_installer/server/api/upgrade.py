@@ -0,0 +1,56 @@
+import errno
+import functools
+
+from truenas_installer.disks import list_disks
+from truenas_installer.exception import InstallError
+from truenas_installer.serial import serial_sql
+from truenas_installer.server.api.install import callback, check_not_busy
+from truenas_installer.server.error import Error
+from truenas_installer.server.method import method
+from truenas_installer.upgrade import boot_pool_disks, upgrade as upgrade_
+
+__all__ = ["upgrade"]
+
+
+@method({
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "disks": {
+            "type": "array",
+            "items": {"type": "string"},
+        },
+        "dry_run": {"type": "boolean"},
+    },
+}, None)
+async def upgrade(context, params):
+    """
+    Upgrades the existing installation without reformatting its disks: the system is installed into a new boot
+    environment of the existing boot pool, the configuration is carried over from the active boot environment, and
+    the new boot environment is activated. The previous boot environment remains available as a rollback target.
+
+    `disks` defaults to all disks that contain the existing boot pool. Progress is reported using
+    `installation_progress` notifications, like for `install`.
+    """
+    disks = {disk.name: disk for disk in await list_disks(force_rescan=True, include_busy=True)}
+
+    if "disks" in params:
+        try:
+            upgrade_disks = [disks[disk_name] for disk_name in params["disks"]]
+        except KeyError as e:
+            raise Error(f"Disk {e.args[0]!r} does not exist", errno.EFAULT)
+    else:
+        upgrade_disks = boot_pool_disks(list(disks.values()))
+
+    check_not_busy(upgrade_disks)
+
+    context.server.progress_hub.reset()
+    try:
+        await upgrade_(
+            upgrade_disks,
+            await serial_sql(),
+            functools.partial(callback, context.server),
+            params.get("dry_run", False),
+        )
+    except InstallError as e:
+        raise Error(e.message, errno.EFAULT)
@@ -0,0 +1,195 @@
+import asyncio
+import collections
+from dataclasses import dataclass, field
+import logging
+import time
+
+from aiohttp import web
+
+from .notification import notification
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["BroadcastHub", "HubWebSocketResponse"]
+
+# Per client. When a client does not keep up, its oldest messages are dropped.
+QUEUE_SIZE = 64
+# How many recent messages are sent to the clients that connect while an operation is running
+REPLAY_SIZE = 16
+
+
+@dataclass
+class Message:
+    # Messages with the same key supersede each other (i.e. progress updates of the same installation step)
+    key: object
+    data: str
+    published: float = field(default_factory=time.monotonic)
+
+
+class Client:
+    def __init__(self, ws, remote):
+        self.ws = ws
+        self.remote = remote
+        self.queue = collections.deque()
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.task = None
+        # Called once the client has disconnected
+        self.close_callbacks = []
+
+    def put(self, message: Message, queue_size: int):
+        if self.queue and self.queue[-1].key == message.key:
+            # Not sent yet, the client only needs the latest one
+            self.queue[-1] = message
+            self.coalesced += 1
+        else:
+            if len(self.queue) >= queue_size:
+                self.queue.popleft()
+                self.dropped += 1
+
+            self.queue.append(message)
+
+        self.ready.set()
+
+    def stats(self):
+        return {
+            "remote": self.remote,
+            "queued": len(self.queue),
+            # How long the oldest message that has not been sent yet has been waiting, in seconds
+            "lag": round(time.monotonic() - self.queue[0].published, 3) if self.queue else 0,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
+
+
+class BroadcastHub:
+    """
+    Sends notifications to every connected client.
+
+    Every client has its own bounded queue and sender, so a slow or stalled client neither delays the others nor
+    grows the memory usage. A client that connects while an operation is running receives its most recent
+    messages first.
+
+    Notifications for a single client (i.e. for its `subscribe_hotplug` subscriptions) go through the same queue
+    (`send`).
+    """
+
+    def __init__(self, server, queue_size: int = QUEUE_SIZE, replay_size: int = REPLAY_SIZE):
+        self.server = server
+        self.queue_size = queue_size
+        self.replay = collections.deque(maxlen=replay_size)
+        self.clients = {}
+
+    def subscribe(self, ws, remote=None):
+        self._prune()
+
+        client = Client(ws, remote)
+        for message in self.replay:
+            client.put(message, self.queue_size)
+
+        client.task = asyncio.get_running_loop().create_task(self._send(client))
+        self.clients[ws] = client
+
+    def unsubscribe(self, ws):
+        if (client := self.clients.pop(ws, None)) is not None:
+            client.task.cancel()
+            for callback in client.close_callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.error("Unhandled exception in disconnect callback", exc_info=True)
+
+    def on_close(self, ws, callback) -> bool:
+        """
+        Calls `callback()` once the client disconnects. Returns `False` (and does not call it) if it is already
+        disconnected.
+        """
+        self._prune()
+        if (client := self.clients.get(ws)) is None:
+            return False
+
+        client.close_callbacks.append(callback)
+        return True
+
+    def publish(self, name: str, params: dict, key=None):
+        """
+        Queues a notification for every client. The notification supersedes the last one with the same (non-`None`)
+        `key` for clients that have not received it yet.
+        """
+        message = Message(key if key is not None else object(), notification(self.server, name, params))
+
+        if self.replay and self.replay[-1].key == message.key:
+            self.replay[-1] = message
+        else:
+            self.replay.append(message)
+
+        self._prune()
+        for client in self.clients.values():
+            client.put(message, self.queue_size)
+
+    def send(self, ws, name: str, params: dict, key=None):
+        """
+        Queues a notification for a single client. Does nothing if it has disconnected.
+        """
+        if (client := self.clients.get(ws)) is not None and not ws.closed:
+            client.put(Message(key if key is not None else object(), notification(self.server, name, params)),
+                       self.queue_size)
+
+    def reset(self):
+        """
+        Forgets the messages of the previous operation, so that they are not replayed.
+        """
+        self.replay.clear()
+
+    def close(self):
+        for ws in list(self.clients):
+            self.unsubscribe(ws)
+
+    def stats(self) -> list[dict]:
+        self._prune()
+        return [client.stats() for client in self.clients.values()]
+
+    def _prune(self):
+        for ws in [ws for ws in self.clients if ws.closed]:
+            self.unsubscribe(ws)
+
+    async def _send(self, client: Client):
+        try:
+            while True:
+                await client.ready.wait()
+                while client.queue:
+                    await client.ws.send_str(client.queue.popleft().data)
+                    client.sent += 1
+
+                client.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug("Unable to send notification to %r: %r", client.remote, e)
+            self.unsubscribe(client.ws)
+
+
+class HubWebSocketResponse(web.WebSocketResponse):
+    """
+    Subscribes the websocket to the `BroadcastHub` once it is connected, and unsubscribes it as soon as the
+    connection ends (the RPC server stops reading messages).
+    """
+
+    def __init__(self, *, hub: BroadcastHub, **kwargs):
+        super().__init__(**kwargs)
+        self.hub = hub
+
+    async def prepare(self, request):
+        writer = await super().prepare(request)
+        self.hub.subscribe(self, request.remote)
+        return writer
+
+    async def __anext__(self):
+        try:
+            return await super().__anext__()
+        except BaseException:
+            self.hub.unsubscribe(self)
+            raise
@@ -31,6 +31,15 @@ def generate_api_doc():
             print(textwrap.indent(json.dumps(method.result_schema, indent=2), "    "))
             print()
 
+    print("# HTTP endpoints")
+    print()
+    print("## GET /metrics")
+    print()
+    print("Installer metrics in the Prometheus text format. Available to anyone until the system is adopted; from")
+    print("then on, the access key returned by `adopt` must be sent as a bearer token")
+    print("(`Authorization: Bearer <access key>`), otherwise the response is `401 Unauthorized`.")
+    print()
+
     print("# Client methods")
     print()
     print("## installation_progress")
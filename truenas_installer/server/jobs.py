@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+import errno
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable
+
+from .error import Error
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["Job", "JobManager"]
+
+# Finished jobs that are kept for clients that reconnect to collect their results
+MAX_FINISHED_JOBS = 16
+
+
+class Job:
+    def __init__(self, id_: int, method: str):
+        self.id = id_
+        self.method = method
+        self.state = "RUNNING"
+        # The last `installation_progress` of the job
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.task = None
+
+    def set_progress(self, progress, message):
+        self.progress = {"progress": progress, "message": message}
+
+    def status(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "state": self.state,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+    async def run(self, fn: Callable[["Job"], Awaitable]):
+        try:
+            self.result = await fn(self)
+            self.state = "SUCCESS"
+        except asyncio.CancelledError:
+            self.state = "ABORTED"
+        except Error as e:
+            self.state = "FAILED"
+            self.error = {"message": e.text, "errno": errno.errorcode.get(e.code)}
+        except Exception as e:
+            logger.error("Unhandled exception in job %r", self.method, exc_info=True)
+            self.state = "FAILED"
+            self.error = {"message": str(e) or repr(e), "errno": None}
+        finally:
+            self.finished = time.time()
+
+
+class JobManager:
+    """
+    Runs long operations (i.e. the installation) in the background, so that they do not depend on the connection
+    that has started them, and keeps their results.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.ids = itertools.count(1)
+
+    def start(self, method: str, fn: Callable[[Job], Awaitable], context: contextvars.Context | None = None) -> Job:
+        """
+        Runs `fn(job)` as a new job (in `context`, if specified). Its return value becomes the job result.
+        """
+        self._prune()
+
+        job = Job(next(self.ids), method)
+        job.task = asyncio.get_running_loop().create_task(job.run(fn), context=context)
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, id_: int) -> Job:
+        try:
+            return self.jobs[id_]
+        except KeyError:
+            raise Error(f"Job {id_} does not exist", errno.ENOENT) from None
+
+    async def wait(self, id_: int, timeout: float | None = None) -> Job:
+        job = self.get(id_)
+        # `asyncio.wait` does not cancel the job when the waiter is cancelled or times out
+        await asyncio.wait([job.task], timeout=timeout)
+        return job
+
+    async def abort(self, id_: int) -> Job:
+        """
+        Cancels the job and waits until it has cleaned up.
+        """
+        job = self.get(id_)
+        job.task.cancel()
+        await asyncio.wait([job.task])
+        return job
+
+    async def close(self):
+        if tasks := [job.task for job in self.jobs.values() if not job.task.done()]:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.wait(tasks)
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if job.finished is not None]
+        for job in finished[:max(len(finished) - MAX_FINISHED_JOBS + 1, 0)]:
+            del self.jobs[job.id]
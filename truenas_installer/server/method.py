@@ -1,11 +1,16 @@
 # -*- coding=utf-8 -*-
+import asyncio
+import copy
 from dataclasses import dataclass
 import errno
 import logging
+import time
 
+from truenas_installer.metrics import rpc_calls, rpc_duration
 from truenas_installer.server.error import Error
 
-from jsonschema import validate, ValidationError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 logger = logging.getLogger(__name__)
 
@@ -27,8 +32,37 @@ class Method:
         self.result_schema = result_schema
         self.fn = fn
         self.server = None
+        # Checking the schema and building the validator is much more expensive than validating a typical request
+        self.validator = compile_schema(schema)
+        self.result_validator = compile_schema(result_schema)
+
+    def bind(self, server):
+        """
+        Returns a copy of the method that is served by `server`. Methods are registered globally, and there can be
+        more than one server in a process (i.e. in tests).
+        """
+        bound = copy.copy(self)
+        bound.server = server
+        return bound
 
     async def call(self, rpc_request, *args):
+        start = time.perf_counter()
+        outcome = "exception"
+        try:
+            result = await self._call(rpc_request)
+            outcome = "success"
+            return result
+        except Error:
+            outcome = "error"
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            rpc_calls.inc(self.name, outcome)
+            rpc_duration.observe(time.perf_counter() - start, self.name)
+
+    async def _call(self, rpc_request):
         args = (Context(self.server, rpc_request),)
 
         if self.schema is not None:
@@ -36,17 +70,30 @@ class Method:
                 raise Error(f"1 parameter required, found {len(rpc_request.args)}", errno.EINVAL)
 
             param = rpc_request.args[0]
-            try:
-                validate(param, self.schema)
-            except ValidationError as e:
-                raise Error(str(e), errno.EINVAL)
+            if (error := best_match(self.validator.iter_errors(param))) is not None:
+                raise Error(str(error), errno.EINVAL)
 
             args += (param,)
         else:
             if len(rpc_request.args) != 0:
                 raise Error(f"0 parameters required, found {len(rpc_request.args)}", errno.EINVAL)
 
-        return await self.fn(*args)
+        result = await self.fn(*args)
+
+        if self.result_validator is not None and self.server.validate_results:
+            if (error := best_match(self.result_validator.iter_errors(result))) is not None:
+                raise RuntimeError(f"Method {self.name!r} returned an invalid result: {error}")
+
+        return result
+
+
+def compile_schema(schema):
+    if schema is None:
+        return None
+
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
 
 
 def method(schema, result_schema):
@@ -0,0 +1,10 @@
+from aiohttp_rpc.protocol import JsonRpcRequest
+
+__all__ = ["notification"]
+
+
+def notification(server, name: str, params: dict) -> str:
+    """
+    Serializes a JSON-RPC notification (a request without an `id`) for sending to clients.
+    """
+    return server.json_serialize(JsonRpcRequest(name, params=[params]).dump())
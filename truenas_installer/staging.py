@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import os
+
+from .media import IMAGE_PATH
+
+__all__ = ["media_stager"]
+
+STAGING_DIRECTORY = "/dev/shm/truenas_installer"
+READ_SIZE = 8 * 1024 * 1024
+# RAM that must remain available after the image is copied into tmpfs
+MEMORY_RESERVE = 2 * 1024 ** 3
+
+
+class MediaStager:
+    """
+    Reads the installation image in the background from the moment the installer starts, while the user is still
+    going through the installer dialogs or the RPC client is yet to call `install`.
+
+    If there is enough RAM, the image is copied into tmpfs. Otherwise, it is only read through (so that it ends up in
+    the page cache). Either way, its SHA256 checksum is calculated along the way.
+
+    The copy is removed (`released`) once the image has been unmounted, so that it does not take up RAM for the rest
+    of the session. Installations that follow use the original media.
+    """
+
+    def __init__(self, path: str = IMAGE_PATH, directory: str = STAGING_DIRECTORY):
+        self.path = path
+        self.directory = directory
+        self.staged_path = os.path.join(directory, os.path.basename(path))
+        # idle, staging, caching, staged, cached, released, failed
+        self.state = "idle"
+        self.error = None
+        self.size = 0
+        self.read_bytes = 0
+        self.sha256 = None
+        self.task = None
+        # Set once it is known whether the image is copied into tmpfs or not
+        self.decided = asyncio.Event()
+        self.stopped = False
+
+    async def on_startup(self, app):
+        self.start()
+
+    async def on_shutdown(self, app):
+        self.stop()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        self.stopped = True
+        self.release()
+
+    def release(self):
+        """
+        Removes the copy of the image from tmpfs.
+        """
+        if self.state == "staged":
+            self.state = "released"
+            try:
+                os.unlink(self.staged_path)
+            except FileNotFoundError:
+                pass
+
+    def status(self):
+        return {
+            "state": self.state,
+            "progress": self.read_bytes / self.size if self.size else 0,
+            "size": self.size,
+        }
+
+    async def wait(self):
+        """
+        Waits for the staging that is in progress to finish.
+        """
+        if self.task is not None:
+            await asyncio.shield(self.task)
+
+    async def mount_source(self):
+        """
+        Returns the path the installation image should be mounted from, and whether the loop device should use direct
+        I/O for it (a copy that is already in RAM does not need to be cached once again).
+        """
+        if self.state == "idle" and self.task is not None:
+            await self.decided.wait()
+
+        if self.state == "staging":
+            # The copy will be ready long before the same data could be read from the original media once again
+            await self.wait()
+
+        if self.state == "staged":
+            return self.staged_path, True
+
+        return self.path, False
+
+    async def _run(self):
+        try:
+            try:
+                self.size = await asyncio.to_thread(os.path.getsize, self.path)
+                self.state = "staging" if await asyncio.to_thread(self._fits_in_memory) else "caching"
+            finally:
+                self.decided.set()
+
+            await asyncio.to_thread(self._stage)
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+
+    def _stage(self):
+        if self.state == "staging":
+            os.makedirs(self.directory, exist_ok=True)
+            partial_path = f"{self.staged_path}.partial"
+            try:
+                with open(partial_path, "wb") as f:
+                    sha256 = self._read(f)
+                os.rename(partial_path, self.staged_path)
+            except BaseException:
+                try:
+                    os.unlink(partial_path)
+                except FileNotFoundError:
+                    pass
+                raise
+
+            self.state = "staged"
+        else:
+            sha256 = self._read(None)
+            self.state = "cached"
+
+        self.sha256 = sha256
+
+    def _read(self, output):
+        sha256 = hashlib.sha256()
+        buffer = bytearray(READ_SIZE)
+        with open(self.path, "rb", buffering=0) as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            with memoryview(buffer) as view:
+                while n := f.readinto(buffer):
+                    if self.stopped:
+                        raise RuntimeError("Staging was stopped")
+
+                    sha256.update(view[:n])
+                    if output is not None:
+                        output.write(view[:n])
+                    self.read_bytes += n
+
+        return sha256.hexdigest()
+
+    def _fits_in_memory(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmpfs = os.statvfs(self.directory)
+            with open("/proc/meminfo") as f:
+                meminfo = dict(line.split(":", 1) for line in f.read().splitlines())
+            available = int(meminfo["MemAvailable"].split()[0]) * 1024
+        except (OSError, KeyError, ValueError):
+            return False
+
+        return (
+            tmpfs.f_bavail * tmpfs.f_frsize > self.size and
+            available - self.size > MEMORY_RESERVE
+        )
+
+
+media_stager = MediaStager()
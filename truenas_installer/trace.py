@@ -0,0 +1,114 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+__all__ = ["tracer"]
+
+TRACE_PATH = "/run/truenas_installer_trace.json"
+
+
+class Tracer:
+    """
+    Records timed spans in the Chrome trace event format (which Perfetto and chrome://tracing can open).
+
+    Every asyncio task (i.e. every installation plan step) gets its own track named after it, so spans recorded
+    within a task (i.e. subprocesses it runs) are nested under it.
+
+    Spans are only recorded within `recording()` (and the tasks and threads it starts), so that commands run outside
+    of an installation or upgrade (i.e. disk rescans) do not end up in its trace.
+    """
+
+    def __init__(self, path: str = TRACE_PATH):
+        self.path = path
+        self.events = []
+        self.tracks = {}
+        self.pid = os.getpid()
+        self.active = contextvars.ContextVar("tracer_active", default=False)
+
+    def reset(self):
+        self.events = []
+        self.tracks = {}
+
+    @contextlib.contextmanager
+    def recording(self):
+        """
+        Starts a new trace and records the spans of the `with` block. The trace is kept after the block exits.
+        """
+        self.reset()
+        token = self.active.set(True)
+        try:
+            yield
+        finally:
+            self.active.reset(token)
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args):
+        """
+        Records the time spent in the `with` block. The yielded `args` dictionary can be updated within the block to
+        attach more information to the span.
+        """
+        if not self.active.get():
+            yield args
+            return
+
+        track = self._track()
+        start = time.monotonic_ns()
+        try:
+            yield args
+        finally:
+            self.events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start / 1000,
+                "dur": (time.monotonic_ns() - start) / 1000,
+                "pid": self.pid,
+                "tid": track,
+                "args": args,
+            })
+
+    def trace(self):
+        return {"traceEvents": self.events, "displayTimeUnit": "ms"}
+
+    def dump(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.trace(), f)
+        os.rename(tmp_path, self.path)
+
+    def load(self):
+        """
+        Returns the last trace that was written to disk (possibly by a previous installer process).
+        """
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"traceEvents": [], "displayTimeUnit": "ms"}
+
+    def _track(self):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+
+        # Names, not the tasks and threads themselves, so that finished ones are not kept alive
+        name = task.get_name() if task is not None else threading.current_thread().name
+        if name not in self.tracks:
+            self.tracks[name] = len(self.tracks) + 1
+            self.events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self.pid,
+                "tid": self.tracks[name],
+                "args": {"name": name},
+            })
+
+        return self.tracks[name]
+
+
+tracer = Tracer()
@@ -0,0 +1,85 @@
+import asyncio
+from dataclasses import dataclass
+import socket
+
+__all__ = ["Uevent", "UeventMonitor"]
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_EVENTS_GROUP = 1
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+@dataclass
+class Uevent:
+    action: str
+    devpath: str
+    properties: dict
+
+    @property
+    def subsystem(self):
+        return self.properties.get("SUBSYSTEM")
+
+    @property
+    def name(self):
+        return self.devpath.rsplit("/", 1)[-1]
+
+
+class UeventMonitor:
+    """
+    Receives kernel uevents (the same events udev receives) over netlink.
+
+    The socket is opened in the constructor so that no event that happens after the monitor is created is missed.
+    """
+
+    def __init__(self, subsystem: str | None = None):
+        self.subsystem = subsystem
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC,
+                                    NETLINK_KOBJECT_UEVENT)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+            self.socket.bind((0, KERNEL_EVENTS_GROUP))
+            self.socket.setblocking(False)
+        except Exception:
+            self.socket.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.socket.close()
+
+    async def receive(self) -> Uevent | None:
+        """
+        Waits for the next uevent of the requested subsystem.
+
+        Returns `None` if events were lost because the receive buffer has overflown, the caller should then assume
+        that anything could have changed.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                data = await loop.sock_recv(self.socket, 65536)
+            except OSError:
+                # ENOBUFS
+                return None
+
+            if (event := parse_uevent(data)) is None:
+                continue
+
+            if self.subsystem is None or event.subsystem == self.subsystem:
+                return event
+
+
+def parse_uevent(data: bytes) -> Uevent | None:
+    # Kernel uevents look like `add@/devices/...\0ACTION=add\0DEVPATH=/devices/...\0SUBSYSTEM=block\0...`
+    header, *fields = data.decode("utf-8", "ignore").split("\0")
+    if "@" not in header:
+        return None
+
+    action, devpath = header.split("@", 1)
+    properties = dict(field.split("=", 1) for field in fields if "=" in field)
+    return Uevent(properties.get("ACTION", action), properties.get("DEVPATH", devpath), properties)
@@ -0,0 +1,224 @@
+import asyncio
+import functools
+import os
+import subprocess
+import tempfile
+from typing import Callable
+
+from .disks import Disk, disk_inventory
+from .exception import InstallError
+from .install import BOOT_POOL, run_installer
+from .lock import installation_lock
+from .media import InstallMedia
+from .metrics import operations
+from .plan import Plan
+from .staging import media_stager
+from .trace import tracer
+from .utils import run, to_thread
+
+__all__ = ["boot_pool_disks", "stale_boot_pool_disks", "upgrade", "upgrade_plan"]
+
+
+def boot_pool_disks(disks: list[Disk]) -> list[Disk]:
+    """
+    Returns the disks that hold the existing boot pool.
+
+    When disks hold several different boot pools (i.e. left over from previous installations on other disks), the
+    one that was written to last (according to the uberblock timestamps in the vdev labels) is the existing one, the
+    others are stale. Transaction group numbers are only compared when the timestamps are equal (or unknown): every
+    pool counts them on its own, so an old, long-used pool would beat a newly installed one.
+    """
+    pools = _boot_pools(disks)
+    if not pools:
+        return []
+
+    def last_written(pool_guid):
+        members = [
+            zfs_member
+            for disk in pools[pool_guid]
+            for zfs_member in disk.zfs_members
+            if zfs_member.pool == BOOT_POOL
+        ]
+        return (
+            max(zfs_member.timestamp or 0 for zfs_member in members),
+            max(zfs_member.txg or 0 for zfs_member in members),
+        )
+
+    return pools[max(pools, key=last_written)]
+
+
+def stale_boot_pool_disks(disks: list[Disk]) -> list[Disk]:
+    """
+    Returns the disks that hold boot pools other than the existing one.
+    """
+    current = boot_pool_disks(disks)
+    return [disk for pool_disks in _boot_pools(disks).values() for disk in pool_disks if disk not in current]
+
+
+def _boot_pools(disks: list[Disk]) -> dict[str | None, list[Disk]]:
+    # Members whose labels could not be read are assumed to belong to the same pool
+    pools = {}
+    for disk in disks:
+        for zfs_member in disk.zfs_members:
+            if zfs_member.pool == BOOT_POOL:
+                pools.setdefault(zfs_member.pool_guid, []).append(disk)
+                break
+
+    return pools
+
+
+def _boot_pool_guid(disks: list[Disk]) -> str | None:
+    for disk in disks:
+        for zfs_member in disk.zfs_members:
+            if zfs_member.pool == BOOT_POOL and zfs_member.pool_guid is not None:
+                return zfs_member.pool_guid
+
+
+async def upgrade(disks: list[Disk], sql: str | None, callback: Callable, dry_run: bool = False):
+    """
+    Installs the system into a new boot environment of the existing boot pool on `disks` and activates it. The boot
+    environment that was active before remains available as a rollback target, and its configuration is carried over
+    to the new one.
+    """
+    if not disks:
+        raise InstallError("No existing boot pool found")
+
+    if missing := [disk.name for disk in disks if not _boot_pools([disk])]:
+        raise InstallError(f"Disk(s) {', '.join(missing)} do not contain an existing boot pool")
+
+    if len(_boot_pools(disks)) > 1:
+        raise InstallError(f"Disk(s) {', '.join(disk.name for disk in disks)} contain different boot pools")
+
+    plan = upgrade_plan(disks, sql, callback)
+
+    if dry_run:
+        for line in plan.describe():
+            callback(0, line)
+        return
+
+    with installation_lock:
+        outcome = "failure"
+        try:
+            with tracer.recording(), tracer.span("upgrade", "upgrade"):
+                await plan.run()
+
+            outcome = "success"
+        except asyncio.CancelledError:
+            outcome = "aborted"
+            raise
+        except subprocess.CalledProcessError as e:
+            raise InstallError(f"Command {' '.join(e.cmd)} failed:\n{e.stderr.rstrip()}")
+        finally:
+            operations.inc("upgrade", outcome)
+            disk_inventory.invalidate()
+            try:
+                tracer.dump()
+            except OSError:
+                pass
+
+
+def upgrade_plan(disks: list[Disk], sql: str | None, callback: Callable) -> Plan:
+    plan = Plan()
+    media = InstallMedia(stager=media_stager)
+    state = {"old_root": None, "boot_environments": []}
+
+    plan.add("check_media", functools.partial(to_thread, media.check))
+    plan.add("verify_media", functools.partial(media.verify, callback), bounded=False)
+    plan.add("mount_media", media.mount, requires=["check_media"])
+
+    async def import_pool():
+        callback(0, "Importing boot pool")
+        await import_boot_pool(_boot_pool_guid(disks))
+
+    plan.add("import_boot_pool", import_pool)
+
+    async def mount_old_root():
+        bootfs = (await run(["zpool", "get", "-H", "-o", "value", "bootfs", BOOT_POOL])).stdout.strip()
+        if bootfs in ("", "-"):
+            raise InstallError("Existing boot pool does not have an active boot environment")
+
+        state["boot_environments"] = await list_boot_environments()
+        state["old_root"] = await mount_dataset(bootfs)
+        return bootfs
+
+    plan.add("mount_old_root", mount_old_root, requires=["import_boot_pool"])
+
+    async def install_image():
+        await run_installer(
+            [disk.name for disk in disks],
+            None,
+            None,
+            sql,
+            media.mountpoint,
+            callback,
+            old_root=state["old_root"],
+        )
+
+    plan.add("install_image", install_image, requires=["verify_media", "mount_media", "mount_old_root"])
+
+    async def activate():
+        bootfs = (await run(["zpool", "get", "-H", "-o", "value", "bootfs", BOOT_POOL])).stdout.strip()
+        if bootfs != plan.results["mount_old_root"]:
+            # The installer has already activated the new boot environment
+            return bootfs
+
+        new = [dataset for dataset in await list_boot_environments() if dataset not in state["boot_environments"]]
+        if len(new) != 1:
+            raise InstallError("Unable to find the new boot environment")
+
+        callback(1, f"Activating boot environment {new[0]}")
+        await run(["zpool", "set", f"bootfs={new[0]}", BOOT_POOL])
+        return new[0]
+
+    plan.add("activate", activate, requires=["install_image"])
+
+    async def unmount_old_root():
+        await unmount_dataset(state["old_root"])
+
+    plan.add("unmount_old_root", unmount_old_root, requires=["mount_old_root"], after=["activate"])
+    plan.add("unmount_media", media.unmount, requires=["mount_media"], after=["install_image"])
+
+    async def export_pool():
+        await run(["zpool", "export", "-f", BOOT_POOL])
+
+    plan.add("export_boot_pool", export_pool, requires=["import_boot_pool"], after=["unmount_old_root", "activate"])
+
+    return plan
+
+
+async def import_boot_pool(pool_guid: str | None = None):
+    """
+    Imports the boot pool, by its GUID if it is known (so that stale boot pools on other disks do not make the name
+    ambiguous).
+    """
+    if (await run(["zpool", "list", "-H", "-o", "name", BOOT_POOL], check=False)).returncode == 0:
+        return
+
+    await run(["zpool", "import", "-f", "-N", "-o", "cachefile=none", pool_guid or BOOT_POOL])
+
+
+async def list_boot_environments() -> list[str]:
+    return [
+        dataset
+        for dataset in (await run(["zfs", "list", "-H", "-o", "name", "-d", "1", f"{BOOT_POOL}/ROOT"])).stdout.split()
+        if dataset != f"{BOOT_POOL}/ROOT"
+    ]
+
+
+async def mount_dataset(dataset: str) -> str:
+    mountpoint = (await run(["zfs", "get", "-H", "-o", "value", "mountpoint", dataset])).stdout.strip()
+
+    path = tempfile.mkdtemp()
+    try:
+        # Datasets that are not `mountpoint=legacy` can only be mounted with `zfsutil`
+        await run(["mount", "-t", "zfs", "-o", "ro" if mountpoint == "legacy" else "ro,zfsutil", dataset, path])
+    except Exception:
+        os.rmdir(path)
+        raise
+
+    return path
+
+
+async def unmount_dataset(path: str):
+    await run(["umount", "-f", path])
+    os.rmdir(path)
@@ -1,11 +1,23 @@
 import asyncio
 import os
 import subprocess
+import time
+from typing import Callable
 
-__all__ = ["GiB", "get_partitions", "run"]
+from .gpt import reread_partition_table
+from .metrics import subprocess_duration, subprocesses
+from .trace import tracer
+from .uevent import UeventMonitor
+
+__all__ = ["GiB", "get_partitions", "run", "run_lines", "terminate", "to_thread"]
 
 GiB = 1024 ** 3
 MAX_PARTITION_WAIT_TIME_SECS = 300
+# How long a cancelled command has to exit after SIGTERM before it is killed
+TERMINATE_TIMEOUT = 10
+
+# Records or replays the commands executed by `run` (see `cassette`)
+interceptor = None
 
 
 async def get_partitions(
@@ -17,7 +29,7 @@ async def get_partitions(
     `device`: str (i.e. /dev/sda, /dev/nvme0n1)
     `partitions`: list of integers (i.e. [1, 2, 3])
     `tries`: None or int, defaults to None, if provided, will
-        sleep up to that time waiting on all `partitions` for `device`
+        wait up to that many seconds for all `partitions` for `device`
         to appear in sysfs. Maximum of `MAX_PARTITION_WAIT_TIME_SECS`.
     """
     if not isinstance(tries, int) or tries < 2:
@@ -25,40 +37,47 @@ async def get_partitions(
     else:
         tries = min(tries, MAX_PARTITION_WAIT_TIME_SECS)
 
-    # by the time this function is called, partitions should have been
-    # written to the disk. However, it doesn't mean the kernel/udev has
-    # updated the various symlinks in sysfs. We'll open the block device
-    # in write mode. This should send a kernel and udev change event for
-    # the device and any partitions as well. Ideally, this will help bubble
-    # up the events so sysfs is populated before the logic below kicks in
-    with open(device, 'w'):
-        pass
+    # Subscribe to kernel uevents before poking the device so that we do not
+    # miss the events for partitions that show up in the meantime. Without
+    # netlink access we fall back to polling sysfs once a second.
+    try:
+        monitor = UeventMonitor("block")
+    except OSError:
+        monitor = None
 
-    disk_partitions = {i: None for i in partitions}
-    device = device.removeprefix('/dev/')
-    for _try in range(tries):
-        if all((disk_partitions[i] is not None for i in disk_partitions)):
-            # all partitions were found on disk
-            return disk_partitions
+    try:
+        disk_partitions = {i: None for i in partitions}
+        name = device.removeprefix('/dev/')
+        # Usually the partitions are already there (i.e. `write_partition_table`
+        # has just asked the kernel to re-read the partition table). Re-reading
+        # it once again would remove and re-add every partition, and udev would
+        # have to process all of that once again.
+        if not _find_partitions(name, disk_partitions):
+            # by the time this function is called, partitions should have been
+            # written to the disk. However, it doesn't mean the kernel/udev has
+            # updated the various symlinks in sysfs. We'll open the block device
+            # in write mode. This should send a kernel and udev change event for
+            # the device and any partitions as well. We also explicitly ask the
+            # kernel to re-read the partition table so that we do not have to wait
+            # for udev to do that.
+            fd = os.open(device, os.O_RDWR | os.O_CLOEXEC)
+            try:
+                reread_partition_table(fd)
+            except OSError:
+                # EBUSY if some partition is in use, EINVAL for devices that
+                # can't be partitioned. Either way, sysfs is as good as it gets.
+                pass
+            finally:
+                os.close(fd)
 
-        try:
-            with os.scandir(f"/sys/block/{device}") as dir_contents:
-                for partdir in filter(lambda x: x.is_dir() and x.name.startswith(device), dir_contents):
-                    with open(os.path.join(partdir.path, 'partition')) as f:
-                        try:
-                            _part = int(f.read().strip())
-                            if _part in partitions:
-                                # looks like {1: '/dev/sda1', 2: '/dev/nvme0n1p2'}
-                                disk_partitions[_part] = f'/dev/{partdir.name}'
-                        except (OSError, ValueError):
-                            # OSError: [Errno 19] No such device was seen on
-                            # our internal CI/CD infrastructure for reasons
-                            # not understood...
-                            continue
-        except FileNotFoundError:
-            continue
-
-        await asyncio.sleep(1)
+        device = name
+        if monitor is not None:
+            await _wait_for_partitions(monitor, device, disk_partitions, tries)
+        else:
+            await _poll_partitions(device, disk_partitions, tries)
+    finally:
+        if monitor is not None:
+            monitor.close()
 
     empty_parts = {k: v for k, v in disk_partitions.items() if v is None}
     if empty_parts:
@@ -77,15 +96,182 @@ async def get_partitions(
     return disk_partitions
 
 
+async def _wait_for_partitions(monitor: UeventMonitor, device: str, disk_partitions: dict, timeout: float):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not _find_partitions(device, disk_partitions):
+        # Sleep until something happens to the disk or to one of its partitions
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                event = await asyncio.wait_for(monitor.receive(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+            if event is None or f"/{device}/" in event.devpath or event.devpath.endswith(f"/{device}"):
+                break
+        else:
+            return
+
+
+async def _poll_partitions(device: str, disk_partitions: dict, tries: int):
+    for _try in range(tries):
+        if _find_partitions(device, disk_partitions):
+            return
+
+        await asyncio.sleep(1)
+
+
+def _find_partitions(device: str, disk_partitions: dict) -> bool:
+    """
+    Fills `disk_partitions` with the partitions of `device` that are present in sysfs.
+
+    Returns `True` if all of them were found.
+    """
+    try:
+        with os.scandir(f"/sys/block/{device}") as dir_contents:
+            for partdir in filter(lambda x: x.is_dir() and x.name.startswith(device), dir_contents):
+                with open(os.path.join(partdir.path, 'partition')) as f:
+                    try:
+                        _part = int(f.read().strip())
+                        if _part in disk_partitions:
+                            # looks like {1: '/dev/sda1', 2: '/dev/nvme0n1p2'}
+                            disk_partitions[_part] = f'/dev/{partdir.name}'
+                    except (OSError, ValueError):
+                        # OSError: [Errno 19] No such device was seen on
+                        # our internal CI/CD infrastructure for reasons
+                        # not understood...
+                        continue
+    except FileNotFoundError:
+        pass
+
+    return all((disk_partitions[i] is not None for i in disk_partitions))
+
+
 async def run(args, check=True):
+    returncode, stdout, stderr = await _run(args, _execute)
+
+    if check:
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args, stdout, stderr)
+
+    return subprocess.CompletedProcess(args, returncode, stdout, stderr)
+
+
+async def run_lines(args, on_line: Callable[[str], None], input: bytes = b"", cwd: str | None = None) -> int:
+    """
+    Runs a command that reports its progress: `input` is written to its stdin and `on_line` is called with every line
+    it writes (stdout and stderr are merged) as soon as it is written. Returns the exit code.
+
+    Like `run`, it is recorded and replayed by cassettes (only the arguments are matched, not `input`). Replayed lines
+    are all passed to `on_line` once the recorded command has finished.
+    """
+    executed = False
+
+    async def execute(args):
+        nonlocal executed
+        executed = True
+        return await _execute_lines(args, on_line, input, cwd)
+
+    returncode, stdout, stderr = await _run(args, execute)
+    if not executed:
+        for line in stdout.splitlines(keepends=True):
+            on_line(line)
+
+    return returncode
+
+
+async def terminate(process: asyncio.subprocess.Process, timeout: float = TERMINATE_TIMEOUT):
+    """
+    Stops the process (SIGTERM, then SIGKILL if it does not exit within `timeout` seconds) and waits for it.
+    """
+    if process.returncode is not None:
+        return
+
+    try:
+        process.terminate()
+    except ProcessLookupError:
+        pass
+
+    try:
+        await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+        await process.wait()
+
+
+async def to_thread(fn, *args, **kwargs):
+    """
+    Same as `asyncio.to_thread`, but when cancelled, waits for `fn` to return before the cancellation propagates:
+    a thread can not be interrupted, and aborting the installation must not leave it writing to the disks.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(fn, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        while not future.done():
+            try:
+                await asyncio.wait([future])
+            except asyncio.CancelledError:
+                pass
+
+        raise
+
+
+async def _run(args, execute):
+    command = os.path.basename(args[0])
+    start = time.perf_counter()
+    outcome = "cancelled"
+    try:
+        with tracer.span(command, "subprocess", args=" ".join(args)) as span_args:
+            if interceptor is not None:
+                returncode, stdout, stderr = await interceptor(args, execute)
+            else:
+                returncode, stdout, stderr = await execute(args)
+            span_args["returncode"] = returncode
+        outcome = "success" if returncode == 0 else "failure"
+    finally:
+        subprocesses.inc(command, outcome)
+        subprocess_duration.observe(time.perf_counter() - start, command)
+
+    return returncode, stdout, stderr
+
+
+async def _execute(args):
     process = await asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = await process.communicate()
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # Aborting the installation must not leave the command running
+        await terminate(process)
+        raise
 
-    stdout = stdout.decode("utf-8", "ignore")
-    stderr = stderr.decode("utf-8", "ignore")
+    return process.returncode, stdout.decode("utf-8", "ignore"), stderr.decode("utf-8", "ignore")
 
-    if check:
-        if process.returncode != 0:
-            raise subprocess.CalledProcessError(process.returncode, args, stdout, stderr)
 
-    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+async def _execute_lines(args, on_line, input, cwd):
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        cwd=cwd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    process.stdin.write(input)
+    process.stdin.close()
+    stdout = []
+    try:
+        while line := await process.stdout.readline():
+            line = line.decode("utf-8", "ignore")
+            stdout.append(line)
+            on_line(line)
+
+        await process.wait()
+    except BaseException:
+        await terminate(process)
+        raise
+
+    return process.returncode, "".join(stdout), ""
@@ -0,0 +1,148 @@
+import fcntl
+import os
+import stat
+import struct
+from typing import Callable
+
+from .disks import Disk
+from .utils import to_thread
+
+__all__ = ["wipe_disk"]
+
+BLKDISCARD = 0x1277
+BLKSSZGET = 0x1268
+BLKZEROOUT = 0x127f
+BLKRRPART = 0x125f
+
+ZFS_LABEL_SIZE = 256 * 1024
+# The first two ZFS labels (L0 and L1) occupy the first 512 KiB of a vdev. That also covers the MBR, the primary GPT
+# (34 sectors or 6 4Kn sectors) and all the signatures wipefs knows about at the start of a device: xfs (0),
+# LVM2 (512), ext2/3/4 (1 KiB), swap (page size - 10), MD RAID 1.1/1.2 (0 and 4 KiB), iso9660 (32 KiB),
+# btrfs (64 KiB).
+HEAD_SIZE = 2 * ZFS_LABEL_SIZE
+# The last two ZFS labels (L2 and L3) occupy the last 512 KiB of a vdev (its size is rounded down to 256 KiB first).
+# That also covers the backup GPT and MD RAID 0.90 (last 64 KiB-aligned 64 KiB) and 1.0 (8 KiB from the end)
+# superblocks.
+TAIL_SIZE = 2 * ZFS_LABEL_SIZE
+
+ZERO_CHUNK_SIZE = 1024 * 1024
+
+
+async def wipe_disk(disk: Disk, callback: Callable, discard: bool = False):
+    """
+    Removes the partition table, ZFS labels and filesystem signatures from the disk and all of its partitions.
+
+    With `discard`, the whole device is discarded first (which, on SSDs, is a fast way to erase all the data).
+    """
+    for warning in await to_thread(_wipe, disk.device, discard):
+        callback(0, f"Warning: {warning}")
+
+
+def signature_ranges(offset: int, size: int) -> list[tuple[int, int]]:
+    """
+    Returns `(start, end)` byte ranges that contain signatures for a device (or a partition) at `offset` of `size`
+    bytes.
+    """
+    aligned_size = size // ZFS_LABEL_SIZE * ZFS_LABEL_SIZE
+    return [
+        (offset, offset + min(HEAD_SIZE, size)),
+        (offset + max(aligned_size - TAIL_SIZE, 0), offset + size),
+    ]
+
+
+def _wipe(device: str, discard: bool) -> list[str]:
+    name = device.removeprefix("/dev/")
+    warnings = []
+
+    try:
+        fd = os.open(device, os.O_RDWR | os.O_CLOEXEC)
+    except OSError as e:
+        return [f"unable to open {name}: {e.strerror}"]
+
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+        is_block_device = stat.S_ISBLK(os.fstat(fd).st_mode)
+
+        if discard:
+            if is_block_device:
+                try:
+                    fcntl.ioctl(fd, BLKDISCARD, struct.pack("QQ", 0, size))
+                except OSError as e:
+                    warnings.append(f"unable to discard {name}: {e.strerror}")
+            else:
+                warnings.append(f"unable to discard {name}: not a block device")
+
+        ranges = signature_ranges(0, size)
+        for part_offset, part_size in _partitions(name):
+            ranges.extend(signature_ranges(part_offset, part_size))
+
+        if is_block_device:
+            block_size = struct.unpack("i", fcntl.ioctl(fd, BLKSSZGET, b"\0" * 4))[0]
+        else:
+            block_size = 512
+
+        for start, end in _merge(ranges, block_size, size):
+            try:
+                _zero(fd, start, end, is_block_device)
+            except OSError as e:
+                warnings.append(f"unable to wipe {name} at offset {start}: {e.strerror}")
+
+        os.fsync(fd)
+
+        if is_block_device:
+            try:
+                # Let the kernel forget about the partitions that no longer exist
+                fcntl.ioctl(fd, BLKRRPART)
+            except OSError as e:
+                warnings.append(f"unable to re-read partition table for {name}: {e.strerror}")
+    finally:
+        os.close(fd)
+
+    return warnings
+
+
+def _partitions(name: str) -> list[tuple[int, int]]:
+    partitions = []
+    try:
+        with os.scandir(f"/sys/class/block/{name}") as dir_contents:
+            for entry in dir_contents:
+                if not entry.name.startswith(name):
+                    continue
+
+                try:
+                    with open(os.path.join(entry.path, "start")) as f:
+                        start = int(f.read())
+                    with open(os.path.join(entry.path, "size")) as f:
+                        size = int(f.read())
+                except (OSError, ValueError):
+                    continue
+
+                # sysfs always uses 512 byte sectors
+                partitions.append((start * 512, size * 512))
+    except FileNotFoundError:
+        pass
+
+    return partitions
+
+
+def _merge(ranges: list[tuple[int, int]], block_size: int, size: int) -> list[tuple[int, int]]:
+    merged = []
+    for start, end in sorted(ranges):
+        start = start // block_size * block_size
+        end = min(-(-end // block_size) * block_size, size)
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def _zero(fd: int, start: int, end: int, is_block_device: bool):
+    if is_block_device:
+        fcntl.ioctl(fd, BLKZEROOUT, struct.pack("QQ", start, end - start))
+        return
+
+    zeroes = bytes(min(ZERO_CHUNK_SIZE, end - start))
+    while start < end:
+        start += os.pwrite(fd, zeroes[:end - start], start)
@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+import os
+import struct
+
+from .nvlist import NVListError, unpack_nvlist
+
+__all__ = ["VdevLabel", "read_vdev_label"]
+
+LABEL_SIZE = 256 * 1024
+NVLIST_OFFSET = 16 * 1024
+NVLIST_SIZE = 112 * 1024
+UBERBLOCKS_OFFSET = 128 * 1024
+UBERBLOCKS_SIZE = 128 * 1024
+UBERBLOCK_MAGIC = 0x00bab10c
+# Uberblock slots are `1 << ashift` bytes, but never smaller than 1 KiB or larger than 8 KiB
+MIN_UBERBLOCK_SHIFT = 10
+MAX_UBERBLOCK_SHIFT = 13
+# magic, version, txg, guid_sum, timestamp
+UBERBLOCK = struct.Struct("QQQQQ")
+
+
+@dataclass
+class VdevLabel:
+    pool: str
+    pool_guid: int
+    guid: int
+    # Of the most recent uberblock (falls back to the txg the label was written at)
+    txg: int
+    timestamp: int | None
+    hostid: int | None
+    hostname: str | None
+    state: int | None
+    vdev_tree: dict
+    # How many of the four labels are intact
+    labels: int
+
+
+def read_vdev_label(path: str) -> VdevLabel | None:
+    """
+    Reads the four vdev labels of the ZFS pool member at `path` (a partition or a whole disk) the way `zdb -l` does,
+    without importing the pool.
+
+    Returns `None` if the device can not be read or does not contain a valid label.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    except OSError:
+        return None
+
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END) // LABEL_SIZE * LABEL_SIZE
+        if size < 4 * LABEL_SIZE:
+            return None
+
+        labels = []
+        for offset in [0, LABEL_SIZE, size - 2 * LABEL_SIZE, size - LABEL_SIZE]:
+            try:
+                data = os.pread(fd, LABEL_SIZE, offset)
+            except OSError:
+                continue
+
+            if (label := _parse_label(data)) is not None:
+                labels.append(label)
+    finally:
+        os.close(fd)
+
+    if not labels:
+        return None
+
+    # Labels are updated one at a time, the one written last is the most accurate
+    config, _ = max(labels, key=lambda label: label[0].get("txg", 0))
+    uberblocks = [uberblock for label, uberblock in labels if uberblock and label["pool_guid"] == config["pool_guid"]]
+    txg, timestamp = max(uberblocks, default=(config.get("txg", 0), None))
+
+    return VdevLabel(
+        config.get("name", ""),
+        config["pool_guid"],
+        config.get("guid", 0),
+        txg,
+        timestamp,
+        config.get("hostid"),
+        config.get("hostname"),
+        config.get("state"),
+        config.get("vdev_tree", {}),
+        len(labels),
+    )
+
+
+def _parse_label(data: bytes):
+    try:
+        config = unpack_nvlist(data[NVLIST_OFFSET:NVLIST_OFFSET + NVLIST_SIZE])
+    except NVListError:
+        return None
+
+    # Spares and L2ARC devices have labels too, but they do not belong to a pool
+    if not isinstance(config.get("pool_guid"), int):
+        return None
+
+    ashift = config.get("vdev_tree", {}).get("ashift", MIN_UBERBLOCK_SHIFT)
+    slot = 1 << min(max(ashift, MIN_UBERBLOCK_SHIFT), MAX_UBERBLOCK_SHIFT)
+
+    uberblock = None
+    for offset in range(UBERBLOCKS_OFFSET, UBERBLOCKS_OFFSET + UBERBLOCKS_SIZE, slot):
+        for byteorder in "<>":
+            magic, _, txg, _, timestamp = struct.unpack_from(byteorder + UBERBLOCK.format, data, offset)
+            if magic == UBERBLOCK_MAGIC:
+                if uberblock is None or txg > uberblock[0]:
+                    uberblock = (txg, timestamp)
+                break
+
+    return config, uberblock